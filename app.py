@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
-from flask import Flask, redirect, url_for, request, session, flash
+from flask import Flask, redirect, url_for, request, session, flash, g, abort, jsonify
+from flask import before_render_template, template_rendered
 from flask_wtf.csrf import CSRFProtect
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
+from time import perf_counter
+import json
 import os
 
 # Extensions
-from config.mongo import init_mongo, load_db_config
+from config.mongo import init_mongo, load_db_config, mongo_status, apply_db_config, sync_config
+from utils import metrics, timing, profiler, assets, compress
 
 # Blueprints
 from service.users import bp as users_bp
@@ -15,6 +20,7 @@ from service.tokens import bp as tokens_bp
 from service.files import bp as files_bp
 from service.balances import bp as balances_bp
 from service.auth import bp as auth_bp
+from service.api import bp as api_bp
 
 
 def home():
@@ -35,6 +41,14 @@ def create_app():
     )
 
     app.secret_key = os.getenv("SECRET_KEY", "super-secret")
+
+    # Di belakang reverse proxy: remote_addr (bucket throttle login per IP) dan
+    # scheme diambil dari X-Forwarded-* sebanyak PROXY_FIX_HOPS proxy tepercaya.
+    # Tanpa ini semua klien berbagi IP proxy. Jangan diset kalau app diakses
+    # langsung: header X-Forwarded-For bisa dipalsukan klien.
+    proxy_hops = int(os.getenv("PROXY_FIX_HOPS", "0"))
+    if proxy_hops > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops, x_proto=proxy_hops, x_host=proxy_hops)
     
     # Initialize CSRF Protection
     csrf = CSRFProtect(app)
@@ -49,8 +63,7 @@ def create_app():
 
     # Load config Mongo dari JSON
     cfg = load_db_config()
-    app.config["MONGO_URI"] = cfg["MONGO_URI"]
-    app.config["MONGO_DB"] = cfg["MONGO_DB"]
+    apply_db_config(app, cfg)
     app.config["USERS_COL"] = os.getenv("USERS_COL", "users")
     app.config["CATS_COL"] = os.getenv("CATS_COL", "agentcategories")
 
@@ -68,6 +81,59 @@ def create_app():
     app.register_blueprint(tokens_bp)
     app.register_blueprint(files_bp)
     app.register_blueprint(balances_bp)
+    app.register_blueprint(api_bp)
+
+    # Asset statis ber-fingerprint (/assets/...) + asset_url() untuk template
+    assets.init_app(app)
+
+    # Latency & status per endpoint untuk /metrics, plus Server-Timing
+    # (mongo / compute / render) untuk response admin
+    timing_log = os.getenv("TIMING_LOG", "false").lower() == "true"
+    before_render_template.connect(timing.render_started, app)
+    template_rendered.connect(timing.render_finished, app)
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_t0 = perf_counter()
+        g._timing_token = timing.begin()
+        metrics.request_started()
+
+    @app.after_request
+    def _metrics_status(resp):
+        g._metrics_status = resp.status_code
+        t = timing.current()
+        if t is not None and (request.path or "").startswith("/admin-klg/"):
+            b = t.breakdown()
+            resp.headers["Server-Timing"] = timing.server_timing_header(b)
+            resp.headers["X-Mongo-Round-Trips"] = str(b["round_trips"])
+            resp.headers["X-Mongo-Docs"] = str(b["docs"])
+            if timing_log:
+                app.logger.info(json.dumps({
+                    "event": "request_timing",
+                    "endpoint": request.endpoint,
+                    "status": resp.status_code,
+                    **{k: round(v, 1) if isinstance(v, float) else v for k, v in b.items()},
+                }))
+        return resp
+
+    @app.teardown_request
+    def _metrics_finish(exc):
+        token = g.pop("_timing_token", None)
+        if token is not None:
+            timing.end(token)
+        t0 = g.pop("_metrics_t0", None)
+        if t0 is not None:
+            metrics.request_finished(
+                request.endpoint or "unmatched",
+                request.method,
+                g.pop("_metrics_status", 500),
+                perf_counter() - t0,
+            )
+
+    # Worker lain bisa mengubah db_config.json (Settings > Apply)
+    @app.before_request
+    def _sync_db_config():
+        sync_config(app)
 
     # Proteksi semua route /admin/* wajib login
     @app.before_request
@@ -78,7 +144,10 @@ def create_app():
             path.startswith("/login")
             or path.startswith("/_dev/hash")
             or path.startswith("/static/")
+            or path.startswith("/assets/")
             or path == "/favicon.ico"
+            or path == "/health"
+            or path == "/metrics"
             or path == "/"
         )
         if allowed:
@@ -86,24 +155,72 @@ def create_app():
         # jika akses /admin/* tapi belum login -> redirect ke /login?next=<path>
         if path.startswith("/admin-klg/admin/") and not session.get("logged_in"):
             return redirect(url_for("auth.login", next=path))
-        
+        # API JSON: jangan redirect ke halaman login, cukup 401
+        if path.startswith("/admin-klg/api/") and not session.get("logged_in"):
+            return jsonify({"error": "Authentication required"}), 401
+
+    # Profiler on-demand (hanya admin yang sudah login, lihat Settings > Profiles)
+    @app.before_request
+    def _profile_start():
+        path = request.path or ""
+        if (
+            path.startswith("/admin-klg/admin/")
+            and session.get("logged_in")
+            and not path.startswith("/admin-klg/admin/settings/profiles")
+            and profiler.requested(request)
+        ):
+            g._profile = profiler.start()
+
+    @app.teardown_request
+    def _profile_stop(exc):
+        state = g.pop("_profile", None)
+        if state is not None:
+            try:
+                name = profiler.stop(state, request.endpoint, request.full_path, g.get("_metrics_status"))
+                app.logger.info(f"[Profiler] Saved profile {name}")
+            except Exception as e:
+                app.logger.error(f"[Profiler] Failed to save profile: {e}")
+
     
     @app.after_request
     def add_no_cache(resp):
         p = request.path or ""
-        if p.startswith("/admin-klg/admin/"):
+        if p.startswith("/admin-klg/admin/") or p.startswith("/admin-klg/api/"):
             resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
             resp.headers["Pragma"] = "no-cache"
             resp.headers["Expires"] = "0"
         return resp
 
+    # Gzip HTML/JSON admin sesuai Accept-Encoding
+    @app.after_request
+    def compress_admin(resp):
+        p = request.path or ""
+        if p.startswith("/admin-klg/"):
+            compress.gzip_response(resp, request.accept_encodings)
+        return resp
+
+    # Status Mongo (cached, tanpa network) untuk banner di base.html
+    @app.context_processor
+    def inject_mongo_status():
+        return {"mongo_status": mongo_status()}
+
     # Route home
     app.add_url_rule("/", "home", home)
 
     # Health check endpoint
     @app.route('/health')
     def health_check():
-        return {'status': 'healthy'}, 200
+        status = mongo_status()
+        return {'status': 'healthy', 'mongo': 'up' if status["up"] else 'down',
+                'mongo_primary': 'up' if status["primary"] else 'down'}, 200
+
+    # Prometheus scrape endpoint (opsional dilindungi METRICS_TOKEN)
+    @app.route('/metrics')
+    def metrics_endpoint():
+        token = os.getenv("METRICS_TOKEN")
+        if token and request.headers.get("Authorization") != f"Bearer {token}":
+            abort(401)
+        return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
 
     return app
 
@@ -0,0 +1,78 @@
+# config/indexes.py
+# Index yang dibutuhkan query dashboard, per collection. LibreChat sudah
+# membuat sebagian (mis. users.email, messages.messageId); create_index()
+# idempotent, dan key yang sama dengan nama lain dilewati. Index sort
+# diakhiri _id: API v1 memakai keyset (field, _id), dan prefix-nya tetap
+# melayani sort satu field di halaman lama.
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+INDEXES = {
+    "users": [
+        ([("email", ASCENDING), ("_id", ASCENDING)], "klg_email"),
+        ([("name", ASCENDING), ("_id", ASCENDING)], "klg_name"),
+        ([("role", ASCENDING), ("_id", ASCENDING)], "klg_role"),
+    ],
+    "messages": [
+        # admin_tokens: filter isCreatedByUser (+ model) dan rentang createdAt
+        ([("isCreatedByUser", ASCENDING), ("createdAt", ASCENDING)], "klg_createdByUser_createdAt"),
+        ([("isCreatedByUser", ASCENDING), ("model", ASCENDING), ("createdAt", ASCENDING)],
+         "klg_createdByUser_model_createdAt"),
+        ([("user", ASCENDING), ("createdAt", ASCENDING)], "klg_user_createdAt"),
+        # lookup parent message per batch
+        ([("messageId", ASCENDING)], "klg_messageId"),
+    ],
+    "conversations": [
+        ([("files", ASCENDING)], "klg_files"),
+    ],
+    "agents": [
+        ([("id", ASCENDING)], "klg_id"),
+        ([("tool_resources.file_search.file_ids", ASCENDING)], "klg_file_search_ids"),
+    ],
+    "files": [
+        ([("createdAt", DESCENDING), ("_id", DESCENDING)], "klg_createdAt"),
+        ([("user", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)], "klg_user_createdAt"),
+        ([("filename", ASCENDING), ("_id", ASCENDING)], "klg_filename"),
+        ([("type", ASCENDING), ("_id", ASCENDING)], "klg_type"),
+        ([("bytes", ASCENDING), ("_id", ASCENDING)], "klg_bytes"),
+    ],
+    "balances": [
+        ([("user", ASCENDING)], "klg_user"),
+        ([("tokenCredits", DESCENDING), ("_id", DESCENDING)], "klg_tokenCredits"),
+        ([("lastRefill", DESCENDING), ("_id", DESCENDING)], "klg_lastRefill"),
+    ],
+    "agentcategories": [
+        ([("order", ASCENDING), ("_id", ASCENDING)], "klg_order"),
+    ],
+}
+
+
+def _key(items) -> tuple:
+    # Index buatan mongoose kadang menyimpan arah sebagai 1.0
+    return tuple((k, int(v) if isinstance(v, (int, float)) else v) for k, v in items)
+
+
+def ensure_indexes(db, log=print) -> dict:
+    """Create the dashboard index set; returns {collection: [created or existing names]}."""
+    done = {}
+    for coll, specs in INDEXES.items():
+        current = list(db[coll].list_indexes())
+        existing = {_key(ix["key"].items()): ix["name"] for ix in current}
+        by_name = {ix["name"]: _key(ix["key"].items()) for ix in current}
+        names = []
+        for keys, name in specs:
+            same = existing.get(_key(keys))
+            if same:
+                names.append(same)
+                continue
+            if name in by_name:
+                # Definisi index berubah: buat ulang (drop + create)
+                db[coll].drop_index(name)
+                log(f"[Indexes] {coll}.{name} key changed, recreating")
+            try:
+                names.append(db[coll].create_index(keys, name=name))
+                log(f"[Indexes] {coll}.{name} created")
+            except OperationFailure as e:
+                log(f"[Indexes] {coll}.{name} failed: {e}")
+        done[coll] = names
+    return done
@@ -1,11 +1,256 @@
-from flask import current_app
-from pymongo import MongoClient, errors
-import json, os
+from flask import current_app, g, request, has_request_context
+from collections import deque
+from functools import wraps
+from pymongo import MongoClient, errors, monitoring
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+import pymongo
+import json, os, threading, time
+from datetime import datetime, timedelta
+
+from utils import metrics, slowlog, timing
 
 CONFIG_FILE = os.path.join("config", "db_config.json")
 
+# Circuit breaker: setelah koneksi gagal, get_db() langsung return None
+# selama window backoff, sementara thread background mencoba ping ulang.
+BREAKER_BACKOFF_MIN = float(os.getenv("MONGO_BREAKER_BACKOFF", "2"))
+BREAKER_BACKOFF_MAX = float(os.getenv("MONGO_BREAKER_BACKOFF_MAX", "60"))
+
 _client = None
 _db = None
+_target = (None, None)  # (uri, dbname) yang sedang dipakai
+_lock = threading.RLock()
+# Hanya satu thread yang boleh membuat client baru (worker gthread)
+_connect_lock = threading.Lock()
+_sync_lock = threading.Lock()
+# "up" = ada server yang bisa melayani read analitik (secondaryPreferred);
+# "primary" terpisah: saat election read analitik tetap jalan, hanya request
+# yang butuh primary (write, blueprint non-analitik) yang fail fast
+_breaker = {
+    "up": False,
+    "primary": False,
+    "since": None,
+    "last_error": None,
+    "failures": 0,
+    "backoff": BREAKER_BACKOFF_MIN,
+    "open_until": 0.0,
+}
+_probe_thread = None
+
+# Ring buffer latency ping (ms) yang diisi thread background
+LATENCY_SAMPLE_INTERVAL = float(os.getenv("MONGO_LATENCY_INTERVAL", "15"))
+LATENCY_RING_SIZE = int(os.getenv("MONGO_LATENCY_RING", "240"))
+_latency_samples = deque(maxlen=LATENCY_RING_SIZE)  # (epoch, ms)
+_sampler_thread = None
+
+# Propagasi config antar worker gunicorn: stat() db_config.json paling sering
+# sekali per interval, dan baru dibaca ulang kalau mtime-nya berubah. Worker
+# hanya reconnect kalau "APPLIED_GENERATION" naik (tombol Apply); Save saja
+# tidak mengubah koneksi yang berjalan.
+CONFIG_CHECK_INTERVAL = float(os.getenv("MONGO_CONFIG_CHECK_INTERVAL", "5"))
+# true = init_mongo tidak connect (di-set gunicorn.conf.py untuk preload_app)
+MONGO_LAZY_CONNECT = os.getenv("MONGO_LAZY_CONNECT", "false").lower() == "true"
+_config_seen = {"mtime": None, "checked_at": 0.0, "generation": None}
+
+# Budget waktu per endpoint (ms), override lewat "QUERY_BUDGETS_MS" di db_config.json.
+# Key = endpoint Flask (mis. "tokens.admin_tokens"); "export" dipakai saat ?export=...
+DEFAULT_QUERY_BUDGETS_MS = {"default": 15000, "export": 120000}
+
+# Read routing: GET pada blueprint analitik dibaca dari secondary (kalau ada),
+# semua write/POST tetap ke primary. Override lewat "READ_ROUTING" di db_config.json.
+# "balances" sengaja tidak ikut: GET setelah edit_balance harus melihat
+# tokenCredits yang baru (dan count-nya di-cache), bukan secondary yang tertinggal.
+DEFAULT_READ_ROUTING = {
+    "analytics_blueprints": ["tokens", "files", "api"],
+    "read_preference": "secondaryPreferred",
+    "max_staleness_s": 120,
+}
+# Data yang dibaca dari secondary bisa tertinggal sampai max_staleness_s; cache
+# jangka panjang untuk rentang "sudah lewat" baru boleh setelah lag + margin ini.
+# Tanpa batas staleness (max_staleness_s <= 0) dipakai batas konservatif.
+READ_SETTLE_MARGIN_S = float(os.getenv("MONGO_READ_SETTLE_MARGIN_S", "60"))
+UNBOUNDED_STALENESS_S = float(os.getenv("MONGO_UNBOUNDED_STALENESS_S", "3600"))
+_READ_MODES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondaryPreferred": SecondaryPreferred,
+    "secondary": Secondary,
+    "nearest": Nearest,
+}
+_analytics_pref = None  # (routing, ReadPreference) yang sudah di-build
+
+
+class _TopologyHealth(monitoring.TopologyListener):
+    """Trip/close the breaker from pymongo's own server monitoring."""
+
+    def opened(self, event):
+        pass
+
+    def description_changed(self, event):
+        # Listener dipakai semua client; client lama yang di-close (reload)
+        # juga mengirim readable -> Unknown, jadi hanya client aktif yang dihitung
+        with _lock:
+            client = _client
+        if client is None or event.topology_id != _topology_id(client):
+            return
+        was_up = event.previous_description.has_readable_server(_ANY_MEMBER)
+        is_up = event.new_description.has_readable_server(_ANY_MEMBER)
+        if was_up and not is_up:
+            _trip("no readable server in topology")
+        elif is_up and not was_up:
+            _mark_up()
+        with _lock:
+            _breaker["primary"] = event.new_description.has_readable_server()
+
+    def closed(self, event):
+        pass
+
+
+_topology_listener = _TopologyHealth()
+_ANY_MEMBER = SecondaryPreferred()
+
+
+def _topology_id(client):
+    topology = getattr(client, "_topology", None)
+    return getattr(topology, "_topology_id", None)
+
+
+def _make_client(uri: str) -> MongoClient:
+    return MongoClient(
+        uri,
+        serverSelectionTimeoutMS=3000,
+        event_listeners=[
+            _topology_listener,
+            metrics.command_listener,
+            slowlog.listener,
+            timing.command_listener,
+        ],
+    )
+
+
+def _mark_up():
+    with _lock:
+        if not _breaker["up"]:
+            _breaker["since"] = time.time()
+        _breaker.update(up=True, primary=_has_primary(_client), last_error=None, failures=0,
+                        backoff=BREAKER_BACKOFF_MIN, open_until=0.0)
+
+
+def _has_primary(client) -> bool:
+    if not isinstance(client, MongoClient):
+        return client is not None  # client pengganti (mis. test) tanpa topology pymongo
+    return client._topology.description.has_readable_server()
+
+
+def _trip(err):
+    """Open the breaker and make sure a background probe is running."""
+    global _probe_thread
+    with _lock:
+        if _breaker["up"] or _breaker["since"] is None:
+            _breaker["since"] = time.time()
+        _breaker["up"] = False
+        _breaker["last_error"] = str(err)[:200]
+        _breaker["failures"] += 1
+        _breaker["open_until"] = time.monotonic() + _breaker["backoff"]
+        if _probe_thread is None or not _probe_thread.is_alive():
+            _probe_thread = threading.Thread(target=_probe_loop, name="mongo-probe", daemon=True)
+            _probe_thread.start()
+
+
+def _probe_loop():
+    """Ping the target with exponential backoff until it answers."""
+    global _client, _db
+    while True:
+        with _lock:
+            if _breaker["up"]:
+                return
+            wait = _breaker["open_until"] - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+        with _lock:
+            client = _client
+            uri, dbname = _target
+        fresh = client is None
+        try:
+            if fresh:
+                client = _make_client(uri)
+            client.admin.command("ping", read_preference=_ANY_MEMBER)
+        except errors.PyMongoError as e:
+            if fresh and client is not None:
+                client.close()
+            with _lock:
+                _breaker["backoff"] = min(_breaker["backoff"] * 2, BREAKER_BACKOFF_MAX)
+                _breaker["open_until"] = time.monotonic() + _breaker["backoff"]
+                _breaker["last_error"] = str(e)[:200]
+            continue
+
+        with _lock:
+            if _target != (uri, dbname):
+                # Target berubah (reload) selama probe -> probe target baru
+                if fresh:
+                    client.close()
+                continue
+            _client, _db = client, client[dbname]
+        _mark_up()
+        return
+
+
+def _reset_after_fork():
+    """Forget the parent's client, locks and threads in a new worker.
+
+    With preload_app the app (and possibly a MongoClient) is created in the
+    gunicorn master; MongoClient is not fork-safe and threads don't survive
+    fork(), so each worker starts from a clean breaker and reconnects lazily
+    to the inherited _target on its first get_db().
+    """
+    global _client, _db, _lock, _connect_lock, _sync_lock, _probe_thread, _sampler_thread
+    _lock = threading.RLock()
+    _connect_lock = threading.Lock()
+    _sync_lock = threading.Lock()
+    _client, _db = None, None
+    _probe_thread, _sampler_thread = None, None
+    _breaker.update(up=False, primary=False, since=None, last_error=None, failures=0,
+                    backoff=BREAKER_BACKOFF_MIN, open_until=0.0)
+    _latency_samples.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _close_later(client, delay: float = 30.0):
+    """Close a replaced client once in-flight requests had time to finish."""
+    if client is None:
+        return
+    t = threading.Timer(delay, client.close)
+    t.daemon = True
+    t.start()
+
+
+def _connect(uri: str, dbname: str):
+    """Connect + ping; on failure trip the breaker and re-raise."""
+    global _client, _db, _target
+    with _lock:
+        _target = (uri, dbname)
+    client = None
+    try:
+        client = _make_client(uri)
+        # Secondary cukup: saat election client tetap dibuat untuk read analitik
+        client.admin.command("ping", read_preference=_ANY_MEMBER)
+    except errors.PyMongoError as e:
+        if client is not None:
+            client.close()
+        with _lock:
+            _client, _db = None, None
+        _trip(e)
+        raise
+    with _lock:
+        old = _client
+        _client, _db = client, client[dbname]
+    if old is not client:
+        _close_later(old)
+    _mark_up()
+
 
 def load_db_config():
     if os.path.exists(CONFIG_FILE):
@@ -20,9 +265,73 @@ def _load_from_json():
             return cfg.get("MONGO_URI"), cfg.get("MONGO_DB")
     return "mongodb://localhost:27017/", "LibreChat"  # fallback default
 
-def init_mongo(app):
-    global _client, _db
+def _config_mtime():
+    try:
+        return os.stat(CONFIG_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+def apply_db_config(app, cfg: dict):
+    """Copy db_config.json settings into app.config."""
+    app.config["MONGO_URI"] = cfg.get("MONGO_URI") or app.config.get("MONGO_URI")
+    app.config["MONGO_DB"] = cfg.get("MONGO_DB") or app.config.get("MONGO_DB")
+    app.config["QUERY_BUDGETS_MS"] = {**DEFAULT_QUERY_BUDGETS_MS, **(cfg.get("QUERY_BUDGETS_MS") or {})}
+    app.config["READ_ROUTING"] = {**DEFAULT_READ_ROUTING, **(cfg.get("READ_ROUTING") or {})}
+    # "TYPES_NORMALIZED": true di db_config.json setelah scripts.normalize_types
+    # melaporkan 0 dokumen tersisa: query memakai satu tipe per field
+    # (isCreatedByUser bool, messages.user string, balances/files.user ObjectId)
+    # dan equality tunggal, bukan $in/$or lintas tipe.
+    app.config["TYPES_NORMALIZED"] = bool(cfg.get("TYPES_NORMALIZED"))
+    _config_seen["generation"] = cfg.get("APPLIED_GENERATION", 0)
+    _config_seen["mtime"] = _config_mtime()
+    _config_seen["checked_at"] = time.monotonic()
+
+def sync_config(app):
+    """Reconnect this worker if another one applied a new db_config.json.
+
+    Cheap enough for before_request: at most one stat() per
+    CONFIG_CHECK_INTERVAL, and the file is only parsed when its mtime moved.
+    """
+    now = time.monotonic()
+    if now - _config_seen["checked_at"] < CONFIG_CHECK_INTERVAL:
+        return
+    # Thread lain di worker ini sedang mengecek -> tidak perlu ikut
+    if not _sync_lock.acquire(blocking=False):
+        return
+    try:
+        _config_seen["checked_at"] = now
+        _sync_config(app)
+    finally:
+        _sync_lock.release()
+
+def _sync_config(app):
+    mtime = _config_mtime()
+    if mtime is None or mtime == _config_seen["mtime"]:
+        return
+    try:
+        cfg = load_db_config()
+    except (OSError, ValueError) as e:
+        # Kemungkinan file sedang ditulis; coba lagi di window berikutnya
+        app.logger.warning(f"[Mongo] Config changed but unreadable: {e}")
+        return
+    if not isinstance(cfg, dict):
+        return
 
+    if cfg.get("APPLIED_GENERATION", 0) == _config_seen["generation"]:
+        # Save tanpa Apply (atau edit manual): setting lain ikut, target
+        # koneksi tetap yang sedang dipakai worker ini
+        apply_db_config(app, {**cfg, "MONGO_URI": app.config.get("MONGO_URI"),
+                              "MONGO_DB": app.config.get("MONGO_DB")})
+        return
+    old_target = (app.config.get("MONGO_URI"), app.config.get("MONGO_DB"))
+    apply_db_config(app, cfg)
+    new_target = (app.config["MONGO_URI"], app.config["MONGO_DB"])
+    if new_target != old_target or new_target != _target:
+        app.logger.info(f"[Mongo] Config applied on disk, reconnecting worker {os.getpid()}")
+        reload_mongo(app, *new_target)
+
+def init_mongo(app):
+    global _target
     uri = app.config.get("MONGO_URI")
     dbname = app.config.get("MONGO_DB")
 
@@ -31,42 +340,205 @@ def init_mongo(app):
         app.config["MONGO_URI"] = uri
         app.config["MONGO_DB"] = dbname
 
+    if MONGO_LAZY_CONNECT:
+        # preload_app: app dibuat di master gunicorn. Jangan buka MongoClient /
+        # thread sampler di sana (master memegangnya seumur hidup dan fork
+        # dengan client hidup); tiap worker connect di post_worker_init.
+        with _lock:
+            _target = (uri, dbname)
+        app.logger.info(f"[Mongo] Lazy connect to {uri}, db={dbname} (per worker)")
+        return
+
     try:
-        _client = MongoClient(uri, serverSelectionTimeoutMS=3000)
-        _client.admin.command("ping")
-        _db = _client[dbname]
+        _connect(uri, dbname)
         app.logger.info(f"[Mongo] Connected to {uri}, db={dbname}")
-    except errors.ServerSelectionTimeoutError as e:
+    except errors.PyMongoError as e:
         app.logger.warning(f"[Mongo] Could not connect to {uri}, db={dbname}: {e}")
-        _client, _db = None, None
+    start_latency_sampler()
 
 def get_db():
-    global _client, _db
-    if _db is None:
-        try:
+    # Breaker terbuka -> fail fast, jangan tunggu serverSelectionTimeoutMS
+    if not _breaker["up"] and _breaker["since"] is not None:
+        return None
+    if _db is not None:
+        if not _breaker["primary"] and _needs_primary():
+            return None  # election: hanya read yang di-route ke secondary jalan
+        return _db
+
+    with _connect_lock:
+        # Thread lain mungkin sudah connect (atau gagal) selama kita menunggu
+        if _db is not None:
+            return _db
+        if not _breaker["up"] and _breaker["since"] is not None:
+            return None
+        uri, dbname = _target
+        if not uri or not dbname:
             uri, dbname = _load_from_json()
-            client = MongoClient(uri, serverSelectionTimeoutMS=3000)
-            client.admin.command("ping")
-            return client[dbname]
-        except errors.ServerSelectionTimeoutError:
+        try:
+            _connect(uri, dbname)
+        except errors.PyMongoError:
             return None
+    start_latency_sampler()
     return _db
 
+def analytics_read_preference(routing: dict):
+    """Build (and memoize) the ReadPreference for analytical reads."""
+    global _analytics_pref
+    if _analytics_pref is not None and _analytics_pref[0] == routing:
+        return _analytics_pref[1]
+    mode = routing.get("read_preference", "secondaryPreferred")
+    staleness = int(routing.get("max_staleness_s") or -1)
+    if 0 < staleness < 90:
+        staleness = 90  # minimum yang diterima MongoDB
+    if mode == "primary":
+        pref = Primary()
+    else:
+        pref = _READ_MODES.get(mode, SecondaryPreferred)(max_staleness=staleness)
+    _analytics_pref = (dict(routing), pref)
+    return pref
+
+def settled_before() -> datetime:
+    """UTC cutoff: data created before it is safe to cache long-term from this request's reads.
+
+    Reads routed to a secondary may lag by up to max_staleness_s, so a
+    range only counts as closed once that lag plus READ_SETTLE_MARGIN_S has
+    passed since its end. Outside a request the default routing is assumed.
+    """
+    lag = READ_SETTLE_MARGIN_S
+    pref = _routed_read_preference() if has_request_context() else analytics_read_preference(DEFAULT_READ_ROUTING)
+    if pref is not None and pref.mode:
+        staleness = getattr(pref, "max_staleness", -1)
+        lag += staleness if staleness > 0 else UNBOUNDED_STALENESS_S
+    return datetime.utcnow() - timedelta(seconds=lag)
+
+def _needs_primary() -> bool:
+    """True if the current request's Mongo calls go to the primary."""
+    return has_request_context() and _routed_read_preference() is None
+
+def _routed_read_preference():
+    """Read preference for the current request, or None for the primary."""
+    if not has_request_context() or request.method not in ("GET", "HEAD"):
+        return None
+    routing = current_app.config.get("READ_ROUTING") or DEFAULT_READ_ROUTING
+    if request.blueprint not in (routing.get("analytics_blueprints") or []):
+        return None
+    return analytics_read_preference(routing)
+
 def get_col(name: str):
     db = get_db()
     if db is None:
         return None
+    pref = _routed_read_preference()
+    if pref is not None:
+        return db[name].with_options(read_preference=pref)
     return db[name]
 
+def read_routing_table(app) -> list:
+    """[(blueprint, reads, writes)] describing the active routing."""
+    routing = app.config.get("READ_ROUTING") or DEFAULT_READ_ROUTING
+    analytics = set(routing.get("analytics_blueprints") or [])
+    pref = analytics_read_preference(routing)
+    label = pref.mongos_mode if pref.mode else "primary"
+    if getattr(pref, "max_staleness", -1) > 0:
+        label += f" (maxStaleness {pref.max_staleness}s)"
+    rows = []
+    for name in sorted(app.blueprints):
+        rows.append((name, label if name in analytics else "primary", "primary"))
+    return rows
+
+def is_mongo_up() -> bool:
+    """Cached up/down state; never touches the network."""
+    return bool(_breaker["up"])
+
+def mongo_status() -> dict:
+    """Snapshot of the breaker state for health checks and templates."""
+    with _lock:
+        retry_in = max(_breaker["open_until"] - time.monotonic(), 0.0)
+        return {
+            "up": _breaker["up"],
+            "primary": _breaker["up"] and _breaker["primary"],
+            "since": _breaker["since"],
+            "last_error": _breaker["last_error"],
+            "failures": _breaker["failures"],
+            "retry_in": 0.0 if _breaker["up"] else round(retry_in, 1),
+        }
+
+def ping_ms(client=None) -> float:
+    """One ping round trip on the pooled client, in milliseconds."""
+    client = client or _client
+    if client is None:
+        raise errors.ConnectionFailure("MongoDB client not initialised")
+    t0 = time.perf_counter()
+    client.admin.command("ping")
+    return (time.perf_counter() - t0) * 1000
+
+def _sampler_loop():
+    while True:
+        time.sleep(LATENCY_SAMPLE_INTERVAL)
+        if not _breaker["up"]:
+            continue
+        try:
+            _latency_samples.append((time.time(), ping_ms()))
+        except errors.PyMongoError:
+            pass
+
+def start_latency_sampler():
+    global _sampler_thread
+    with _lock:
+        if _sampler_thread is None or not _sampler_thread.is_alive():
+            _sampler_thread = threading.Thread(target=_sampler_loop, name="mongo-latency", daemon=True)
+            _sampler_thread.start()
+
+def latency_history() -> list:
+    """Recent background ping samples as [(epoch, ms)], oldest first."""
+    return list(_latency_samples)
+
 def reload_mongo(app, new_uri: str, new_dbname: str):
-    global _client, _db
     try:
-        _client = MongoClient(new_uri, serverSelectionTimeoutMS=3000)
-        _client.admin.command("ping")
-        _db = _client[new_dbname]
+        _connect(new_uri, new_dbname)
         app.config["MONGO_URI"] = new_uri
         app.config["MONGO_DB"] = new_dbname
         app.logger.info(f"[Mongo] Reloaded to {new_uri}, db={new_dbname}")
-    except errors.ServerSelectionTimeoutError as e:
+    except errors.PyMongoError as e:
         app.logger.warning(f"[Mongo] Reload failed for {new_uri}, db={new_dbname}: {e}")
-        _client, _db = None, None
+
+def query_budget(view):
+    """Run every Mongo call issued by the view under one time budget.
+
+    pymongo.timeout() sets maxTimeMS on each find/aggregate/count from the
+    remaining budget, so a wide query can't outlive the request server-side.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        budgets = current_app.config.get("QUERY_BUDGETS_MS") or DEFAULT_QUERY_BUDGETS_MS
+        if request.args.get("export") and "export" in budgets:
+            ms = budgets["export"]
+        else:
+            ms = budgets.get(request.endpoint, budgets.get("default"))
+        if not ms:
+            return view(*args, **kwargs)
+        g.query_budget_ms = ms
+        g.query_deadline = time.monotonic() + ms / 1000.0
+        with pymongo.timeout(ms / 1000.0):
+            return view(*args, **kwargs)
+    return wrapper
+
+def budget_exceeded(e, tag: str) -> bool:
+    """True if e is a budget timeout; flags the response as truncated.
+
+    Only ExecutionTimeout (maxTimeMS on the server, or pymongo.timeout()
+    refusing to send with too little budget left) and a socket timeout after
+    the request's budget ran out on a live server count. Server selection
+    and other network timeouts are outages and go to the caller's error path.
+    """
+    if isinstance(e, errors.ExecutionTimeout):
+        pass
+    elif isinstance(e, errors.NetworkTimeout):
+        deadline = g.get("query_deadline")
+        if deadline is None or time.monotonic() < deadline or not _breaker["up"]:
+            return False
+    else:
+        return False
+    g.query_truncated = True
+    current_app.logger.warning(f"{tag} Query budget exceeded: {e}")
+    return True
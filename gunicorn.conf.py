@@ -0,0 +1,64 @@
+# gunicorn.conf.py
+# Konfigurasi produksi: worker gthread (N proses x M thread) dengan preload.
+# App dibuat sekali di master lalu di-fork; master tidak membuka MongoClient
+# maupun thread sampler (MONGO_LAZY_CONNECT), state per proses (lock, thread
+# background) di-reset di child lewat os.register_at_fork di masing-masing
+# modul, dan koneksi Mongo dibuka di post_worker_init.
+#
+# Override lewat env: PORT, WEB_CONCURRENCY, GUNICORN_THREADS,
+# GUNICORN_TIMEOUT, GUNICORN_MAX_REQUESTS.
+import glob
+import os
+
+
+def _cpu_count() -> int:
+    # Hormati cpuset/affinity container, bukan jumlah CPU host
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '3000')}"
+
+# I/O-bound (Mongo): sedikit proses, beberapa thread per proses. Export
+# yang lambat hanya memakai satu thread, worker lain tetap melayani.
+workers = int(os.getenv("WEB_CONCURRENCY") or max(2, min(_cpu_count() + 1, 8)))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+
+preload_app = True
+# Dibaca config.mongo saat app di-preload di master (file ini dieksekusi dulu)
+os.environ.setdefault("MONGO_LAZY_CONNECT", "true")
+
+# Heartbeat gthread jalan di thread utama, jadi timeout ini tidak memotong
+# request panjang (budget query export 120 dtk ditangani di config.mongo)
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle worker secara berkala (fragmentasi memori pandas/openpyxl)
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    """Drop metric snapshots left by workers of a previous run."""
+    from utils import metrics
+    paths = glob.glob(os.path.join(metrics.METRICS_DIR, "worker_*.json"))
+    paths.append(os.path.join(metrics.METRICS_DIR, metrics.RETIRED_FILE))
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def post_worker_init(worker):
+    """Open this worker's own MongoClient (and latency sampler) before it accepts requests."""
+    from config.mongo import get_db
+    if get_db() is None:
+        worker.log.warning(f"[Mongo] Worker {worker.pid} started with MongoDB unavailable")
@@ -0,0 +1,188 @@
+# scripts/bench_routes.py
+# Benchmark route admin lewat Flask test client terhadap dataset sintetis
+# (scripts.synth_data): latency, round trip Mongo, dokumen yang dibaca dan
+# peak memory Python per route, disimpan sebagai JSON untuk dibandingkan
+# antar versi.
+#
+#   python -m scripts.synth_data --scale 10k --drop
+#   python -m scripts.bench_routes --db klg_bench --runs 5 --out bench-before.json
+#   python -m scripts.bench_routes --db klg_bench --out bench-after.json --compare bench-before.json
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (nama, path); tanggal mengikuti rentang data sintetis (berakhir 2026-01-01).
+# Tabel/stat halaman tokens dan files dimuat lewat API v1, jadi diukur di sana.
+API = "/admin-klg/api/v1"
+ROUTES = [
+    ("tokens", "/admin-klg/admin/tokens"),
+    ("api_tokens", f"{API}/tokens?limit=10"),
+    ("api_tokens_30d", f"{API}/tokens?date_from=2025-12-01&date_to=2025-12-31&limit=10"),
+    ("api_tokens_year", f"{API}/tokens?date_from=2025-01-01&date_to=2025-12-31&limit=10"),
+    ("api_tokens_search", f"{API}/tokens?q=user0000&limit=10"),
+    ("api_tokens_stats", f"{API}/tokens/stats"),
+    ("tokens_export", "/admin-klg/admin/tokens?export=xlsx"),
+    ("files", "/admin-klg/admin/files"),
+    ("api_files", f"{API}/files?limit=10"),
+    ("api_files_by_user", f"{API}/files?s=user&limit=50"),
+    ("api_files_stats", f"{API}/files/stats"),
+    ("api_files_users", f"{API}/files/users"),
+    ("files_export", "/admin-klg/admin/files?export=1"),
+    ("balances", "/admin-klg/admin/balances"),
+    ("balances_search", "/admin-klg/admin/balances?q=user0001&sort=email"),
+    ("api_balances", f"{API}/balances?limit=10"),
+    ("users", "/admin-klg/admin/users"),
+    ("api_users", f"{API}/users?limit=10"),
+    ("categories", "/admin-klg/admin/categories"),
+]
+
+
+def _git_rev() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _make_client(uri: str, dbname: str, use_cache: bool):
+    from app import create_app
+    from config.mongo import reload_mongo, get_db
+    from utils import cache
+
+    cache.CACHE_ENABLED = use_cache
+    app = create_app()
+    app.config["WTF_CSRF_ENABLED"] = False
+    reload_mongo(app, uri, dbname)
+    if get_db() is None:
+        raise SystemExit(f"Cannot reach MongoDB at {uri}")
+
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["logged_in"] = True
+        s["admin_username"] = "bench"
+    return app, client
+
+
+def _request(client, path: str) -> dict:
+    t0 = time.perf_counter()
+    resp = client.get(path)
+    body = resp.get_data()
+    ms = (time.perf_counter() - t0) * 1000
+    return {
+        "status": resp.status_code,
+        "ms": ms,
+        "round_trips": int(resp.headers.get("X-Mongo-Round-Trips", 0)),
+        "docs": int(resp.headers.get("X-Mongo-Docs", 0)),
+        "bytes": len(body),
+    }
+
+
+def bench_route(client, path: str, runs: int, warmup: int) -> dict:
+    from utils.helper import percentile
+
+    for _ in range(warmup):
+        _request(client, path)
+
+    # Peak memory diukur di run terpisah: tracemalloc memperlambat request
+    tracemalloc.start()
+    mem_run = _request(client, path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    samples = [_request(client, path) for _ in range(runs)]
+    latencies = [s["ms"] for s in samples]
+    return {
+        "path": path,
+        "status": samples[-1]["status"],
+        "runs": runs,
+        "ms_min": min(latencies),
+        "ms_p50": percentile(latencies, 50),
+        "ms_p95": percentile(latencies, 95),
+        "ms_max": max(latencies),
+        "round_trips": mem_run["round_trips"],
+        "docs": mem_run["docs"],
+        "response_bytes": mem_run["bytes"],
+        "peak_mem_mb": peak / (1024 * 1024),
+    }
+
+
+def compare(current: dict, baseline: dict):
+    print(f"\n{'route':18} {'p50 ms':>18} {'round trips':>16} {'peak MB':>16}")
+    for name, cur in current["routes"].items():
+        old = baseline.get("routes", {}).get(name)
+        if not old:
+            print(f"{name:18} {cur['ms_p50']:>8.1f} (new)")
+            continue
+
+        def cell(key, fmt):
+            a, b = old[key], cur[key]
+            delta = f"{(b - a) / a * 100:+.0f}%" if a else "n/a"
+            return f"{format(b, fmt)} {delta:>6}"
+        print(f"{name:18} {cell('ms_p50', '>10.1f'):>18} {cell('round_trips', '>8d'):>16} "
+              f"{cell('peak_mem_mb', '>8.1f'):>16}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Time admin routes against a synthetic dataset")
+    ap.add_argument("--uri", default="mongodb://localhost:27017/")
+    ap.add_argument("--db", default="klg_bench")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--warmup", type=int, default=1)
+    ap.add_argument("--only", nargs="*", help="route names to run (default: all)")
+    ap.add_argument("--with-cache", action="store_true", help="keep the shared result cache enabled")
+    ap.add_argument("--out", help="write results JSON to this file")
+    ap.add_argument("--compare", help="baseline results JSON to diff against")
+    args = ap.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    app, client = _make_client(args.uri, args.db, args.with_cache)
+
+    from config.mongo import get_db
+    db = get_db()
+    dataset = {name: db[name].estimated_document_count()
+               for name in ("users", "agents", "conversations", "messages", "files", "balances", "agentcategories")}
+
+    wanted = set(args.only or [])
+    routes = {}
+    for name, path in ROUTES:
+        if wanted and name not in wanted:
+            continue
+        print(f"{name:18} ...", end=" ", flush=True)
+        routes[name] = bench_route(client, path, max(args.runs, 1), args.warmup)
+        r = routes[name]
+        print(f"p50 {r['ms_p50']:.1f} ms, {r['round_trips']} round trips, {r['docs']} docs, "
+              f"peak {r['peak_mem_mb']:.1f} MB")
+
+    result = {
+        "meta": {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "db": args.db,
+            "cache": args.with_cache,
+            "dataset": dataset,
+        },
+        "routes": routes,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(result, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
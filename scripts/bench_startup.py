@@ -0,0 +1,88 @@
+# scripts/bench_startup.py
+# Benchmark cold start worker: waktu import app + create_app() dan RSS proses
+# setelahnya, diukur di subprocess baru supaya cache import tidak ikut terhitung.
+#
+#   python -m scripts.bench_startup --runs 5
+#   python -m scripts.bench_startup --max-ms 1500 --max-rss-mb 120   # gagal (exit 1) jika regresi
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("pandas", "numpy", "openpyxl")
+
+_CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import app as app_module
+t_import = time.perf_counter()
+if not {with_mongo}:
+    app_module.init_mongo = lambda app: None
+app_module.create_app()
+t_create = time.perf_counter()
+
+rss_kb = 0
+try:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss_kb = int(line.split()[1])
+except OSError:
+    import resource
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+print(json.dumps({{
+    "import_ms": (t_import - t0) * 1000,
+    "create_app_ms": (t_create - t_import) * 1000,
+    "total_ms": (t_create - t0) * 1000,
+    "rss_mb": rss_kb / 1024.0,
+    "heavy_loaded": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+
+def run_once(with_mongo: bool) -> dict:
+    code = _CHILD.format(with_mongo=with_mongo, heavy=HEAVY_MODULES)
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Measure worker cold start (import + create_app) and RSS")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--with-mongo", action="store_true", help="include the initial Mongo connect/ping")
+    ap.add_argument("--max-ms", type=float, help="fail if median total_ms exceeds this")
+    ap.add_argument("--max-rss-mb", type=float, help="fail if median rss_mb exceeds this")
+    ap.add_argument("--out", help="write results JSON to this file")
+    args = ap.parse_args(argv)
+
+    runs = [run_once(args.with_mongo) for _ in range(max(args.runs, 1))]
+    summary = {
+        key: statistics.median(r[key] for r in runs)
+        for key in ("import_ms", "create_app_ms", "total_ms", "rss_mb")
+    }
+    summary["heavy_loaded"] = sorted({m for r in runs for m in r["heavy_loaded"]})
+    result = {"runs": runs, "median": summary, "python": sys.version.split()[0]}
+
+    print(json.dumps(summary, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    failed = False
+    if args.max_ms is not None and summary["total_ms"] > args.max_ms:
+        print(f"FAIL: median cold start {summary['total_ms']:.0f} ms > {args.max_ms:.0f} ms", file=sys.stderr)
+        failed = True
+    if args.max_rss_mb is not None and summary["rss_mb"] > args.max_rss_mb:
+        print(f"FAIL: median RSS {summary['rss_mb']:.1f} MB > {args.max_rss_mb:.1f} MB", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,23 @@
+# scripts/build_assets.py
+# Build static/dist: nama file ber-hash + varian .gz/.br + manifest.json.
+# Dijalankan di image Docker (lihat dockerfile); di dev opsional, tanpa build
+# template memakai /static biasa.
+#
+#   python -m scripts.build_assets
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main(argv=None):
+    sys.path.insert(0, ROOT)
+    from utils.assets import build
+
+    manifest = build()
+    print(f"{len(manifest)} assets fingerprinted")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
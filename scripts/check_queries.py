@@ -0,0 +1,235 @@
+# scripts/check_queries.py
+# Regression check per route admin: (1) jumlah round trip Mongo per request
+# punya batas atas dan TIDAK tumbuh dengan per_page (menangkap pola N+1 seperti
+# find_one per baris), (2) tiap query yang memfilter/sort memakai index
+# (bukan COLLSCAN) setelah index set dari config.indexes dipasang.
+#
+# Butuh mongod lokal berisi dataset sintetis:
+#   python -m scripts.synth_data --scale 10k --drop
+#   python -m scripts.check_queries --db klg_bench --apply-indexes
+# Exit code 1 jika ada pelanggaran.
+import argparse
+import json
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from pymongo import monitoring
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _token_trips(fixed: int, date_from: str, date_to: str = None):
+    """Limit for the partitioned token rollup: fixed + 2 per partition (messages, parents)."""
+    def limit():
+        from service.tokens import _partitions
+        start = datetime.strptime(date_from, "%Y-%m-%d")
+        if date_to:
+            end = datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1)
+        else:
+            end = datetime.combine(datetime.utcnow().date(), datetime.min.time()) + timedelta(days=1)
+        return fixed + 2 * len(_partitions(start, end))
+    return limit
+
+
+def _sketch_trips(fixed: int, date_from: str):
+    """Limit for a HyperLogLog distinct (utils.hll, cache off): fixed + 1 aggregate per month."""
+    def limit():
+        from utils.hll import _months
+        start = datetime.strptime(date_from, "%Y-%m-%d")
+        end = datetime.combine(datetime.utcnow().date(), datetime.min.time()) + timedelta(days=1)
+        return fixed + len(_months(start, end))
+    return limit
+
+
+# (nama, path, batas round trip). Route ber-pagination dijalankan dengan
+# per_page/limit kecil dan besar; jumlah round trip harus sama. Halaman tokens
+# dan files hanya shell; tabel dan stat-nya diukur lewat API v1. Rollup tokens
+# dipartisi per bulan/minggu (service.tokens._partitions), jadi batasnya per
+# partisi: agents + users (+ pesan paling lama, + partisi tanpa createdAt
+# sampai 3 query, + lookup email) lalu 2 per partisi: pesan + lookup parent
+# per batch TOKEN_BATCH_SIZE (dataset 10k = satu batch per partisi). Distinct
+# user (files/stats, tokens/stats) = dokumen paling lama + satu aggregate
+# sketch harian per bulan (utils.hll). Dataset sintetis mulai 2025-01-01.
+API = "/admin-klg/api/v1"
+SYNTH_START = "2025-01-01"
+ROUTES = [
+    ("tokens", "/admin-klg/admin/tokens", 1),
+    ("api_tokens", f"{API}/tokens", _token_trips(6, SYNTH_START)),
+    ("api_tokens_search", f"{API}/tokens?q=user0000", _token_trips(7, SYNTH_START)),
+    ("api_tokens_30d", f"{API}/tokens?date_from=2025-12-01&date_to=2025-12-31",
+     _token_trips(2, "2025-12-01", "2025-12-31")),
+    ("api_tokens_year", f"{API}/tokens?date_from=2025-01-01&date_to=2025-12-31",
+     _token_trips(2, "2025-01-01", "2025-12-31")),
+    ("api_tokens_stats", f"{API}/tokens/stats", _sketch_trips(1, SYNTH_START)),
+    ("files", "/admin-klg/admin/files", 0),
+    ("api_files", f"{API}/files", 5),
+    ("api_files_by_user_sort", f"{API}/files?s=user", 5),
+    ("api_files_by_size", f"{API}/files?s=bytes&o=asc", 5),
+    ("api_files_stats", f"{API}/files/stats", _sketch_trips(3, SYNTH_START)),
+    ("api_files_users", f"{API}/files/users", 2),
+    ("balances", "/admin-klg/admin/balances", 3),
+    ("balances_search", "/admin-klg/admin/balances?q=user0001", 4),
+    ("api_balances", f"{API}/balances", 2),
+    ("api_balances_search", f"{API}/balances?q=user0001", 3),
+    ("users", "/admin-klg/admin/users", 2),
+    ("users_by_name", "/admin-klg/admin/users?sort=name", 2),
+    ("api_users", f"{API}/users?sort=name", 1),
+    ("categories", "/admin-klg/admin/categories", 1),
+    ("api_categories", f"{API}/categories", 1),
+]
+PER_PAGE = (5, 100)
+
+IGNORED = {"getMore", "killCursors", "endSessions", "ping", "hello", "isMaster", "ismaster",
+           "listIndexes", "explain", "buildInfo", "saslStart", "saslContinue"}
+PLANNED = {"find", "aggregate", "count", "distinct"}
+
+
+class Capture(monitoring.CommandListener):
+    """Collect the commands issued while capturing (any thread)."""
+
+    def __init__(self):
+        self.active = False
+        self.commands = []
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if self.active and event.command_name not in IGNORED:
+            with self._lock:
+                self.commands.append((event.command_name, event.database_name, dict(event.command)))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def run(self, fn):
+        with self._lock:
+            self.commands = []
+        self.active = True
+        try:
+            fn()
+        finally:
+            self.active = False
+        with self._lock:
+            return list(self.commands)
+
+
+def _needs_index(name: str, cmd: dict) -> bool:
+    """Only filtered or sorted reads must use an index; full reads are reported."""
+    if name == "find":
+        return bool(cmd.get("filter")) or bool(cmd.get("sort"))
+    if name in ("count", "distinct"):
+        return bool(cmd.get("query"))
+    if name == "aggregate":
+        pipeline = cmd.get("pipeline") or []
+        first = pipeline[0] if pipeline else {}
+        return bool(first.get("$match")) or "$sort" in first
+    return False
+
+
+def _with_per_page(path: str, per_page: int) -> str:
+    param = "limit" if path.startswith(API) else "per_page"
+    return f"{path}{'&' if '?' in path else '?'}{param}={per_page}"
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Check Mongo round trips and query plans per admin route")
+    ap.add_argument("--uri", default="mongodb://localhost:27017/")
+    ap.add_argument("--db", default="klg_bench")
+    ap.add_argument("--apply-indexes", action="store_true", help="create the config.indexes set first")
+    ap.add_argument("--skip-plans", action="store_true", help="only check round trips")
+    ap.add_argument("--out", help="write a JSON report to this file")
+    args = ap.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+
+    # Listener global harus terdaftar sebelum MongoClient dibuat
+    capture = Capture()
+    monitoring.register(capture)
+
+    from app import create_app
+    from config.mongo import reload_mongo, get_db
+    from config.indexes import ensure_indexes
+    from utils import cache, slowlog
+
+    cache.CACHE_ENABLED = False  # yang diukur query-nya, bukan cache
+    app = create_app()
+    reload_mongo(app, args.uri, args.db)
+    db = get_db()
+    if db is None:
+        print(f"Cannot reach MongoDB at {args.uri}", file=sys.stderr)
+        return 2
+    if args.apply_indexes:
+        ensure_indexes(db)
+
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s["logged_in"] = True
+        s["admin_username"] = "check"
+
+    failures = []
+    report = {}
+    explained = {}
+    for name, path, limit in ROUTES:
+        limit = limit() if callable(limit) else limit
+        counts = {}
+        captured = []
+        for per_page in PER_PAGE:
+            url = _with_per_page(path, per_page)
+            status = []
+            cmds = capture.run(lambda: status.append(client.get(url).status_code))
+            counts[per_page] = len(cmds)
+            captured.extend(cmds)
+            if status[0] != 200:
+                failures.append(f"{name}: HTTP {status[0]} for {url}")
+
+        small, large = (counts[p] for p in PER_PAGE)
+        line = f"{name:20} round trips {small:>3} (per_page={PER_PAGE[0]}) / {large:>3} (per_page={PER_PAGE[1]}), limit {limit}"
+        if large != small:
+            failures.append(f"{name}: round trips grow with per_page ({small} -> {large})")
+        if max(small, large) > limit:
+            failures.append(f"{name}: {max(small, large)} round trips > limit {limit}")
+        print(line)
+
+        plans = []
+        if not args.skip_plans:
+            for cmd_name, dbname, cmd in captured:
+                if cmd_name not in PLANNED:
+                    continue
+                coll = cmd.get(cmd_name)
+                shape = slowlog.command_shape(cmd_name, cmd)
+                key = f"{coll}.{cmd_name} {json.dumps(shape, sort_keys=True, default=str)}"
+                if key in explained:
+                    continue
+                if not _needs_index(cmd_name, cmd):
+                    explained[key] = {"plan": "full read (unfiltered)", "collscan": False}
+                    continue
+                summary = slowlog.explain_command(db.client, dbname, cmd)
+                explained[key] = summary
+                plans.append({"shape": key, **summary})
+                if summary.get("error"):
+                    failures.append(f"{name}: explain failed for {key}: {summary['error']}")
+                elif summary.get("collscan"):
+                    failures.append(f"{name}: COLLSCAN for {key} ({summary['plan']})")
+                print(f"    {summary.get('plan', summary.get('error')):60} {key[:100]}")
+        report[name] = {"path": path, "limit": limit, "round_trips": counts, "plans": plans}
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"routes": report, "failures": failures}, f, indent=2, default=str)
+
+    if failures:
+        print("\nFAIL", file=sys.stderr)
+        for f in failures:
+            print(f"  {f}", file=sys.stderr)
+        return 1
+    print("\nOK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+# scripts/normalize_types.py
+# Migrasi in-place untuk field LibreChat bertipe campuran, supaya query
+# dashboard cukup equality satu tipe (satu key index) dan bisa menyalakan
+# "TYPES_NORMALIZED": true di db_config.json:
+#
+#   messages.isCreatedByUser  "false"/"False"/0/"true"/1 -> bool
+#   messages.user             ObjectId                   -> string (skema Message)
+#   balances.user, files.user string hex 24              -> ObjectId (ref User)
+#
+# Per batch: ambil _id berikutnya (urut _id, index default), lalu satu
+# bulk_write dengan write concern majority (secondary ikut terkejar) dan jeda
+# --pause. Posisi terakhir per field disimpan di --state, jadi run yang
+# dihentikan (Ctrl+C, budget --max-batches) lanjut dari sana. Setiap run
+# diakhiri laporan jumlah dokumen yang masih perlu dimigrasi.
+#
+#   python -m scripts.normalize_types --report
+#   python -m scripts.normalize_types --batch-size 500 --pause 0.2
+#   python -m scripts.normalize_types --only messages.user --restart
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+from bson import ObjectId, json_util
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from pymongo.write_concern import WriteConcern
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_STATE = os.path.join(ROOT, "config", "normalize_state.json")
+
+USER_FLAG_VALUES = ["true", "True", "TRUE", 1]
+ASSISTANT_FLAG_VALUES = ["false", "False", "FALSE", 0]
+
+
+def _to_bool(value):
+    return value in USER_FLAG_VALUES
+
+
+def _to_str(value):
+    return str(value)
+
+
+def _to_oid(value):
+    return ObjectId(value) if ObjectId.is_valid(value) else None
+
+
+# (collection, field, filter dokumen yang masih perlu dimigrasi, konversi).
+# Konversi yang mengembalikan None = tidak bisa dimigrasi (dilewati, dilaporkan)
+FIELDS = [
+    ("messages", "isCreatedByUser",
+     {"isCreatedByUser": {"$in": USER_FLAG_VALUES + ASSISTANT_FLAG_VALUES, "$not": {"$type": "bool"}}},
+     _to_bool),
+    ("messages", "user", {"user": {"$type": "objectId"}}, _to_str),
+    ("balances", "user", {"user": {"$type": "string"}}, _to_oid),
+    ("files", "user", {"user": {"$type": "string"}}, _to_oid),
+]
+
+
+def _load_state(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json_util.loads(f.read())
+    except FileNotFoundError:
+        return {}
+
+
+def _save_state(path: str, state: dict):
+    # Tulis atomik: state tidak rusak kalau proses dihentikan di tengah
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(json_util.dumps(state, indent=2))
+    os.replace(tmp, path)
+
+
+def _state_key(args, col: str, field: str) -> str:
+    # URI di-hash: bisa berisi kredensial
+    target = hashlib.sha1(args.uri.encode("utf-8")).hexdigest()[:12]
+    return f"{target}|{args.db}|{col}.{field}"
+
+
+def migrate_field(db, col_name: str, field: str, query: dict, convert, args, state: dict) -> dict:
+    """Convert one field batch by batch from the saved position; returns counters."""
+    col = db.get_collection(col_name, write_concern=WriteConcern(w="majority"))
+    key = _state_key(args, col_name, field)
+    last_id = None if args.restart else state.get(key)
+    done = {"updated": 0, "skipped": 0, "batches": 0}
+
+    while args.max_batches is None or done["batches"] < args.max_batches:
+        batch_query = dict(query)
+        if last_id is not None:
+            batch_query["_id"] = {"$gt": last_id}
+        docs = list(col.find(batch_query, {field: 1}).sort("_id", 1).limit(args.batch_size))
+        if not docs:
+            break
+
+        ops = []
+        for doc in docs:
+            old = doc.get(field)
+            new = convert(old)
+            if new is None:
+                done["skipped"] += 1
+                continue
+            # Filter ikut nilai lama: dokumen yang berubah sejak dibaca tidak ditimpa
+            ops.append(UpdateOne({"_id": doc["_id"], field: old}, {"$set": {field: new}}))
+        if ops:
+            try:
+                result = col.bulk_write(ops, ordered=False)
+                done["updated"] += result.modified_count
+            except BulkWriteError as e:
+                done["updated"] += e.details.get("nModified", 0)
+                print(f"  {col_name}.{field}: {len(e.details.get('writeErrors', []))} write errors", file=sys.stderr)
+
+        last_id = docs[-1]["_id"]
+        state[key] = last_id
+        _save_state(args.state, state)
+        done["batches"] += 1
+        print(f"  {col_name}.{field}: {done['updated']:,} updated, {done['skipped']:,} skipped",
+              end="\r", file=sys.stderr, flush=True)
+        if args.pause:
+            time.sleep(args.pause)
+
+    print(file=sys.stderr)
+    if args.max_batches is None or done["batches"] < args.max_batches:
+        # Selesai sampai ujung: run berikutnya mulai lagi dari awal (dokumen
+        # yang sudah benar tidak cocok filter, jadi murah)
+        state.pop(key, None)
+        _save_state(args.state, state)
+    return done
+
+
+def remaining(db, col_name: str, query: dict, convert) -> dict:
+    """{"pending": convertible docs left, "unconvertible": docs the migration skips}."""
+    col = db[col_name]
+    total = col.count_documents(query)
+    unconvertible = 0
+    if convert is _to_oid:
+        # String yang bukan ObjectId tidak pernah cocok dengan user mana pun
+        unconvertible = col.count_documents({**query, "user": {
+            "$type": "string", "$not": {"$regex": "^[0-9a-fA-F]{24}$"}}})
+    return {"pending": total - unconvertible, "unconvertible": unconvertible}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Normalize mixed-type LibreChat fields in place (throttled, resumable)")
+    ap.add_argument("--uri", help="default: MONGO_URI from config/db_config.json")
+    ap.add_argument("--db", help="default: MONGO_DB from config/db_config.json")
+    ap.add_argument("--batch-size", type=int, default=1000)
+    ap.add_argument("--pause", type=float, default=0.1, help="seconds to sleep between batches")
+    ap.add_argument("--max-batches", type=int, help="stop each field after this many batches (resume later)")
+    ap.add_argument("--only", action="append", metavar="COLLECTION.FIELD", help="limit to these fields")
+    ap.add_argument("--state", default=DEFAULT_STATE, help="resume positions (JSON)")
+    ap.add_argument("--restart", action="store_true", help="ignore saved positions")
+    ap.add_argument("--report", action="store_true", help="only count what still needs migrating")
+    args = ap.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    from config.mongo import load_db_config
+
+    cfg = load_db_config()
+    args.uri = args.uri or cfg.get("MONGO_URI")
+    args.db = args.db or cfg.get("MONGO_DB")
+
+    fields = FIELDS
+    if args.only:
+        fields = [f for f in FIELDS if f"{f[0]}.{f[1]}" in args.only]
+        unknown = set(args.only) - {f"{f[0]}.{f[1]}" for f in FIELDS}
+        if unknown:
+            print(f"Unknown fields: {', '.join(sorted(unknown))}", file=sys.stderr)
+            return 2
+
+    client = MongoClient(args.uri, serverSelectionTimeoutMS=3000)
+    db = client[args.db]
+    try:
+        if not args.report:
+            state = _load_state(args.state)
+            t0 = time.perf_counter()
+            for col_name, field, query, convert in fields:
+                done = migrate_field(db, col_name, field, query, convert, args, state)
+                print(f"{col_name + '.' + field:26} updated {done['updated']:>10,}  "
+                      f"skipped {done['skipped']:>8,}  batches {done['batches']:>6,}")
+            print(f"migrated in {time.perf_counter() - t0:.1f}s")
+
+        pending = 0
+        print(f"Remaining in {args.db}:")
+        for col_name, field, query, convert in fields:
+            left = remaining(db, col_name, query, convert)
+            pending += left["pending"]
+            print(f"  {col_name + '.' + field:26} pending {left['pending']:>10,}  "
+                  f"unconvertible {left['unconvertible']:>8,}")
+    except PyMongoError as e:
+        print(f"MongoDB error: {e}", file=sys.stderr)
+        return 2
+    finally:
+        client.close()
+
+    if pending:
+        return 1
+    if len(fields) == len(FIELDS):
+        print('Nothing left to migrate: set "TYPES_NORMALIZED": true in config/db_config.json')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+# scripts/synth_data.py
+# Generator dataset LibreChat sintetis yang deterministik (seed yang sama ->
+# dokumen yang sama) untuk benchmark: users, agents, agentcategories,
+# conversations, messages (rantai parentMessageId user -> assistant), files
+# dan balances. Ditulis ke mongod lokal; JANGAN arahkan ke database produksi.
+#
+#   python -m scripts.synth_data --scale 10k --drop
+#   python -m scripts.synth_data --scale 1m --uri mongodb://localhost:27017/ --db klg_bench
+#   python -m scripts.synth_data --messages 250000 --seed 7
+import argparse
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+SCALES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+BATCH = 10_000
+END_DATE = datetime(2026, 1, 1)
+
+MODELS = ["gpt-4o", "gpt-4o-mini", "gpt-4.1", "claude-3-5-sonnet", "gemini-1.5-pro"]
+FILE_TYPES = [
+    ("application/pdf", "pdf"), ("text/plain", "txt"), ("image/png", "png"),
+    ("application/vnd.openxmlformats-officedocument.wordprocessingml.document", "docx"),
+    ("text/csv", "csv"),
+]
+REFILL_UNITS = ["seconds", "minutes", "hours", "days", "weeks", "months"]
+
+
+def sizes(messages: int) -> dict:
+    """Collection sizes derived from the message count (LibreChat-ish ratios)."""
+    return {
+        "messages": messages,
+        "conversations": max(messages // 10, 1),  # ~5 turn per percakapan
+        "users": max(messages // 100, 50),
+        "files": max(messages // 50, 20),
+        "agents": 20,
+        "agentcategories": 12,
+    }
+
+
+class _Ids:
+    """Deterministic ObjectIds / UUIDs from the seeded RNG."""
+
+    def __init__(self, rnd: random.Random):
+        self.rnd = rnd
+        self.counter = 0
+
+    def oid(self, when: datetime) -> ObjectId:
+        self.counter += 1
+        ts = int(when.timestamp()).to_bytes(4, "big")
+        return ObjectId(ts + self.counter.to_bytes(8, "big"))
+
+    def uuid(self) -> str:
+        return str(uuid.UUID(int=self.rnd.getrandbits(128), version=4))
+
+
+def _insert(col, docs, total: int, label: str):
+    col.insert_many(docs, ordered=False)
+    print(f"  {label}: {total:,}", end="\r", file=sys.stderr, flush=True)
+
+
+def generate(db, messages: int, seed: int = 42, days: int = 365, mixed_types: float = 0.05) -> dict:
+    """Populate db; returns the number of documents written per collection.
+
+    mixed_types is the fraction of documents that use the legacy encodings
+    the dashboard has to tolerate (isCreatedByUser as "false"/0, user as
+    ObjectId in messages or as string in balances).
+    """
+    rnd = random.Random(seed)
+    ids = _Ids(rnd)
+    n = sizes(messages)
+    start = END_DATE - timedelta(days=days)
+    span_s = days * 86400
+
+    def when():
+        return start + timedelta(seconds=rnd.randrange(span_s))
+
+    # Users (sebagian kecil admin)
+    users = []
+    for i in range(n["users"]):
+        created = when()
+        users.append({
+            "_id": ids.oid(created),
+            "name": f"User {i:06d}",
+            "username": f"user{i:06d}",
+            "email": f"user{i:06d}@example.test",
+            "role": "ADMIN" if i % 97 == 0 else "USER",
+            "provider": "local",
+            "emailVerified": True,
+            "createdAt": created,
+            "updatedAt": created,
+        })
+    for i in range(0, len(users), BATCH):
+        _insert(db.users, users[i:i + BATCH], min(i + BATCH, len(users)), "users")
+
+    cats = [{
+        "id": uuid.UUID(int=rnd.getrandbits(128), version=4).hex,
+        "name": f"Category {i}",
+        "slug": f"category-{i}",
+        "value": f"category-{i}",
+        "label": f"category-{i}",
+        "description": f"com_agents_category_category-{i}_description",
+        "order": i,
+        "isActive": True,
+        "custom": i >= 4,
+        "createdAt": start,
+        "updatedAt": start,
+        "__v": 0,
+    } for i in range(n["agentcategories"])]
+    db.agentcategories.insert_many(cats)
+
+    # Files dulu, supaya agents/conversations bisa mereferensikan file_id
+    file_ids = []
+    files = []
+    written = 0
+    for i in range(n["files"]):
+        created = when()
+        mime, ext = rnd.choice(FILE_TYPES)
+        fid = ids.uuid()
+        file_ids.append(fid)
+        files.append({
+            "_id": ids.oid(created),
+            "file_id": fid,
+            "user": rnd.choice(users)["_id"],
+            "filename": f"document-{i:07d}.{ext}",
+            "filepath": f"/uploads/{fid}.{ext}",
+            "type": mime,
+            "bytes": int(rnd.lognormvariate(11, 1.5)),
+            "context": "agents" if i % 3 == 0 else "message_attachment",
+            "usage": 0,
+            "createdAt": created,
+            "updatedAt": created,
+        })
+        if len(files) >= BATCH:
+            written += len(files)
+            _insert(db.files, files, written, "files")
+            files = []
+    if files:
+        written += len(files)
+        _insert(db.files, files, written, "files")
+
+    agents = []
+    for i in range(n["agents"]):
+        attached = rnd.sample(file_ids, min(len(file_ids), rnd.randint(0, 5)))
+        agents.append({
+            "_id": ids.oid(start),
+            "id": f"agent_{ids.uuid().replace('-', '')[:21]}",
+            "name": f"Agent {i:02d}",
+            "model": rnd.choice(MODELS),
+            "provider": "openAI",
+            "category": rnd.choice(cats)["value"],
+            "author": rnd.choice(users)["_id"],
+            "tool_resources": {"file_search": {"file_ids": attached}},
+            "createdAt": start,
+            "updatedAt": start,
+        })
+    db.agents.insert_many(agents)
+
+    # Conversations + messages: tiap turn = pesan user lalu balasan assistant
+    per_convo = max(messages // n["conversations"], 2)
+    convos, msgs = [], []
+    written_c = written_m = 0
+    remaining = messages
+    while remaining > 0:
+        user = rnd.choice(users)
+        agent = rnd.choice(agents) if rnd.random() < 0.6 else None
+        model = agent["id"] if agent else rnd.choice(MODELS)
+        created = when()
+        conv_id = ids.uuid()
+        convo_files = rnd.sample(file_ids, 1) if rnd.random() < 0.1 else []
+        convos.append({
+            "_id": ids.oid(created),
+            "conversationId": conv_id,
+            "user": str(user["_id"]),
+            "endpoint": "agents" if agent else "openAI",
+            "model": agent["model"] if agent else model,
+            "agent_id": agent["id"] if agent else None,
+            "title": f"Conversation {written_c + len(convos):08d}",
+            "files": convo_files,
+            "createdAt": created,
+            "updatedAt": created,
+        })
+
+        parent = "00000000-0000-0000-0000-000000000000"
+        t = created
+        for _ in range(min(per_convo, remaining) // 2 or 1):
+            legacy = rnd.random() < mixed_types
+            user_ref = user["_id"] if legacy else str(user["_id"])
+            q_id, a_id = ids.uuid(), ids.uuid()
+            msgs.append({
+                "messageId": q_id,
+                "conversationId": conv_id,
+                "parentMessageId": parent,
+                "user": user_ref,
+                "isCreatedByUser": True,
+                "sender": "User",
+                "tokenCount": rnd.randint(5, 400),
+                "text": "lorem ipsum",
+                "createdAt": t,
+            })
+            t += timedelta(seconds=rnd.randint(2, 40))
+            msgs.append({
+                "messageId": a_id,
+                "conversationId": conv_id,
+                "parentMessageId": q_id,
+                "user": user_ref,
+                "isCreatedByUser": rnd.choice(["false", 0]) if legacy else False,
+                "sender": agent["name"] if agent else "Assistant",
+                "model": model,
+                "tokenCount": rnd.randint(20, 1500),
+                "text": "dolor sit amet",
+                "createdAt": t,
+            })
+            parent = a_id
+            t += timedelta(seconds=rnd.randint(30, 600))
+            remaining -= 2
+            if remaining <= 0:
+                break
+
+        if len(msgs) >= BATCH:
+            written_m += len(msgs)
+            _insert(db.messages, msgs, written_m, "messages")
+            msgs = []
+        if len(convos) >= BATCH:
+            written_c += len(convos)
+            _insert(db.conversations, convos, written_c, "conversations")
+            convos = []
+    if msgs:
+        written_m += len(msgs)
+        _insert(db.messages, msgs, written_m, "messages")
+    if convos:
+        written_c += len(convos)
+        _insert(db.conversations, convos, written_c, "conversations")
+
+    balances = []
+    for i, u in enumerate(users):
+        legacy = rnd.random() < mixed_types
+        balances.append({
+            "_id": ids.oid(u["createdAt"]),
+            "user": str(u["_id"]) if legacy else u["_id"],
+            "tokenCredits": float(rnd.randint(0, 1_000_000)),
+            "autoRefillEnabled": rnd.random() < 0.3,
+            "refillAmount": rnd.choice([0, 10_000, 50_000]),
+            "refillIntervalUnit": rnd.choice(REFILL_UNITS),
+            "refillIntervalValue": rnd.randint(1, 30),
+            "lastRefill": when(),
+        })
+    for i in range(0, len(balances), BATCH):
+        _insert(db.balances, balances[i:i + BATCH], min(i + BATCH, len(balances)), "balances")
+    print(file=sys.stderr)
+
+    return {
+        "users": len(users),
+        "agentcategories": len(cats),
+        "files": written,
+        "agents": len(agents),
+        "conversations": written_c,
+        "messages": written_m,
+        "balances": len(balances),
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Populate a local mongod with a synthetic LibreChat dataset")
+    ap.add_argument("--uri", default="mongodb://localhost:27017/")
+    ap.add_argument("--db", default="klg_bench")
+    ap.add_argument("--scale", choices=sorted(SCALES), default="10k")
+    ap.add_argument("--messages", type=int, help="exact message count (overrides --scale)")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--days", type=int, default=365, help="spread createdAt over this many days before 2026-01-01")
+    ap.add_argument("--mixed-types", type=float, default=0.05, help="fraction of docs with legacy field types")
+    ap.add_argument("--drop", action="store_true", help="drop the target database first")
+    args = ap.parse_args(argv)
+
+    messages = args.messages or SCALES[args.scale]
+    client = MongoClient(args.uri, serverSelectionTimeoutMS=3000)
+    if args.drop:
+        client.drop_database(args.db)
+    elif client[args.db].messages.estimated_document_count():
+        print(f"Database {args.db} is not empty; use --drop to regenerate", file=sys.stderr)
+        return 1
+
+    t0 = time.perf_counter()
+    counts = generate(client[args.db], messages, seed=args.seed, days=args.days, mixed_types=args.mixed_types)
+    elapsed = time.perf_counter() - t0
+    for name, count in counts.items():
+        print(f"{name:16} {count:>12,}")
+    print(f"generated in {elapsed:.1f}s (seed={args.seed})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,432 @@
+# service/api.py
+# JSON API v1 untuk listing admin: users, balances, files (+ stats, opsi user),
+# tokens (+ seri harian, stats), categories. Dipakai halaman yang merender
+# shell dulu lalu memuat tabel dan stat secara paralel lewat fetch().
+#
+# Konvensi:
+#   ?limit=N             ukuran halaman (1..MAX_LIMIT)
+#   ?cursor=...          opaque; dari "next_cursor" response sebelumnya. Keyset
+#                        (nilai sort + _id terakhir), bukan skip, jadi halaman
+#                        ke-N sama murahnya dengan halaman pertama
+#   ?fields=a,b          kolom yang dikembalikan; lookup untuk kolom yang tidak
+#                        diminta (mis. nama uploader/agent file) dilewati
+# Response: {"data": [...], "next_cursor": str|null, ["partial": true],
+#            ["messages": [{"category", "message"}]]}; error: {"error": "..."}.
+import base64
+import math
+import re
+from datetime import datetime
+
+from bson import ObjectId, json_util
+from bson.decimal128 import Decimal128
+from bson.errors import BSONError
+from flask import Blueprint, jsonify, request, current_app, g, get_flashed_messages
+from pymongo.errors import PyMongoError
+
+from config.mongo import get_col, query_budget, budget_exceeded
+from utils import cache
+from utils.helper import human_bytes
+from service.balances import _user_filter
+from service.files import _build_query, _file_stats, _user_options, _file_rows, _sort_spec
+from service.tokens import (_load_agents, _cached_token_rows, _cached_approx_rollup, _daily_totals,
+                            _active_users, TOKEN_METRICS)
+
+bp = Blueprint("api", __name__, url_prefix="/admin-klg/api/v1")
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+USER_FIELDS = ("id", "email", "name", "role", "createdAt")
+USER_SORTS = ("email", "name", "role")
+BALANCE_FIELDS = ("id", "user_id", "email", "name", "tokenCredits", "autoRefillEnabled",
+                  "refillAmount", "refillIntervalUnit", "refillIntervalValue", "lastRefill")
+BALANCE_SORTS = ("tokenCredits", "lastRefill")
+FILE_FIELDS = ("id", "file_id", "createdAt", "filename", "type", "size", "size_h", "user", "user_id", "agent")
+TOKEN_FIELDS = ("date", "email", "agent_label", "agent_name", "model_label", "total_tokens",
+                "input_tokens", "output_tokens", "total_messages")
+TOKEN_CI_FIELDS = tuple(f"{m}_ci" for m in TOKEN_METRICS)
+CATEGORY_FIELDS = ("id", "name", "value", "label", "description", "order", "isActive", "custom")
+
+
+class ApiError(Exception):
+    """Client error; rendered as {"error": message} with the given status."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+@bp.errorhandler(ApiError)
+def _api_error(e):
+    return jsonify({"error": str(e)}), e.status
+
+
+@bp.errorhandler(PyMongoError)
+def _mongo_error(e):
+    current_app.logger.error(f"[API] Database error on {request.endpoint}: {e}")
+    return jsonify({"error": "Database error"}), 503
+
+
+def _col(name: str):
+    col = get_col(name)
+    if col is None:
+        raise ApiError("Database connection unavailable", 503)
+    return col
+
+
+def _limit() -> int:
+    try:
+        limit = int(request.args.get("limit", DEFAULT_LIMIT))
+    except (ValueError, TypeError):
+        raise ApiError("limit must be an integer")
+    return max(min(limit, MAX_LIMIT), 1)
+
+
+def _fields(allowed) -> list:
+    raw = (request.args.get("fields") or "").strip()
+    if not raw:
+        return list(allowed)
+    wanted = [f.strip() for f in raw.split(",") if f.strip()]
+    unknown = [f for f in wanted if f not in allowed]
+    if unknown:
+        raise ApiError(f"Unknown fields: {', '.join(unknown)} (allowed: {', '.join(allowed)})")
+    return wanted
+
+
+def _choice(name: str, allowed, default: str) -> str:
+    value = request.args.get(name, default)
+    if value not in allowed:
+        raise ApiError(f"{name} must be one of: {', '.join(allowed)}")
+    return value
+
+
+def _encode_cursor(values: list) -> str:
+    raw = json_util.dumps(values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(expect_head: list):
+    """Cursor values after the head (sort spec); None on the first page."""
+    raw = request.args.get("cursor")
+    if not raw:
+        return None
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(raw + "=" * (-len(raw) % 4)))
+    except (ValueError, TypeError, BSONError):
+        raise ApiError("Invalid cursor")
+    n = len(expect_head)
+    if not isinstance(values, list) or values[:n] != expect_head:
+        # Cursor dari sort/filter lain tidak bisa dilanjutkan
+        raise ApiError("Invalid cursor for this sort order")
+    return values[n:]
+
+
+def _after(field: str, direction: int, value, last_id) -> dict:
+    """Filter for documents after (value, _id) in a (field, _id) sort."""
+    op = "$gt" if direction == 1 else "$lt"
+    if value is None:
+        # null/missing di awal urutan asc, di akhir urutan desc
+        if direction == 1:
+            return {"$or": [{field: {"$ne": None}}, {field: None, "_id": {op: last_id}}]}
+        return {field: None, "_id": {op: last_id}}
+    clauses = [{field: {op: value}}, {field: value, "_id": {op: last_id}}]
+    if direction == -1:
+        clauses.append({field: None})
+    return {"$or": clauses}
+
+
+def _keyset_page(col, query: dict, field: str, direction: int, limit: int, projection=None, tag="[API]"):
+    """One page of docs sorted by (field, _id) plus the cursor for the next one."""
+    head = [field, direction]
+    after = _decode_cursor(head)
+    if after is not None:
+        if len(after) != 2:
+            raise ApiError("Invalid cursor")
+        cond = _after(field, direction, after[0], after[1])
+        query = {"$and": [query, cond]} if query else cond
+
+    docs = []
+    try:
+        cur = col.find(query, projection).sort([(field, direction), ("_id", direction)]).limit(limit + 1)
+        for d in cur:
+            docs.append(d)
+    except PyMongoError as e:
+        # Budget habis -> kirim yang sudah terambil, halaman berikut lanjut dari situ
+        if not budget_exceeded(e, tag):
+            raise
+    more = len(docs) > limit or bool(g.get("query_truncated") and docs)
+    docs = docs[:limit]
+    next_cursor = _encode_cursor(head + [docs[-1].get(field), docs[-1]["_id"]]) if more else None
+    return docs, next_cursor
+
+
+def _jsonable(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return float(value.to_decimal())
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def _pick(row: dict, fields) -> dict:
+    return {f: _jsonable(row.get(f)) for f in fields}
+
+
+def _page(data: list, next_cursor=None, **extra):
+    body = {"data": data, "next_cursor": next_cursor, **extra}
+    if g.get("query_truncated"):
+        body["partial"] = True
+    # flash() dari helper bersama diteruskan ke client, bukan ke halaman berikutnya
+    messages = get_flashed_messages(with_categories=True)
+    if messages:
+        body["messages"] = [{"category": c, "message": m} for c, m in messages]
+    return jsonify(body)
+
+
+def _search() -> str:
+    return (request.args.get("q", "") or "").strip()[:100]
+
+
+@bp.get("/users")
+@query_budget
+def users():
+    """Users sorted by email/name/role, optional ?q= email search."""
+    users_col = _col(current_app.config["USERS_COL"])
+    fields = _fields(USER_FIELDS)
+    sort_field = _choice("sort", USER_SORTS, "email")
+    direction = 1 if _choice("dir", ("asc", "desc"), "asc") == "asc" else -1
+    q = _search()
+
+    query = {"email": {"$regex": re.escape(q), "$options": "i"}} if q else {}
+    projection = {f: 1 for f in fields if f != "id"}
+    projection[sort_field] = 1
+    docs, next_cursor = _keyset_page(users_col, query, sort_field, direction, _limit(), projection, "[Users]")
+    return _page([_pick({**d, "id": d["_id"]}, fields) for d in docs], next_cursor)
+
+
+@bp.get("/balances")
+@query_budget
+def balances():
+    """Balances sorted by tokenCredits/lastRefill, optional ?q= email search."""
+    balances_col = _col("balances")
+    users_col = _col(current_app.config["USERS_COL"])
+    fields = _fields(BALANCE_FIELDS)
+    sort_field = _choice("sort", BALANCE_SORTS, "tokenCredits")
+    direction = 1 if _choice("dir", ("asc", "desc"), "desc") == "asc" else -1
+    q = _search()
+
+    query = {}
+    if q:
+        query = _user_filter(users_col, q)
+        if query is None:
+            return _page([])
+
+    docs, next_cursor = _keyset_page(balances_col, query, sort_field, direction, _limit(), tag="[Balances]")
+
+    # Email/nama hanya untuk user di halaman ini (satu $in), bukan map semua user
+    users_by_id = {}
+    if docs and ("email" in fields or "name" in fields):
+        ids = set()
+        for b in docs:
+            raw = b.get("user")
+            if isinstance(raw, ObjectId):
+                ids.add(raw)
+            elif isinstance(raw, str) and ObjectId.is_valid(raw):
+                ids.add(ObjectId(raw))
+        if ids:
+            try:
+                users_by_id = {str(u["_id"]): u for u in users_col.find({"_id": {"$in": list(ids)}}, {"email": 1, "name": 1})}
+            except PyMongoError as e:
+                if not budget_exceeded(e, "[Balances]"):
+                    raise
+
+    data = []
+    for b in docs:
+        user_id = str(b.get("user")) if b.get("user") else None
+        user = users_by_id.get(user_id) or {}
+        try:
+            credits = float(b.get("tokenCredits", 0) or 0)
+        except (ValueError, TypeError):
+            credits = 0.0
+        data.append(_pick({
+            "id": b["_id"],
+            "user_id": user_id,
+            "email": user.get("email"),
+            "name": user.get("name"),
+            "tokenCredits": credits,
+            "autoRefillEnabled": bool(b.get("autoRefillEnabled", False)),
+            "refillAmount": b.get("refillAmount", 0),
+            "refillIntervalUnit": b.get("refillIntervalUnit"),
+            "refillIntervalValue": b.get("refillIntervalValue"),
+            "lastRefill": b.get("lastRefill"),
+        }, fields))
+    return _page(data, next_cursor)
+
+
+def _file_filters():
+    start = (request.args.get("start", "") or "").strip()
+    end = (request.args.get("end", "") or "").strip()
+    user = (request.args.get("user", "") or "").strip()
+    return start, end, user, _build_query(start, end, user)
+
+
+@bp.get("/files")
+@query_budget
+def files():
+    """Files page rows; ?s=createdAt|filename|type|bytes|user&o=asc|desc."""
+    files_col = _col("files")
+    fields = _fields(FILE_FIELDS)
+    sort_key, sort_ord, mongo_sort, sort_dir = _sort_spec(
+        _choice("s", ("createdAt", "filename", "type", "bytes", "user"), "createdAt"),
+        _choice("o", ("asc", "desc"), "desc"),
+    )
+    _, _, _, query = _file_filters()
+
+    docs, next_cursor = _keyset_page(files_col, query, mongo_sort, sort_dir, _limit(), tag="[Files]")
+
+    # Lookup uploader/agent hanya kalau kolomnya diminta
+    want_user = sort_key == "user" or "user" in fields
+    users_col = get_col(current_app.config["USERS_COL"]) if want_user else None
+    agents_col = get_col("agents") if "agent" in fields else None
+    convos_col = get_col("conversations") if "agent" in fields else None
+    rows = _file_rows(docs, users_col, agents_col, convos_col)
+
+    if sort_key == "user":
+        # Sama seperti halaman lama: urut nama uploader di dalam satu halaman
+        rows.sort(key=lambda r: (r["user"] or "").lower(), reverse=(sort_ord == "desc"))
+    return _page([_pick({**r, "id": r["_id"]}, fields) for r in rows], next_cursor)
+
+
+@bp.get("/files/stats")
+@query_budget
+def files_stats():
+    """Totals for the filtered files (shared result cache); total_users is estimated."""
+    files_col = _col("files")
+    start, end, user, query = _file_filters()
+
+    key = cache.make_key(start, end, user)
+    stats = cache.get_or_set("files", key, lambda: _file_stats(files_col, query))
+    return _page([], None, stats={
+        **stats,
+        "total_size_h": human_bytes(stats["total_size_bytes"]),
+    })
+
+
+@bp.get("/files/users")
+@query_budget
+def files_users():
+    """Uploader dropdown options ({_id, name}) for the filtered files."""
+    files_col = _col("files")
+    users_col = get_col(current_app.config["USERS_COL"])
+    start, end, user, query = _file_filters()
+
+    key = cache.make_key("users", start, end, user)
+    options = cache.get_or_set("files", key, lambda: _user_options(files_col, users_col, query))
+    return _page(options, None)
+
+
+def _token_params():
+    """(agent, date_from, date_to, q, approx) from the query string."""
+    selected_agent = (request.args.get("agent", "general") or "general").strip()
+    date_from = (request.args.get("date_from", "") or "").strip()
+    date_to = (request.args.get("date_to", "") or "").strip()
+    approx = (request.args.get("approx") or "").lower() in ("1", "true", "yes")
+    return selected_agent, date_from, date_to, _search(), approx
+
+
+def _token_rollup(selected_agent, date_from, date_to, q, approx):
+    """Exact rows, or the cached approximate rollup; (rows, approx meta or None)."""
+    users_col = _col(current_app.config["USERS_COL"])
+    messages_col = _col("messages")
+    convos_col = _col("conversations")
+    agents_col = _col("agents")
+
+    _, agents_map, agent_name_by_id = _load_agents(agents_col)
+    if not approx:
+        rows = _cached_token_rows(users_col, messages_col, convos_col, agents_map, agent_name_by_id,
+                                  selected_agent, date_from, date_to, q)
+        return rows, None
+    result = _cached_approx_rollup(users_col, messages_col, convos_col, agents_map, agent_name_by_id,
+                                   selected_agent, date_from, date_to, q)
+    meta = {
+        "confidence": 0.95,
+        "sampled": result["sampled"],
+        "population": result["population"],
+        "exact": result["exact"],
+        "totals": result["totals"],
+    }
+    return result, meta
+
+
+@bp.get("/tokens")
+@query_budget
+def tokens():
+    """Daily token rollup rows (newest first); ?agent=&date_from=&date_to=&q=&approx=1.
+
+    approx=1 estimates from a sample; each figure gets a "<field>_ci"
+    (95% half-width) and the response an "approx" summary.
+    """
+    selected_agent, date_from, date_to, q, approx = _token_params()
+    fields = _fields(TOKEN_FIELDS + TOKEN_CI_FIELDS if approx else TOKEN_FIELDS)
+    limit = _limit()
+
+    rows, meta = _token_rollup(selected_agent, date_from, date_to, q, approx)
+    if approx:
+        rows = rows["rows"]
+
+    # Rollup dihitung utuh (dan di-cache); cursor = kunci group terakhir,
+    # urutan rows sama dengan sort di _token_rows (desc)
+    def key(r):
+        return [r.get("date") or "", r.get("email") or "", r.get("agent_label") or "", r.get("model_label") or ""]
+
+    head = ["tokens", "approx"] if approx else ["tokens"]
+    after = _decode_cursor(head)
+    start = 0
+    if after is not None:
+        if len(after) != 4:
+            raise ApiError("Invalid cursor")
+        start = next((i for i, r in enumerate(rows) if key(r) < after), len(rows))
+
+    page = rows[start:start + limit]
+    more = start + limit < len(rows)
+    next_cursor = _encode_cursor(head + key(page[-1])) if more and page else None
+    extra = {"approx": meta} if approx else {}
+    return _page([_pick(r, fields) for r in page], next_cursor, total=len(rows), **extra)
+
+
+@bp.get("/tokens/daily")
+@query_budget
+def tokens_daily():
+    """Per-date totals for charts (oldest first); same filters as /tokens, incl. approx=1."""
+    selected_agent, date_from, date_to, q, approx = _token_params()
+    result, meta = _token_rollup(selected_agent, date_from, date_to, q, approx)
+    if approx:
+        return _page(result["daily"], None, approx=meta)
+    return _page(_daily_totals(result), None)
+
+
+@bp.get("/tokens/stats")
+@query_budget
+def tokens_stats():
+    """Distinct active users for the token filters (HyperLogLog estimate; approx is ignored)."""
+    selected_agent, date_from, date_to, q, _ = _token_params()
+    users_col = _col(current_app.config["USERS_COL"])
+    messages_col = _col("messages")
+    active_users = _active_users(users_col, messages_col, selected_agent, date_from, date_to, q)
+    return _page([], None, stats={"active_users": active_users})
+
+
+@bp.get("/categories")
+@query_budget
+def categories():
+    """Agent categories in display order."""
+    cats_col = _col(current_app.config["CATS_COL"])
+    fields = _fields(CATEGORY_FIELDS)
+    projection = {f: 1 for f in fields}
+    projection["order"] = 1
+    docs, next_cursor = _keyset_page(cats_col, {}, "order", 1, _limit(), projection, "[Categories]")
+    return _page([_pick(d, fields) for d in docs], next_cursor)
@@ -2,7 +2,11 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, current_app, flash
 from pathlib import Path
 import json
+import os
+import threading
+import time
 from werkzeug.security import check_password_hash, generate_password_hash
+from utils import throttle
 
 bp = Blueprint("auth", __name__, url_prefix="/admin-klg")
 
@@ -19,50 +23,96 @@ def verify_password(plain: str, stored: str) -> bool:
         current_app.logger.error(f"[Auth] Unexpected password verification error: {e}")
         return False
 
-def _load_creds(username: str):
-    """Load credentials with comprehensive error handling"""
+# Cache credentials.json: dict username -> password_hash, mtime dicek
+# paling sering sekali per CREDS_CHECK_INTERVAL detik.
+CREDS_CHECK_INTERVAL = float(os.getenv("CREDS_CHECK_INTERVAL", "5"))
+_creds = {"by_user": {}, "mtime": None, "checked_at": None, "path": None}
+_creds_lock = threading.Lock()
+
+def _reset_creds_lock():
+    global _creds_lock
+    _creds_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_creds_lock)
+
+def _creds_path() -> Path:
+    try:
+        project_root = Path(current_app.root_path)
+    except RuntimeError:
+        project_root = Path(__file__).resolve().parents[1]
+    return (project_root / "credentials.json").resolve()
+
+def _parse_creds(json_path: Path) -> dict:
+    """Parse credentials file into {username: password_hash} with diagnostics"""
     try:
-        try:
-            project_root = Path(current_app.root_path)
-        except RuntimeError:
-            project_root = Path(__file__).resolve().parents[1]
-        
-        json_path = (project_root / "credentials.json").resolve()
-        current_app.logger.info(f"[Auth] Loading credentials for user: {username}")
-        
-        if not json_path.exists():
-            current_app.logger.error(f"[Auth] Credentials file not found: {json_path}")
-            return None, None
-            
         with open(json_path, "r", encoding="utf-8") as f:
             data = json.load(f)
-            
+
         if not isinstance(data, list):
             current_app.logger.error("[Auth] Invalid credentials file format - expected list")
-            return None, None
-            
+            return {}
+
+        by_user = {}
         for cred in data:
             if not isinstance(cred, dict):
                 current_app.logger.warning("[Auth] Invalid credential entry - skipping")
                 continue
-            if username == cred.get("username"):
-                return cred.get("username"), cred.get("password_hash")
-                
-        current_app.logger.warning(f"[Auth] User not found: {username}")
-        return None, None
-        
+            username = cred.get("username")
+            if username:
+                by_user.setdefault(username, cred.get("password_hash"))
+        current_app.logger.info(f"[Auth] Loaded {len(by_user)} credentials from {json_path}")
+        return by_user
+
     except json.JSONDecodeError as e:
         current_app.logger.error(f"[Auth] JSON decode error in credentials file: {e}")
-        return None, None
     except PermissionError as e:
         current_app.logger.error(f"[Auth] Permission denied reading credentials: {e}")
-        return None, None
     except FileNotFoundError as e:
         current_app.logger.error(f"[Auth] Credentials file not found: {e}")
-        return None, None
     except OSError as e:
         current_app.logger.error(f"[Auth] OS error reading credentials: {e}")
-        return None, None
+    except Exception as e:
+        current_app.logger.error(f"[Auth] Unexpected error loading credentials: {e}")
+    return {}
+
+def _refresh_creds():
+    """Reload the credential cache if credentials.json changed on disk"""
+    now = time.monotonic()
+    checked_at = _creds["checked_at"]
+    if checked_at is not None and now - checked_at < CREDS_CHECK_INTERVAL:
+        return
+    with _creds_lock:
+        if _creds["checked_at"] is not None and now - _creds["checked_at"] < CREDS_CHECK_INTERVAL:
+            return
+        if _creds["path"] is None:
+            _creds["path"] = _creds_path()
+        json_path = _creds["path"]
+        try:
+            mtime = json_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            current_app.logger.error(f"[Auth] Credentials file not found: {json_path}")
+            _creds.update(by_user={}, mtime=None, checked_at=now)
+            return
+        except OSError as e:
+            current_app.logger.error(f"[Auth] OS error reading credentials: {e}")
+            _creds["checked_at"] = now
+            return
+
+        if mtime != _creds["mtime"]:
+            _creds["by_user"] = _parse_creds(json_path)
+            _creds["mtime"] = mtime
+        _creds["checked_at"] = now
+
+def _load_creds(username: str):
+    """Look up credentials in the in-memory store (no file I/O per login)"""
+    try:
+        _refresh_creds()
+        password_hash = _creds["by_user"].get(username)
+        if not password_hash:
+            current_app.logger.warning(f"[Auth] User not found: {username}")
+            return None, None
+        return username, password_hash
     except Exception as e:
         current_app.logger.error(f"[Auth] Unexpected error loading credentials: {e}")
         return None, None
@@ -82,15 +132,27 @@ def login():
                 if not username or not password:
                     flash("Username and password are required", "danger")
                     return redirect(url_for("auth.login", next=request.args.get("next")))
+
+                # Throttle sebelum check_password_hash (KDF mahal)
+                client_ip = request.remote_addr or "unknown"
+                username = username[:100]
+                retry_after = throttle.check(client_ip, username)
+                if retry_after:
+                    wait_s = int(retry_after) + 1
+                    current_app.logger.warning(f"[Auth] Login throttled: {username} from {client_ip} ({wait_s}s)")
+                    flash(f"Too many login attempts. Try again in {wait_s} seconds.", "danger")
+                    return render_template("login.html", hide_sidebar=True), 429, {"Retry-After": str(wait_s)}
                 
                 cfg_user, cfg_pw_hash = _load_creds(username)
                 
                 if not cfg_user or not cfg_pw_hash:
+                    throttle.record_failure(client_ip, username)
                     flash("Invalid credentials configuration", "danger")
                     current_app.logger.warning(f"[Auth] Login attempt with invalid config: {username}")
                     return redirect(url_for("auth.login", next=request.args.get("next")))
                 
                 if username == cfg_user and verify_password(password, cfg_pw_hash):
+                    throttle.record_success(client_ip, username)
                     session.permanent = True
                     session["logged_in"] = True
                     session["admin_username"] = username
@@ -100,6 +162,7 @@ def login():
                     next_url = request.args.get("next") or url_for("users.admin_users")
                     return redirect(next_url)
                 else:
+                    throttle.record_failure(client_ip, username)
                     flash("Invalid username or password", "danger")
                     current_app.logger.warning(f"[Auth] Failed login attempt: {username}")
                     return redirect(url_for("auth.login", next=request.args.get("next")))
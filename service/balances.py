@@ -3,13 +3,16 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from bson import ObjectId
 from bson.errors import InvalidId
 from datetime import datetime
-from config.mongo import get_col
+from config.mongo import get_col, query_budget, budget_exceeded
+from utils import cache
 from pymongo.errors import PyMongoError
 from math import ceil
 import re
 
 bp = Blueprint("balances", __name__, url_prefix="/admin-klg/admin")
 
+BALANCE_COUNT_TTL = 60
+
 def safe_template_render(template_name, **kwargs):
     """Safe template rendering with default values"""
     defaults = {
@@ -28,7 +31,47 @@ def safe_template_render(template_name, **kwargs):
     defaults.update(kwargs)
     return render_template(template_name, **defaults)
 
+def _users_map(users_col) -> dict:
+    """{user id: {email, name}} for every user, with error handling"""
+    users_map = {}
+    try:
+        users_cursor = users_col.find({}, {"_id": 1, "email": 1, "name": 1})
+        users_map = {
+            str(u["_id"]): {
+                "email": u.get("email", "Unknown"), 
+                "name": u.get("name", "Unknown")
+            }
+            for u in users_cursor
+        }
+        current_app.logger.info(f"[Balances] Loaded {len(users_map)} users")
+    except PyMongoError as e:
+        if not budget_exceeded(e, "[Balances]"):
+            current_app.logger.error(f"[Balances] Error loading users: {e}")
+            flash("Error loading user data", "warning")
+            cache.skip_store()
+    return users_map
+
+def _user_filter(users_col, q: str):
+    """Balance filter for users whose email matches q; None if nobody matches."""
+    # Find users with matching email
+    email_regex = {"$regex": re.escape(q), "$options": "i"}
+    matched_users = list(users_col.find({"email": email_regex}, {"_id": 1}))
+    if not matched_users:
+        return None
+
+    oid_list = [u["_id"] for u in matched_users]
+    if current_app.config.get("TYPES_NORMALIZED"):
+        return {"user": {"$in": oid_list}}
+    str_list = [str(u["_id"]) for u in matched_users]
+
+    # Support both ObjectId and string user references
+    return {"$or": [
+        {"user": {"$in": oid_list}},
+        {"user": {"$in": str_list}},
+    ]}
+
 @bp.route("/balances")
+@query_budget
 def balance_list():
     """Balance list with comprehensive error handling"""
     try:
@@ -67,62 +110,43 @@ def balance_list():
         reverse = (sort_dir != "asc")
 
         try:
-            # Preload user map with error handling
-            users_map = {}
-            try:
-                users_cursor = users_col.find({}, {"_id": 1, "email": 1, "name": 1})
-                users_map = {
-                    str(u["_id"]): {
-                        "email": u.get("email", "Unknown"), 
-                        "name": u.get("name", "Unknown")
-                    }
-                    for u in users_cursor
-                }
-                current_app.logger.info(f"[Balances] Loaded {len(users_map)} users")
-            except PyMongoError as e:
-                current_app.logger.error(f"[Balances] Error loading users: {e}")
-                flash("Error loading user data", "warning")
+            # Preload user map (di-cache bersama antar worker, namespace "users")
+            users_map = cache.get_or_set("users", cache.make_key("balances_users_map"),
+                                         lambda: _users_map(users_col))
 
             # Build filter for balances based on email search
             bal_filter = {}
             if q:
                 try:
-                    # Find users with matching email
-                    email_regex = {"$regex": re.escape(q), "$options": "i"}
-                    matched_users = list(users_col.find({"email": email_regex}, {"_id": 1}))
-                    
-                    if not matched_users:
+                    bal_filter = _user_filter(users_col, q)
+                    if bal_filter is None:
                         # No matching users
                         return safe_template_render(
                             "balances.html",
                             q=q, page=page, per_page=per_page,
                             sort=sort_field, dir=sort_dir
                         )
-
-                    oid_list = [u["_id"] for u in matched_users]
-                    str_list = [str(u["_id"]) for u in matched_users]
-                    
-                    # Support both ObjectId and string user references
-                    bal_filter = {"$or": [
-                        {"user": {"$in": oid_list}},
-                        {"user": {"$in": str_list}},
-                    ]}
                 except PyMongoError as e:
-                    current_app.logger.error(f"[Balances] Error building search filter: {e}")
-                    flash("Search error occurred", "danger")
-                    return safe_template_render("balances.html")
+                    if not budget_exceeded(e, "[Balances]"):
+                        current_app.logger.error(f"[Balances] Error building search filter: {e}")
+                        flash("Search error occurred", "danger")
+                    return safe_template_render("balances.html", q=q)
 
             # Count total documents
             try:
-                total = balances_col.count_documents(bal_filter)
+                # count_documents memindai seluruh filter; cukup segar dengan TTL pendek
+                total = cache.get_or_set("balances", cache.make_key("count", q),
+                                         lambda: balances_col.count_documents(bal_filter),
+                                         ttl=BALANCE_COUNT_TTL)
                 total_pages = max(ceil(total / per_page), 1)
                 if page > total_pages:
                     page = total_pages
                 start = (page - 1) * per_page
             except PyMongoError as e:
-                current_app.logger.error(f"[Balances] Error counting documents: {e}")
-                flash("Error counting balances", "danger")
-                return safe_template_render("balances.html")
+                if not budget_exceeded(e, "[Balances]"):
+                    current_app.logger.error(f"[Balances] Error counting documents: {e}")
+                    flash("Error counting balances", "danger")
+                return safe_template_render("balances.html", q=q)
 
             # Fetch balance data
             try:
@@ -140,7 +164,15 @@ def balance_list():
                 ).skip(start).limit(per_page)
 
                 data = []
-                for b in cursor:
+                docs = []
+                try:
+                    for b in cursor:
+                        docs.append(b)
+                except PyMongoError as e:
+                    # Budget habis di tengah page -> tampilkan baris yang sudah terambil
+                    if not budget_exceeded(e, "[Balances]"):
+                        raise
+                for b in docs:
                     try:
                         user_id_raw = b.get("user")
                         user_id_str = str(user_id_raw) if user_id_raw else "unknown"
@@ -276,6 +308,9 @@ def edit_balance(balance_id):
             )
 
             if result.modified_count > 0:
+                # Tidak ada cache yang perlu di-invalidate: namespace "balances"
+                # hanya menyimpan jumlah dokumen, tokenCredits selalu dibaca
+                # langsung (dari primary, lihat DEFAULT_READ_ROUTING)
                 flash(f"Token balance updated to {tokenCredits:,.2f}", "success")
                 current_app.logger.info(f"[Balances] Balance updated: {balance_id} -> {tokenCredits}")
             else:
@@ -1,16 +1,21 @@
 from flask import Blueprint, render_template, request, send_file, current_app, url_for, flash
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
 from io import BytesIO
-from openpyxl import Workbook
 from bson import ObjectId
 from bson.errors import InvalidId
 from pymongo.errors import PyMongoError
 
-from config.mongo import get_col
+from config.mongo import get_col, query_budget, budget_exceeded
+from utils import cache, fanout, hll
 from utils.helper import parse_date, human_bytes
 
 bp = Blueprint("files", __name__, url_prefix="/admin-klg/admin")
 
+# Export di-resolve per batch supaya list $in lookup tetap kecil
+EXPORT_BATCH = 1000
+# "user" diurutkan per halaman berdasarkan nama (bukan field Mongo)
+FILE_SORT_KEYS = ("createdAt", "filename", "type", "bytes", "user")
+
 
 def _build_query(start_str: str, end_str: str, user_str: str) -> dict:
     """Build MongoDB query from date & user filters with error handling"""
@@ -44,16 +49,210 @@ def _build_query(start_str: str, end_str: str, user_str: str) -> dict:
     return query
 
 
+def _date_bounds(query: dict):
+    """(start, end) datetimes of the createdAt filter, end exclusive; None when absent."""
+    created = query.get("createdAt") or {}
+    start = created.get("$gte")
+    end = created.get("$lte")
+    if end is not None:
+        end = datetime.combine(end.date(), time.min) + timedelta(days=1)
+    return start, end
+
+
+def _file_stats(files_col, query: dict) -> dict:
+    """Totals for the filtered files; total_users is a HyperLogLog estimate."""
+    total_files = 0
+    total_size_bytes = 0
+    total_users = 0
+
+    if files_col is not None:
+        pipe = [
+            {"$match": query},
+            {"$group": {"_id": None, "total": {"$sum": {"$ifNull": ["$bytes", 0]}}}},
+        ]
+        start, end = _date_bounds(query)
+        # count, total size dan distinct user independen -> paralel. Distinct
+        # dari sketch harian (utils.hll), bukan array distinct() penuh
+        with fanout.group() as fan:
+            count_f = fan.submit(files_col.count_documents, query)
+            size_f = fan.submit(lambda: list(files_col.aggregate(pipe)))
+            users_f = None
+            if "user" not in query:
+                users_f = fan.submit(hll.distinct_count, files_col, {}, "user", start, end)
+
+        # Get totals with error handling
+        try:
+            total_files = count_f.result()
+            agg = size_f.result()
+            total_size_bytes = agg[0]["total"] if agg else 0
+            
+        except PyMongoError as e:
+            if not budget_exceeded(e, "[Files]"):
+                current_app.logger.error(f"[Files] Database error calculating totals: {e}")
+                flash("Error calculating file statistics", "warning")
+                cache.skip_store()
+        except (KeyError, TypeError) as e:
+            current_app.logger.warning(f"[Files] Data format error in totals: {e}")
+            cache.skip_store()
+
+        try:
+            # Filter satu user: distinct-nya 0 atau 1
+            total_users = users_f.result() if users_f is not None else min(total_files, 1)
+        except PyMongoError as e:
+            if not budget_exceeded(e, "[Files]"):
+                current_app.logger.error(f"[Files] Error estimating distinct users: {e}")
+                cache.skip_store()
+
+    return {
+        "total_files": total_files,
+        "total_size_bytes": total_size_bytes,
+        "total_users": total_users,
+    }
+
+
+def _user_options(files_col, users_col, query: dict) -> list:
+    """Uploader dropdown options ({_id, name}, sorted by name) for the filtered files."""
+    user_options = []
+    if files_col is None:
+        return user_options
+
+    # Get user dropdown options
+    try:
+        distinct_ids = [u for u in files_col.distinct("user", query) if isinstance(u, ObjectId)]
+        if distinct_ids and users_col is not None:
+            name_map = {}
+            try:
+                for u in users_col.find({"_id": {"$in": distinct_ids}}, {"name": 1, "email": 1}):
+                    name_map[str(u["_id"])] = (u.get("name") or u.get("email") or str(u["_id"]))
+            except PyMongoError as e:
+                if not budget_exceeded(e, "[Files]"):
+                    current_app.logger.error(f"[Files] Error loading user names: {e}")
+                    cache.skip_store()
+                
+            for oid in distinct_ids:
+                key = str(oid)
+                user_options.append({"_id": key, "name": name_map.get(key, key)})
+            user_options.sort(key=lambda x: (x["name"] or "").lower())
+            
+    except PyMongoError as e:
+        if not budget_exceeded(e, "[Files]"):
+            current_app.logger.error(f"[Files] Error getting user options: {e}")
+            cache.skip_store()
+    except (KeyError, TypeError) as e:
+        current_app.logger.warning(f"[Files] Data format error in user options: {e}")
+        cache.skip_store()
+
+    return user_options
+
+
+def _resolve_related(docs, users_col, agents_col, convos_col):
+    """Batch lookups for a list of file docs: ({user key: name}, {file_id: agent name}).
+
+    A fixed number of round trips per batch instead of up to four find_one()
+    per row. The agent rule is unchanged: an agent whose file_search holds
+    the file, overridden by the agent of a conversation that has the file.
+    """
+    user_ids = list({d["user"] for d in docs if d.get("user")})
+    file_ids = list({d["file_id"] for d in docs if d.get("file_id")})
+    agent_file_ids = list({d["file_id"] for d in docs if d.get("file_id") and d.get("context") == "agents"})
+
+    def users_q():
+        return list(users_col.find({"_id": {"$in": user_ids}}, {"name": 1}))
+
+    def agents_by_file_q():
+        return list(agents_col.find(
+            {"tool_resources.file_search.file_ids": {"$in": agent_file_ids}},
+            {"name": 1, "tool_resources.file_search.file_ids": 1},
+        ))
+
+    def convos_q():
+        return list(convos_col.find({"files": {"$in": file_ids}}, {"files": 1, "agent_id": 1}))
+
+    with fanout.group() as fan:
+        users_f = fan.submit(users_q) if users_col is not None and user_ids else None
+        agents_f = fan.submit(agents_by_file_q) if agents_col is not None and agent_file_ids else None
+        convos_f = fan.submit(convos_q) if convos_col is not None and agents_col is not None and file_ids else None
+
+    user_names = {}
+    if users_f is not None:
+        try:
+            user_names = {str(u["_id"]): u.get("name") for u in users_f.result()}
+        except PyMongoError as e:
+            if not budget_exceeded(e, "[Files]"):
+                current_app.logger.warning(f"[Files] Error resolving user names: {e}")
+
+    agent_by_file = {}
+    try:
+        if agents_f is not None:
+            wanted = set(agent_file_ids)
+            for a in agents_f.result():
+                for fid in ((a.get("tool_resources") or {}).get("file_search") or {}).get("file_ids") or []:
+                    if fid in wanted:
+                        agent_by_file.setdefault(fid, a.get("name"))
+
+        if convos_f is not None:
+            convo_agent = {}
+            wanted = set(file_ids)
+            for c in convos_f.result():
+                for fid in c.get("files") or []:
+                    if fid in wanted:
+                        convo_agent.setdefault(fid, c.get("agent_id"))
+            agent_ids = list({aid for aid in convo_agent.values() if aid})
+            names = {}
+            if agent_ids:
+                names = {a.get("id"): a.get("name") for a in agents_col.find({"id": {"$in": agent_ids}}, {"id": 1, "name": 1})}
+            for fid, aid in convo_agent.items():
+                agent_by_file[fid] = names.get(aid)
+    except PyMongoError as e:
+        if not budget_exceeded(e, "[Files]"):
+            current_app.logger.warning(f"[Files] Error finding related agents: {e}")
+
+    return user_names, agent_by_file
+
+
+def _sort_spec(sort_key: str, sort_ord: str):
+    """Validated (sort_key, sort_ord, mongo field, direction); "user" sorts a page by name."""
+    if sort_key not in FILE_SORT_KEYS:
+        sort_key = "createdAt"
+    if sort_ord not in {"asc", "desc"}:
+        sort_ord = "desc"
+    mongo_sort = sort_key if sort_key != "user" else "createdAt"
+    return sort_key, sort_ord, mongo_sort, (-1 if sort_ord == "desc" else 1)
+
+
+def _file_rows(docs, users_col, agents_col, convos_col) -> list:
+    """Table/export rows for a batch of file docs (uploader and agent resolved per batch)."""
+    user_names, agent_by_file = _resolve_related(docs, users_col, agents_col, convos_col)
+    rows = []
+    for doc in docs:
+        try:
+            user_name = user_names.get(str(doc.get("user")))
+            agent_name = agent_by_file.get(doc.get("file_id"))
+
+            rows.append({
+                "createdAt": doc.get("createdAt"),
+                "filename": doc.get("filename"),
+                "type": doc.get("type"),
+                "size_h": human_bytes(doc.get("bytes")),
+                "size": doc.get("bytes"),
+                "user": user_name or (str(doc.get("user")) if doc.get("user") else None),
+                "user_id": str(doc.get("user")) if doc.get("user") else "",
+                "_id": str(doc.get("_id")),
+                "file_id": doc.get("file_id"),
+                "agent": agent_name or '-',
+            })
+
+        except (KeyError, TypeError, AttributeError) as e:
+            current_app.logger.warning(f"[Files] Error processing file record: {e}")
+            continue
+    return rows
+
+
 @bp.get("/files")
+@query_budget
 def file_monitoring():
-    """File monitoring with comprehensive error handling"""
+    """File monitoring shell; table and totals are loaded from /admin-klg/api/v1/files"""
     try:
-        # Get database collections
-        files_col = get_col("files")
-        users_col = get_col(current_app.config["USERS_COL"])
-        agents_col = get_col("agents")
-        convos_col = get_col("conversations")
-
         # Parse and validate parameters
         try:
             start_str = request.args.get("start", "").strip()
@@ -61,185 +260,42 @@ def file_monitoring():
             user_str = request.args.get("user", "").strip()
             sort_key = request.args.get("s", "createdAt").strip()
             sort_ord = request.args.get("o", "desc").strip()
-            
-            # Validate and parse pagination
-            page = max(int(request.args.get("page", 1) or 1), 1)
+
             per_page = int(request.args.get("per_page", 10) or 10)
             per_page = max(min(per_page, 200), 5)
-            
+
         except (ValueError, TypeError) as e:
             current_app.logger.warning(f"[Files] Parameter validation error: {e}")
-            page, per_page = 1, 10
+            per_page = 10
 
-        # Validate sort parameters
-        allowed_sort_keys = {"createdAt", "filename", "type", "bytes", "user"}
-        if sort_key not in allowed_sort_keys:
-            sort_key = "createdAt"
-        if sort_ord not in {"asc", "desc"}:
-            sort_ord = "desc"
-
-        # Build query with error handling
-        query = _build_query(start_str, end_str, user_str)
-
-        # Get user dropdown options
-        user_options = []
-        if files_col is not None and users_col is not None:
-            try:
-                distinct_ids = [u for u in files_col.distinct("user", query) if isinstance(u, ObjectId)]
-                if distinct_ids:
-                    name_map = {}
-                    try:
-                        for u in users_col.find({"_id": {"$in": distinct_ids}}, {"name": 1, "email": 1}):
-                            name_map[str(u["_id"])] = (u.get("name") or u.get("email") or str(u["_id"]))
-                    except PyMongoError as e:
-                        current_app.logger.error(f"[Files] Error loading user names: {e}")
-                        
-                    for oid in distinct_ids:
-                        key = str(oid)
-                        user_options.append({"_id": key, "name": name_map.get(key, key)})
-                    user_options.sort(key=lambda x: (x["name"] or "").lower())
-                    
-            except PyMongoError as e:
-                current_app.logger.error(f"[Files] Error getting user options: {e}")
-            except (KeyError, TypeError) as e:
-                current_app.logger.warning(f"[Files] Data format error in user options: {e}")
-
-        # Get totals with error handling
-        total_files = 0
-        total_size_bytes = 0
-        total_users = 0
-        
-        if files_col is not None:
-            try:
-                total_files = files_col.count_documents(query)
-                
-                # Calculate total size
-                pipe = [
-                    {"$match": query},
-                    {"$group": {"_id": None, "total": {"$sum": {"$ifNull": ["$bytes", 0]}}}},
-                ]
-                agg = list(files_col.aggregate(pipe))
-                total_size_bytes = agg[0]["total"] if agg else 0
-                
-                # Count distinct users
-                distinct_users = files_col.distinct("user", query)
-                total_users = len([u for u in distinct_users if u is not None])
-                
-            except PyMongoError as e:
-                current_app.logger.error(f"[Files] Database error calculating totals: {e}")
-                flash("Error calculating file statistics", "warning")
-            except (KeyError, TypeError) as e:
-                current_app.logger.warning(f"[Files] Data format error in totals: {e}")
-
-        total_size_h = human_bytes(total_size_bytes)
-
-        # Sorting and pagination
-        sort_fields_map = {
-            "createdAt": "createdAt",
-            "filename": "filename",
-            "type": "type",
-            "bytes": "bytes",
-        }
-        mongo_sort = sort_fields_map.get(sort_key, "createdAt")
-        sort_dir = -1 if sort_ord == "desc" else 1
-
-        rows = []
-        if files_col is not None:
-            try:
-                cursor = files_col.find(query).sort(mongo_sort, sort_dir).skip((page - 1) * per_page).limit(per_page)
-                
-                for doc in cursor:
-                    try:
-                        # Resolve user name
-                        user_name = None
-                        if users_col is not None and doc.get("user"):
-                            try:
-                                u = users_col.find_one({"_id": doc["user"]}, {"name": 1})
-                                if u:
-                                    user_name = u.get("name")
-                            except PyMongoError as e:
-                                current_app.logger.warning(f"[Files] Error resolving user name: {e}")
-
-                        # Find related agent
-                        related_agent = None
-                        try:
-                            if doc.get("context") == "agents":
-                                target_file_id = doc.get("file_id")
-                                if target_file_id and agents_col is not None:
-                                    related_agent = agents_col.find_one({
-                                        "tool_resources.file_search.file_ids": {"$in": [target_file_id]}
-                                    })
-
-                            # Check conversation files
-                            file_id = doc.get("file_id")
-                            if file_id and convos_col is not None:
-                                conversation_with_file = convos_col.find_one({"files": {"$in": [file_id]}})
-                                if conversation_with_file and agents_col is not None:
-                                    related_agent = agents_col.find_one({
-                                        "id": conversation_with_file.get("agent_id")
-                                    })
-                        except PyMongoError as e:
-                            current_app.logger.warning(f"[Files] Error finding related agent: {e}")
-
-                        rows.append({
-                            "createdAt": doc.get("createdAt"),
-                            "filename": doc.get("filename"),
-                            "type": doc.get("type"),
-                            "size_h": human_bytes(doc.get("bytes")),
-                            "size": doc.get("bytes"),
-                            "user": user_name or (str(doc.get("user")) if doc.get("user") else None),
-                            "user_id": str(doc.get("user")) if doc.get("user") else "",
-                            "_id": str(doc.get("_id")),
-                            "file_id": doc.get("file_id"),
-                            "agent": related_agent.get("name") if related_agent else '-',
-                        })
-                        
-                    except (KeyError, TypeError, AttributeError) as e:
-                        current_app.logger.warning(f"[Files] Error processing file record: {e}")
-                        continue
-                        
-            except PyMongoError as e:
-                current_app.logger.error(f"[Files] Database error fetching files: {e}")
-                flash("Error fetching file data", "danger")
-
-        # Sort by user name in-memory
-        if sort_key == "user":
-            try:
-                rows.sort(key=lambda r: (r["user"] or "").lower(), reverse=(sort_ord == "desc"))
-            except (KeyError, TypeError) as e:
-                current_app.logger.warning(f"[Files] Error sorting by user: {e}")
+        sort_key, sort_ord, mongo_sort, sort_dir = _sort_spec(sort_key, sort_ord)
 
         # Handle Excel export
         if request.args.get("export") == "1":
             try:
-                return _export_excel(files_col, users_col, agents_col, convos_col, query, mongo_sort, sort_dir, 
+                files_col = get_col("files")
+                users_col = get_col(current_app.config["USERS_COL"])
+                agents_col = get_col("agents")
+                convos_col = get_col("conversations")
+                query = _build_query(start_str, end_str, user_str)
+                return _export_excel(files_col, users_col, agents_col, convos_col, query, mongo_sort, sort_dir,
                                    sort_key, sort_ord, start_str, end_str, user_str)
             except Exception as e:
                 current_app.logger.error(f"[Files] Excel export error: {e}")
                 flash("Error generating Excel export", "danger")
 
-        total_pages = max((total_files + per_page - 1) // per_page, 1) if total_files > 0 else 1
-
         return render_template(
             "files.html",
             title="File Monitoring",
             active="files",
-            rows=rows,
             start=start_str,
             end=end_str,
             user=user_str,
-            user_options=user_options,
             s=sort_key,
             o=sort_ord,
-            page=page,
             per_page=per_page,
-            total=total_files,
-            total_pages=total_pages,
-            total_size_bytes=total_size_bytes,
-            total_size_h=total_size_h,
-            total_users=total_users,
         )
-        
+
     except Exception as e:
         current_app.logger.error(f"[Files] Route error: {e}")
         flash("System error. Please contact administrator.", "danger")
@@ -247,20 +303,12 @@ def file_monitoring():
             "files.html",
             title="File Monitoring",
             active="files",
-            rows=[],
             start="",
             end="",
             user="",
-            user_options=[],
             s="createdAt",
             o="desc",
-            page=1,
             per_page=10,
-            total=0,
-            total_pages=1,
-            total_size_bytes=0,
-            total_size_h="0 B",
-            total_users=0,
         )
 
 
@@ -271,54 +319,15 @@ def _export_excel(files_col, users_col, agents_col, convos_col, query, mongo_sor
         all_rows = []
         if files_col is not None:
             try:
-                cur = files_col.find(query).sort(mongo_sort, sort_dir)
+                cur = files_col.find(query).sort(mongo_sort, sort_dir).batch_size(EXPORT_BATCH)
+                batch = []
                 for doc in cur:
-                    try:
-                        uname = None
-                        if users_col is not None and doc.get("user"):
-                            try:
-                                u = users_col.find_one({"_id": doc["user"]}, {"name": 1})
-                                if u:
-                                    uname = u.get("name")
-                            except PyMongoError as e:
-                                current_app.logger.warning(f"[Files] Export user lookup error: {e}")
-
-                        agent_name = "-"
-                        related_agent = None
-                        try:
-                            if doc.get("context") == "agents":
-                                target_file_id = doc.get("file_id")
-                                if target_file_id and agents_col is not None:
-                                    related_agent = agents_col.find_one({
-                                        "tool_resources.file_search.file_ids": {"$in": [target_file_id]}
-                                    })
-                            
-                            # Check conversation files
-                            file_id = doc.get("file_id")
-                            if file_id and convos_col is not None:
-                                conversation_with_file = convos_col.find_one({"files": {"$in": [file_id]}})
-                                if conversation_with_file and agents_col is not None:
-                                    related_agent = agents_col.find_one({
-                                        "id": conversation_with_file.get("agent_id")
-                                    })
-                            
-                            agent_name = related_agent.get("name") if related_agent else "-"
-                        except PyMongoError as e:
-                            current_app.logger.warning(f"[Files] Export agent lookup error: {e}")
-
-                        all_rows.append({
-                            "createdAt": doc.get("createdAt"),
-                            "filename": doc.get("filename"),
-                            "type": doc.get("type"),
-                            "size": doc.get("bytes"),
-                            "user": uname or (str(doc.get("user")) if doc.get("user") else None),
-                            "_id": str(doc.get("_id")),
-                            "file_id": doc.get("file_id"),
-                            "agent": agent_name,
-                        })
-                    except (KeyError, TypeError, AttributeError) as e:
-                        current_app.logger.warning(f"[Files] Export record processing error: {e}")
-                        continue
+                    batch.append(doc)
+                    if len(batch) >= EXPORT_BATCH:
+                        all_rows.extend(_file_rows(batch, users_col, agents_col, convos_col))
+                        batch = []
+                if batch:
+                    all_rows.extend(_file_rows(batch, users_col, agents_col, convos_col))
                         
             except PyMongoError as e:
                 current_app.logger.error(f"[Files] Export database error: {e}")
@@ -330,7 +339,8 @@ def _export_excel(files_col, users_col, agents_col, convos_col, query, mongo_sor
             except (KeyError, TypeError) as e:
                 current_app.logger.warning(f"[Files] Export sorting error: {e}")
 
-        # Create Excel workbook
+        # Create Excel workbook (openpyxl di-import saat export saja)
+        from openpyxl import Workbook
         wb = Workbook()
         ws = wb.active
         ws.title = "files"
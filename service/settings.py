@@ -1,6 +1,9 @@
-from flask import Blueprint, render_template, request, flash, current_app, redirect, url_for
+from flask import Blueprint, render_template, request, flash, current_app, redirect, url_for, send_from_directory, abort
 from time import perf_counter
-from config.mongo import init_mongo, reload_mongo
+from config.mongo import init_mongo, reload_mongo, read_routing_table, get_db, ping_ms, latency_history
+from utils.helper import human_bytes, percentile
+from utils import cache, slowlog, profiler
+from datetime import datetime
 from pymongo import MongoClient
 from pymongo.errors import ServerSelectionTimeoutError, PyMongoError
 import json
@@ -8,10 +11,10 @@ import os
 
 CONFIG_FILE = os.path.join("config", "db_config.json")
 
-def db_exists(uri, dbname):
+def db_exists(uri, dbname, client=None):
     """Check if database exists with specific error handling"""
     try:
-        client = MongoClient(uri, serverSelectionTimeoutMS=3000)
+        client = client or MongoClient(uri, serverSelectionTimeoutMS=3000)
         dblist = client.list_database_names()
         return dbname in dblist
     except ServerSelectionTimeoutError as e:
@@ -55,8 +58,12 @@ def load_db_config():
         current_app.logger.error(f"[Settings] Unexpected error loading config: {e}")
         return {"MONGO_URI": "mongodb://localhost:27017/", "MONGO_DB": "LibreChat"}
 
-def save_db_config(uri: str, dbname: str):
-    """Save database configuration with error handling"""
+def save_db_config(uri: str, dbname: str, apply: bool = False):
+    """Save database configuration with error handling
+
+    apply=True bumps APPLIED_GENERATION so every worker reconnects;
+    a plain save leaves running connections alone.
+    """
     try:
         # Validate inputs
         if not uri or not dbname:
@@ -67,10 +74,28 @@ def save_db_config(uri: str, dbname: str):
         if config_dir and not os.path.exists(config_dir):
             os.makedirs(config_dir, exist_ok=True)
             
-        cfg = {"MONGO_URI": uri.strip(), "MONGO_DB": dbname.strip()}
+        # Pertahankan key lain (mis. QUERY_BUDGETS_MS) yang sudah ada di file
+        cfg = {}
+        if os.path.exists(CONFIG_FILE):
+            try:
+                with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+                    existing = json.load(f)
+                if isinstance(existing, dict):
+                    cfg.update(existing)
+            except (OSError, json.JSONDecodeError) as e:
+                current_app.logger.warning(f"[Settings] Existing config unreadable, overwriting: {e}")
+        # TYPES_NORMALIZED hanya berlaku untuk database yang sudah dimigrasi
+        if (cfg.get("MONGO_URI"), cfg.get("MONGO_DB")) != (uri.strip(), dbname.strip()):
+            cfg.pop("TYPES_NORMALIZED", None)
+        cfg.update({"MONGO_URI": uri.strip(), "MONGO_DB": dbname.strip()})
+        if apply:
+            cfg["APPLIED_GENERATION"] = int(cfg.get("APPLIED_GENERATION") or 0) + 1
         
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
+        # Tulis atomik: worker lain hanya melihat file lama atau file baru
+        tmp_path = f"{CONFIG_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
             json.dump(cfg, f, indent=2)
+        os.replace(tmp_path, CONFIG_FILE)
             
         current_app.logger.info(f"[Settings] Configuration saved: {dbname}")
         
@@ -117,7 +142,7 @@ def db_settings():
                         client = MongoClient(uri, serverSelectionTimeoutMS=5000)
                         client.admin.command("ping")
 
-                        if not db_exists(uri, dbname):
+                        if not db_exists(uri, dbname, client):
                             test_result = {
                                 "ok": False, 
                                 "message": f"⚠️ Database '{dbname}' does not exist on server"
@@ -131,6 +156,8 @@ def db_settings():
                                 "message": f"✅ Connection successful to {dbname} ({dt:.0f}ms, {len(collections)} collections)"
                             }
                             
+                        client.close()
+
                     except ServerSelectionTimeoutError as e:
                         current_app.logger.error(f"[Settings] Connection timeout: {e}")
                         test_result = {"ok": False, "message": "❌ Connection timeout - server unreachable"}
@@ -152,7 +179,7 @@ def db_settings():
 
                 elif action == "apply":
                     try:
-                        save_db_config(uri, dbname)
+                        save_db_config(uri, dbname, apply=True)
                         reload_mongo(current_app, uri, dbname)
                         flash("MongoDB connection applied successfully", "success")
                         current_app.logger.info(f"[Settings] Connection applied: {dbname}")
@@ -177,6 +204,7 @@ def db_settings():
             MONGO_URI=uri,
             MONGO_DB=dbname,
             test_result=test_result,
+            routing=read_routing_table(current_app),
         )
         
     except Exception as e:
@@ -191,4 +219,171 @@ def db_settings():
             MONGO_URI="mongodb://localhost:27017/",
             MONGO_DB="LibreChat",
             test_result={"ok": False, "message": "System error occurred"},
+            routing=[],
+        )
+
+
+def _latency_summary(values):
+    """p50/p95/min/max (ms) of a list of latency samples"""
+    if not values:
+        return None
+    return {
+        "n": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "min": min(values),
+        "max": max(values),
+    }
+
+@bp.route("/settings/diagnostics")
+def db_diagnostics():
+    """Database performance probe using the pooled client"""
+    try:
+        samples = request.args.get("samples", 20, type=int) or 20
+        samples = max(min(samples, 200), 1)
+
+        db = get_db()
+        ping = None
+        coll_stats = []
+
+        history = latency_history()
+        background = _latency_summary([ms for _, ms in history])
+        recent = [
+            {"at": datetime.fromtimestamp(ts).strftime("%H:%M:%S"), "ms": ms}
+            for ts, ms in history[-20:]
+        ][::-1]
+
+        if db is None:
+            flash("Database connection unavailable. Diagnostics skipped.", "warning")
+        else:
+            # Ping latency distribution (network + server round trip)
+            try:
+                ping = _latency_summary([ping_ms(db.client) for _ in range(samples)])
+            except PyMongoError as e:
+                current_app.logger.error(f"[Settings] Ping probe error: {e}")
+                flash("Ping probe failed", "danger")
+
+            # collStats untuk collection yang dipakai dashboard
+            names = [
+                current_app.config["USERS_COL"], "messages", "conversations", "agents",
+                "files", "balances", current_app.config["CATS_COL"],
+            ]
+            for name in names:
+                try:
+                    st = db.command("collStats", name)
+                    coll_stats.append({
+                        "name": name,
+                        "count": st.get("count", 0),
+                        "size_h": human_bytes(st.get("size", 0)),
+                        "storage_h": human_bytes(st.get("storageSize", 0)),
+                        "indexes": st.get("nindexes", 0),
+                        "index_h": human_bytes(st.get("totalIndexSize", 0)),
+                        "index_sizes": {k: human_bytes(v) for k, v in (st.get("indexSizes") or {}).items()},
+                    })
+                except PyMongoError as e:
+                    current_app.logger.warning(f"[Settings] collStats failed for {name}: {e}")
+                    coll_stats.append({"name": name, "error": str(e)[:100]})
+
+        return render_template(
+            "diagnostics.html",
+            title="Database Diagnostics",
+            active="settings",
+            samples=samples,
+            ping=ping,
+            background=background,
+            recent=recent,
+            coll_stats=coll_stats,
+            cache_usage=[
+                {"namespace": ns, "entries": v["entries"], "size_h": human_bytes(v["bytes"])}
+                for ns, v in sorted(cache.summary().items())
+            ],
         )
+
+    except Exception as e:
+        current_app.logger.error(f"[Settings] Diagnostics route error: {e}")
+        flash("System error. Please contact administrator.", "danger")
+        return redirect(url_for("settings.db_settings"))
+
+
+@bp.route("/settings/slow-queries", methods=["GET", "POST"])
+def slow_queries():
+    """Slow-query log with redacted shapes and captured explain plans"""
+    try:
+        if request.method == "POST" and request.form.get("action") == "clear":
+            slowlog.clear()
+            flash("Slow-query log cleared", "info")
+            return redirect(url_for("settings.slow_queries"))
+
+        entries = [
+            dict(e, at=datetime.fromtimestamp(e["at"]).strftime("%Y-%m-%d %H:%M:%S"))
+            for e in slowlog.recent_entries()
+        ]
+        return render_template(
+            "slow_queries.html",
+            title="Slow Queries",
+            active="settings",
+            shapes=slowlog.shape_stats(),
+            entries=entries,
+            threshold_ms=slowlog.SLOW_QUERY_MS,
+            explain_enabled=slowlog.SLOW_QUERY_EXPLAIN,
+        )
+
+    except Exception as e:
+        current_app.logger.error(f"[Settings] Slow-query route error: {e}")
+        flash("System error. Please contact administrator.", "danger")
+        return redirect(url_for("settings.db_settings"))
+
+
+@bp.route("/settings/profiles", methods=["GET", "POST"])
+def profiles():
+    """Browse on-demand request profiles; POST toggles the profiling cookie"""
+    try:
+        if request.method == "POST":
+            action = request.form.get("action", "")
+            resp = redirect(url_for("settings.profiles"))
+            if action == "enable":
+                resp.set_cookie(profiler.PROFILE_COOKIE, "1", max_age=3600, httponly=True, samesite="Lax",
+                                secure=current_app.config.get("SESSION_COOKIE_SECURE", False))
+                flash("Profiling aktif untuk request admin Anda (1 jam)", "warning")
+            else:
+                resp.delete_cookie(profiler.PROFILE_COOKIE)
+                flash("Profiling dimatikan", "info")
+            return resp
+
+        entries = profiler.list_profiles()
+        for e in entries:
+            e["at_h"] = datetime.fromtimestamp(e["at"]).strftime("%Y-%m-%d %H:%M:%S")
+            e["peak_h"] = human_bytes(e.get("mem_peak"))
+        return render_template(
+            "profiles.html",
+            title="Profiles",
+            active="settings",
+            entries=entries,
+            profiling_on=request.cookies.get(profiler.PROFILE_COOKIE) == "1",
+            keep=profiler.PROFILE_KEEP,
+        )
+
+    except Exception as e:
+        current_app.logger.error(f"[Settings] Profiles route error: {e}")
+        flash("System error. Please contact administrator.", "danger")
+        return redirect(url_for("settings.db_settings"))
+
+@bp.route("/settings/profiles/<name>")
+def profile_detail(name):
+    """Top functions and allocation peaks of one profile"""
+    meta = profiler.load(name)
+    if not meta:
+        flash("Profile not found", "warning")
+        return redirect(url_for("settings.profiles"))
+    meta["at_h"] = datetime.fromtimestamp(meta["at"]).strftime("%Y-%m-%d %H:%M:%S")
+    meta["peak_h"] = human_bytes(meta.get("mem_peak"))
+    for a in meta.get("allocations", []):
+        a["size_h"] = human_bytes(a["size"])
+    return render_template("profile_detail.html", title="Profile", active="settings", p=meta)
+
+@bp.route("/settings/profiles/<name>/download")
+def profile_download(name):
+    """Download the raw .prof file (pstats / snakeviz)"""
+    if not profiler.load(name):
+        abort(404)
+    return send_from_directory(profiler.PROFILE_DIR, f"{name}.prof", as_attachment=True)
@@ -1,37 +1,56 @@
-from flask import Blueprint, render_template, request, send_file, current_app, flash
+from flask import Blueprint, render_template, request, send_file, current_app, flash, g, Response, jsonify
 from datetime import datetime, timedelta, date
 from io import BytesIO
-import pandas as pd
-from config.mongo import get_col
+from config.mongo import get_col, query_budget, budget_exceeded, settled_before
+from utils import cache, fanout, hll, live_tokens
 from pymongo.errors import PyMongoError
-from math import ceil
+import math
+import os
+import random
 import re
 
 bp = Blueprint("tokens", __name__, url_prefix="/admin-klg/admin")
 
+# Rentang createdAt dipecah per bulan (per minggu kalau rentangnya pendek)
+# dan diagregasi paralel. Partisi yang sudah lewat tidak berubah lagi, jadi
+# di-cache jangka panjang; view setahun = cache hit + partisi berjalan.
+TOKEN_WEEKLY_MAX_DAYS = 62
+TOKEN_CLOSED_PARTITION_TTL = float(os.getenv("TOKEN_PARTITION_TTL", str(400 * 86400)))
+# Pesan per batch cursor (dan per lookup parent $in)
+TOKEN_BATCH_SIZE = int(os.getenv("TOKEN_BATCH_SIZE", "2000"))
+
+# Mode approximate: rentang createdAt dibagi TOKEN_SAMPLE_WINDOWS strata sama
+# panjang, satu jendela acak (lebar tetap, total ~TOKEN_SAMPLE_SIZE pesan) per
+# stratum; hasil di-scale dengan peluang inklusi plus confidence interval 95%.
+# Mongo hanya membaca pesan di dalam jendela (index createdAt), bukan seluruh
+# rentang
+TOKEN_SAMPLE_SIZE = int(os.getenv("TOKEN_SAMPLE_SIZE", "20000"))
+TOKEN_SAMPLE_WINDOWS = int(os.getenv("TOKEN_SAMPLE_WINDOWS", "200"))
+TOKEN_SAMPLE_ATTEMPTS = 4
+TOKEN_Z95 = 1.96
+TOKEN_METRICS = ("total_tokens", "input_tokens", "output_tokens", "total_messages")
+
 def safe_template_render(**kwargs):
     """Safe template rendering with default values"""
     defaults = {
         "title": "Token Usage",
         "active": "tokens",
-        "rows": [],
         "agents_list": [],
         "selected_agent": "general",
         "date_from": "",
         "date_to": "",
         "now_date": date.today().isoformat(),
-        "page": 1,
         "per_page": 10,
-        "total": 0,
-        "total_pages": 1,
-        "q": ""
+        "q": "",
+        "approx": False
     }
     defaults.update(kwargs)
     return render_template("tokens.html", **defaults)
 
 @bp.route("/tokens")
+@query_budget
 def admin_tokens():
-    """Token usage analysis with comprehensive error handling"""
+    """Token usage shell (filters, agent dropdown) and Excel export"""
     try:
         # Parse and validate parameters
         try:
@@ -39,14 +58,14 @@ def admin_tokens():
             date_from = request.args.get("date_from", "").strip()
             date_to = request.args.get("date_to", "").strip()
             q = (request.args.get("q", "") or "").strip()
+            approx = (request.args.get("approx") or "").lower() in ("1", "true", "yes")
             
-            # Validate pagination
-            page = max(int(request.args.get("page", 1) or 1), 1)
+            # Validate page size (dipakai tabel sebagai limit API)
             per_page = max(min(int(request.args.get("per_page", 10) or 10), 100), 5)
             
         except (ValueError, TypeError) as e:
             current_app.logger.warning(f"[Tokens] Parameter validation error: {e}")
-            page, per_page = 1, 10
+            per_page = 10
 
         # Get database collections
         try:
@@ -64,258 +83,699 @@ def admin_tokens():
             current_app.logger.error("[Tokens] Database collections unavailable")
             return safe_template_render(error="Database unavailable")
 
-        # Get agents list with error handling
-        agents_list = []
-        agents_map = {}
-        agent_name_by_id = {}
-        
-        try:
-            agents_list = list(agents_col.find({}, {"id": 1, "name": 1}).sort("name", 1))
-            
-            # Build agent mappings
-            for a in agents_col.find({}, {"id": 1, "model": 1, "name": 1}):
-                agent_id = a.get("id")
-                if agent_id:
-                    agents_map[agent_id] = a.get("model")
-                    agent_name_by_id[agent_id] = a.get("name")
-                    
-        except PyMongoError as e:
+        agents_list, agents_map, agent_name_by_id = _load_agents(agents_col)
+
+        # Handle Excel export (jangan export data yang terpotong). Tabel halaman
+        # dimuat terpisah lewat /admin-klg/api/v1/tokens
+        if request.args.get("export") == "xlsx":
+            rows = _cached_token_rows(users_col, messages_col, convos_col, agents_map, agent_name_by_id,
+                                      selected_agent, date_from, date_to, q)
+            if g.get("query_truncated"):
+                flash("Export dibatalkan: query melebihi batas waktu, data tidak lengkap", "warning")
+            else:
+                try:
+                    return _export_excel(rows, date_from, date_to)
+                except Exception as e:
+                    current_app.logger.error(f"[Tokens] Excel export error: {e}")
+                    flash("Error generating Excel export", "danger")
+
+        return safe_template_render(
+            agents_list=agents_list,
+            selected_agent=selected_agent,
+            date_from=date_from,
+            date_to=date_to,
+            per_page=per_page,
+            q=q,
+            approx=approx
+        )
+
+    except Exception as e:
+        current_app.logger.error(f"[Tokens] Route error: {e}")
+        flash("System error. Please contact administrator.", "danger")
+        return safe_template_render(error="System error")
+
+
+@bp.route("/tokens/live")
+def tokens_live():
+    """Server-Sent Events: today's per-agent/per-model counters, then deltas"""
+    # Tanpa query_budget: stream hidup sampai LIVE_STREAM_SECONDS, dan
+    # query-nya jalan di thread watcher, bukan di request ini
+    try:
+        sub = live_tokens.subscribe(current_app.logger)
+    except live_tokens.LiveUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+    return Response(
+        live_tokens.stream(sub),
+        mimetype="text/event-stream",
+        headers={"X-Accel-Buffering": "no"},
+    )
+
+
+def _load_agents(agents_col):
+    """(agents_list, {agent id: model}, {agent id: name}) from one round trip."""
+    agents_list = []
+    agents_map = {}
+    agent_name_by_id = {}
+
+    try:
+        # Satu round trip untuk dropdown dan mapping agent
+        agents_list = list(agents_col.find({}, {"id": 1, "model": 1, "name": 1}).sort("name", 1))
+
+        # Build agent mappings
+        for a in agents_list:
+            agent_id = a.get("id")
+            if agent_id:
+                agents_map[agent_id] = a.get("model")
+                agent_name_by_id[agent_id] = a.get("name")
+
+    except PyMongoError as e:
+        if not budget_exceeded(e, "[Tokens]"):
             current_app.logger.error(f"[Tokens] Error loading agents: {e}")
             flash("Error loading agent data", "warning")
+            cache.skip_store()
+    return agents_list, agents_map, agent_name_by_id
 
-        # Build users cache with error handling
-        users_cache = {}
-        try:
-            for u in users_col.find({}, {"name": 1, "email": 1}):
-                user_id = str(u["_id"])
-                users_cache[user_id] = {
-                    "name": u.get("name", "Unknown"), 
-                    "email": u.get("email")
-                }
-        except PyMongoError as e:
+
+def _cached_token_rows(users_col, messages_col, convos_col, agents_map, agent_name_by_id,
+                       selected_agent, date_from, date_to, q, dated_only=False) -> list:
+    """_token_rows() through the shared result cache."""
+    # Rollup di-cache bersama antar worker (utils.cache); pesan ditulis
+    # oleh LibreChat, jadi cukup TTL tanpa invalidasi
+    key = cache.make_key(selected_agent, date_from, date_to, q, dated_only)
+    return cache.get_or_set("tokens", key, lambda: _token_rows(
+        users_col, messages_col, convos_col, agents_map, agent_name_by_id,
+        selected_agent, date_from, date_to, q, dated_only,
+    ))
+
+
+def _load_users_cache(users_col) -> dict:
+    """{user id: {name, email}} with error handling"""
+    users_cache = {}
+    try:
+        for u in users_col.find({}, {"name": 1, "email": 1}):
+            user_id = str(u["_id"])
+            users_cache[user_id] = {
+                "name": u.get("name", "Unknown"), 
+                "email": u.get("email")
+            }
+    except PyMongoError as e:
+        if not budget_exceeded(e, "[Tokens]"):
             current_app.logger.error(f"[Tokens] Error loading users cache: {e}")
             flash("Error loading user data", "warning")
+            cache.skip_store()
+    return users_cache
+
+
+def _partitions(start, end):
+    """Split [start, end) into calendar months, or Monday-aligned weeks for short ranges."""
+    weekly = (end - start).days <= TOKEN_WEEKLY_MAX_DAYS
+    parts = []
+    lo = start
+    while lo < end:
+        if weekly:
+            day = datetime(lo.year, lo.month, lo.day)
+            nxt = day + timedelta(days=7 - day.weekday())
+        else:
+            nxt = datetime(lo.year + lo.month // 12, lo.month % 12 + 1, 1)
+        hi = min(nxt, end)
+        parts.append((lo, hi))
+        lo = hi
+    return parts
+
+
+def _first_created(messages_col, query):
+    """createdAt of the oldest matching message, or None."""
+    first = messages_col.find_one(
+        {**query, "createdAt": {"$type": "date"}},
+        {"createdAt": 1},
+        sort=[("createdAt", 1)],
+    )
+    return first["createdAt"] if first else None
+
+
+def _cached_partition(messages_col, convos_col, query, user_key, selected_agent, lo, hi):
+    """_partition_groups(), cached long-term once the partition is past and replicated."""
+    if lo is None or hi > settled_before():
+        # Partisi berjalan (dan pesan tanpa createdAt) masih bisa berubah; tepat
+        # lewat tengah malam secondary bisa belum punya pesan terakhir hari itu
+        return _partition_groups(messages_col, convos_col, query, lo, hi)
+    key = cache.make_key(selected_agent, user_key, lo, hi)
+    return cache.get_or_set("token_parts", key,
+                            lambda: _partition_groups(messages_col, convos_col, query, lo, hi),
+                            ttl=TOKEN_CLOSED_PARTITION_TTL)
+
+
+class _TokenGroup:
+    """Running sums for one (date, user id, model) group."""
+    __slots__ = ("input_tokens", "output_tokens", "messages")
+
+    def __init__(self):
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.messages = 0
+
+
+class _SampleGroup:
+    """Per-window sums of sampled values (TOKEN_METRICS order) for one group."""
+    __slots__ = ("windows",)
+
+    def __init__(self):
+        self.windows = {}
+
+    def add(self, window: int, values):
+        sums = self.windows.get(window)
+        if sums is None:
+            sums = self.windows[window] = [0] * len(TOKEN_METRICS)
+        for j, v in enumerate(values):
+            sums[j] += v
+
+    def estimate(self, k: int, scale: float) -> dict:
+        """Totals and 95% CI half-widths from one window in each of k strata (missing windows count as 0).
+
+        scale = 1 / inclusion probability of a message, so scale * (sum of
+        window totals) is an unbiased estimate of the group total. The
+        variance uses successive differences between neighbouring strata.
+        """
+        zero = [0] * len(TOKEN_METRICS)
+        series = [self.windows.get(w, zero) for w in range(k)]
+        out = {}
+        for j, name in enumerate(TOKEN_METRICS):
+            diffs = sum((b[j] - a[j]) ** 2 for a, b in zip(series, series[1:]))
+            var = scale * scale * (1 - 1 / scale) * k * diffs / (2 * (k - 1)) if k > 1 else 0.0
+            out[name] = round(scale * sum(sums[j] for sums in series))
+            out[name + "_ci"] = round(TOKEN_Z95 * math.sqrt(max(var, 0.0)))
+        return out
+
+
+def _resolve_batch(batch, messages_col, convos_col, undated):
+    """Yield (message, (date, user id, model), input, output, messages) per message of one batch.
+
+    Parents (and conversations, for messages without createdAt) are looked
+    up once per batch.
+    """
+    convos_map = {}
+    parents_map = {}
+    conv_ids = {str(m.get("conversationId")) for m in batch if m.get("conversationId")} if undated else set()
+    parent_ids = [m.get("parentMessageId") for m in batch if m.get("parentMessageId")]
+
+    # Prefetch conversations and parent messages (dua query independen, paralel)
+    with fanout.group() as fan:
+        convos_f = fan.submit(lambda: list(convos_col.find(
+            {"_id": {"$in": list(conv_ids)}}, {"createdAt": 1}))) if conv_ids else None
+        parents_f = fan.submit(lambda: list(messages_col.find(
+            {"messageId": {"$in": parent_ids}},
+            {"messageId":1,"isCreatedByUser":1,"tokenCount":1}))) if parent_ids else None
 
-        # Build messages query with error handling
-        try:
-            assistants_query = {"isCreatedByUser": {"$in": [False, "false", "False", 0]}}
-            
-            # Agent filter
-            if selected_agent != "general":
-                assistants_query["model"] = selected_agent
+    try:
+        if convos_f is not None:
+            for c in convos_f.result():
+                convos_map[str(c["_id"])] = c.get("createdAt")
+        if parents_f is not None:
+            for p in parents_f.result():
+                parents_map[p.get("messageId")] = p
+
+    except PyMongoError as e:
+        if not budget_exceeded(e, "[Tokens]"):
+            current_app.logger.error(f"[Tokens] Error fetching related data: {e}")
+            flash("Error fetching conversation data", "warning")
+            cache.skip_store()
 
-            # Date range filter
-            created_range = {}
-            if date_from:
-                try:
-                    start_dt = datetime.strptime(date_from, "%Y-%m-%d")
-                    created_range["$gte"] = start_dt
-                except ValueError as e:
-                    current_app.logger.warning(f"[Tokens] Invalid date_from format: {date_from}")
-                    flash("Invalid start date format", "warning")
-                    
-            if date_to:
-                try:
-                    end_dt_exclusive = datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1)
-                    created_range["$lt"] = end_dt_exclusive
-                except ValueError as e:
-                    current_app.logger.warning(f"[Tokens] Invalid date_to format: {date_to}")
-                    flash("Invalid end date format", "warning")
-                    
-            if created_range:
-                assistants_query["createdAt"] = created_range
-
-            # Email filter
-            if q:
-                try:
-                    email_regex = {"$regex": re.escape(q), "$options": "i"}
-                    matched_users = list(users_col.find({"email": email_regex}, {"_id": 1}))
-                    
-                    if not matched_users:
-                        return safe_template_render(
-                            agents_list=agents_list,
-                            selected_agent=selected_agent,
-                            date_from=date_from,
-                            date_to=date_to,
-                            q=q
-                        )
-                        
-                    oid_list = [u["_id"] for u in matched_users]
-                    str_list = [str(u["_id"]) for u in matched_users]
-                    assistants_query["user"] = {"$in": oid_list + str_list}
-                    
-                except PyMongoError as e:
-                    current_app.logger.error(f"[Tokens] Error filtering by email: {e}")
-                    flash("Error filtering by email", "danger")
+    for m in batch:
+        try:
+            created_at = m.get("createdAt") or convos_map.get(str(m.get("conversationId")))
+            if not created_at:
+                continue
 
-        except (ValueError, TypeError) as e:
-            current_app.logger.error(f"[Tokens] Query building error: {e}")
-            flash("Error building search query", "danger")
-            return safe_template_render()
+            try:
+                out_tokens = int(m.get("tokenCount", 0) or 0)
+            except (ValueError, TypeError):
+                out_tokens = 0
 
-        # Fetch messages data
-        assistants = []
-        try:
-            assistants = list(
-                messages_col.find(
-                    assistants_query,
-                    {"user":1,"model":1,"createdAt":1,"conversationId":1,"tokenCount":1,"parentMessageId":1}
-                )
-            )
-            current_app.logger.info(f"[Tokens] Retrieved {len(assistants)} assistant messages")
-            
-        except PyMongoError as e:
+            in_tokens = 0
+            parent = parents_map.get(m.get("parentMessageId"))
+            if parent:
+                try:
+                    raw_flag = parent.get("isCreatedByUser", False)
+                    is_user_parent = raw_flag if isinstance(raw_flag, bool) else (str(raw_flag).lower() == "true" or raw_flag == 1)
+                    if is_user_parent:
+                        in_tokens = int(parent.get("tokenCount", 0) or 0)
+                except (ValueError, TypeError):
+                    in_tokens = 0
+
+            key = (str(created_at.date()), str(m.get("user", "")), m.get("model") or "")
+            yield m, key, in_tokens, out_tokens, 2 if parent else 1
+
+        except (KeyError, TypeError, AttributeError) as e:
+            current_app.logger.warning(f"[Tokens] Error processing message record: {e}")
+            continue
+
+
+def _fold_batch(groups, batch, messages_col, convos_col, undated):
+    """Resolve one batch and fold it into groups ({key: _TokenGroup})."""
+    for _, key, in_tokens, out_tokens, messages in _resolve_batch(batch, messages_col, convos_col, undated):
+        acc = groups.get(key)
+        if acc is None:
+            acc = groups[key] = _TokenGroup()
+        acc.input_tokens += in_tokens
+        acc.output_tokens += out_tokens
+        acc.messages += messages
+
+
+def _partition_groups(messages_col, convos_col, query, lo, hi):
+    """Partial rollup [date, user id, model, input, output, messages] for one createdAt partition.
+
+    lo=None selects the messages without createdAt (dated by their conversation).
+    Groups are keyed by raw ids so cached partitions stay valid when emails or
+    agent names change; labels are applied after the merge.
+    """
+    query = dict(query)
+    query["createdAt"] = None if lo is None else {"$gte": lo, "$lt": hi}
+
+    # Cursor dibaca per batch dan langsung dilipat ke accumulator: memori
+    # sebanding jumlah group, bukan jumlah pesan (kalau budget habis, batch
+    # yang sudah terambil tetap dihitung)
+    groups = {}
+    batch = []
+    fetched = 0
+    try:
+        cursor = messages_col.find(
+            query,
+            {"user":1,"model":1,"createdAt":1,"conversationId":1,"tokenCount":1,"parentMessageId":1}
+        ).batch_size(TOKEN_BATCH_SIZE)
+        for m in cursor:
+            batch.append(m)
+            if len(batch) >= TOKEN_BATCH_SIZE:
+                _fold_batch(groups, batch, messages_col, convos_col, lo is None)
+                fetched += len(batch)
+                batch = []
+
+    except PyMongoError as e:
+        if not budget_exceeded(e, "[Tokens]"):
             current_app.logger.error(f"[Tokens] Error fetching messages: {e}")
             flash("Error fetching token data", "danger")
-            return safe_template_render()
-
-        # Prefetch conversations and parent messages
-        convos_map = {}
-        parents_map = {}
-        
-        try:
-            # Get conversation data
-            conv_ids = {str(m.get("conversationId")) for m in assistants if m.get("conversationId")}
-            if conv_ids:
-                for c in convos_col.find({"_id": {"$in": list(conv_ids)}}, {"createdAt": 1}):
-                    convos_map[str(c["_id"])] = c.get("createdAt")
-
-            # Get parent message data
-            parent_ids = [m.get("parentMessageId") for m in assistants if m.get("parentMessageId")]
-            if parent_ids:
-                for p in messages_col.find({"messageId": {"$in": parent_ids}},
-                                         {"messageId":1,"isCreatedByUser":1,"tokenCount":1}):
-                    parents_map[p.get("messageId")] = p
-                    
-        except PyMongoError as e:
-            current_app.logger.error(f"[Tokens] Error fetching related data: {e}")
-            flash("Error fetching conversation data", "warning")
+            cache.skip_store()
+            return []
+        current_app.logger.info(f"[Tokens] Partial result: {fetched + len(batch)} assistant messages")
 
-        # Process token data
-        data = []
-        for m in assistants:
-            try:
-                user_id = str(m.get("user", ""))
-                uinfo = users_cache.get(user_id, {"name":"Unknown","email":None})
+    if batch:
+        _fold_batch(groups, batch, messages_col, convos_col, lo is None)
 
-                mid_or_name = m.get("model")
-                model_name = agents_map.get(mid_or_name, mid_or_name or "Unknown Model")
+    return [
+        [day, user_id, model, acc.input_tokens, acc.output_tokens, acc.messages]
+        for (day, user_id, model), acc in groups.items()
+    ]
 
-                agent_name = agent_name_by_id.get(mid_or_name)
-                is_agent = bool(agent_name)
 
-                agent_label = agent_name if is_agent else "General"
-                model_label = model_name
+def _token_query(users_col, selected_agent, date_from, date_to, q):
+    """(messages query without createdAt, user key, start, end) or None if nothing can match.
 
-                created_at = m.get("createdAt") or convos_map.get(str(m.get("conversationId")))
-                if not created_at:
-                    continue
+    start/end are the parsed date bounds (end exclusive), None when absent
+    or invalid.
+    """
+    # Build messages query with error handling
+    try:
+        # Data lama LibreChat menyimpan flag/user dengan tipe campuran; setelah
+        # scripts.normalize_types cukup equality satu tipe (satu key index)
+        normalized = current_app.config.get("TYPES_NORMALIZED")
+        if normalized:
+            assistants_query = {"isCreatedByUser": False}
+        else:
+            assistants_query = {"isCreatedByUser": {"$in": [False, "false", "False", 0]}}
+        user_key = None
 
-                try:
-                    out_tokens = int(m.get("tokenCount", 0) or 0)
-                except (ValueError, TypeError):
-                    out_tokens = 0
-
-                in_tokens = 0
-                parent = parents_map.get(m.get("parentMessageId"))
-                if parent:
-                    try:
-                        raw_flag = parent.get("isCreatedByUser", False)
-                        is_user_parent = raw_flag if isinstance(raw_flag, bool) else (str(raw_flag).lower() == "true" or raw_flag == 1)
-                        if is_user_parent:
-                            in_tokens = int(parent.get("tokenCount", 0) or 0)
-                    except (ValueError, TypeError):
-                        in_tokens = 0
-
-                data.append({
-                    "date": str(created_at.date()),
-                    "email": uinfo.get("email"),
-                    "model": model_name,
-                    "agent_name": agent_name,
-                    "agent_label": agent_label,
-                    "model_label": model_label,
-                    "tokens": in_tokens + out_tokens,
-                    "input_tokens": in_tokens,
-                    "output_tokens": out_tokens,
-                    "messages_in_turn": 1 + (1 if parent else 0),
-                })
-                
-            except (KeyError, TypeError, AttributeError) as e:
-                current_app.logger.warning(f"[Tokens] Error processing message record: {e}")
-                continue
+        # Agent filter
+        if selected_agent != "general":
+            assistants_query["model"] = selected_agent
 
-        # Aggregate data using pandas
-        rows = []
-        try:
-            df = pd.DataFrame(data)
-            if not df.empty:
-                daily_usage = (
-                    df.groupby(["date","email","agent_label","model_label"])
-                    .agg(
-                        agent_name=("agent_name","first"),
-                        total_tokens=("tokens","sum"),
-                        input_tokens=("input_tokens","sum"),
-                        output_tokens=("output_tokens","sum"),
-                        total_messages=("messages_in_turn","sum"),
-                    )
-                    .reset_index()
-                )
-
-                rows = daily_usage.to_dict(orient="records")
-                rows.sort(
-                    key=lambda r: (
-                        r["date"],
-                        r["email"] or "",
-                        r["agent_label"] or "",
-                        r["model_label"] or "",
-                    ),
-                    reverse=True
-                )
-                
-        except (ValueError, KeyError) as e:
-            current_app.logger.error(f"[Tokens] Data aggregation error: {e}")
-            flash("Error processing token data", "danger")
-        except Exception as e:
-            current_app.logger.error(f"[Tokens] Unexpected aggregation error: {e}")
-            flash("Unexpected error processing data", "danger")
-
-        # Handle Excel export
-        if request.args.get("export") == "xlsx":
+        # Date range (dipakai sebagai batas partisi)
+        start = end = None
+        if date_from:
             try:
-                return _export_excel(rows, date_from, date_to)
-            except Exception as e:
-                current_app.logger.error(f"[Tokens] Excel export error: {e}")
-                flash("Error generating Excel export", "danger")
-
-        # Pagination
-        total = len(rows)
-        total_pages = ceil(total / per_page) if total > 0 else 1
-        start = (page - 1) * per_page
-        end = start + per_page
-        paginated_rows = rows[start:end]
+                start = datetime.strptime(date_from, "%Y-%m-%d")
+            except ValueError as e:
+                current_app.logger.warning(f"[Tokens] Invalid date_from format: {date_from}")
+                flash("Invalid start date format", "warning")
+                cache.skip_store()
 
-        return safe_template_render(
-            rows=paginated_rows,
-            agents_list=agents_list,
-            selected_agent=selected_agent,
-            date_from=date_from,
-            date_to=date_to,
-            page=page,
-            per_page=per_page,
-            total=total,
-            total_pages=total_pages,
-            q=q
-        )
-
-    except Exception as e:
-        current_app.logger.error(f"[Tokens] Route error: {e}")
-        flash("System error. Please contact administrator.", "danger")
-        return safe_template_render(error="System error")
+        if date_to:
+            try:
+                end = datetime.strptime(date_to, "%Y-%m-%d") + timedelta(days=1)
+            except ValueError as e:
+                current_app.logger.warning(f"[Tokens] Invalid date_to format: {date_to}")
+                flash("Invalid end date format", "warning")
+                cache.skip_store()
+
+        # Email filter
+        if q:
+            try:
+                email_regex = {"$regex": re.escape(q), "$options": "i"}
+                matched_users = list(users_col.find({"email": email_regex}, {"_id": 1}))
+
+                if not matched_users:
+                    return None
+
+                oid_list = [u["_id"] for u in matched_users]
+                str_list = [str(u["_id"]) for u in matched_users]
+                assistants_query["user"] = {"$in": str_list if normalized else oid_list + str_list}
+                user_key = sorted(str_list)
+
+            except PyMongoError as e:
+                if budget_exceeded(e, "[Tokens]"):
+                    # Tanpa filter user hasilnya bukan "partial", jadi jangan lanjut
+                    return None
+                current_app.logger.error(f"[Tokens] Error filtering by email: {e}")
+                flash("Error filtering by email", "danger")
+                cache.skip_store()
+
+    except (ValueError, TypeError) as e:
+        current_app.logger.error(f"[Tokens] Query building error: {e}")
+        flash("Error building search query", "danger")
+        cache.skip_store()
+        return None
+
+    return assistants_query, user_key, start, end
+
+
+def _labels(key, users_cache, agents_map, agent_name_by_id):
+    """(date, email, agent_label, model_label, agent_name) for a raw (date, user id, model) key."""
+    day, user_id, model = key
+    uinfo = users_cache.get(user_id, {"name":"Unknown","email":None})
+    agent_name = agent_name_by_id.get(model)
+    agent_label = agent_name or "General"
+    model_label = agents_map.get(model, model or "Unknown Model")
+    return day, uinfo.get("email"), agent_label, model_label, agent_name
+
+
+def _sort_rows(rows):
+    rows.sort(
+        key=lambda r: (
+            r["date"],
+            r["email"] or "",
+            r["agent_label"] or "",
+            r["model_label"] or "",
+        ),
+        reverse=True
+    )
+    return rows
+
+
+def _token_rows(users_col, messages_col, convos_col, agents_map, agent_name_by_id,
+                selected_agent, date_from, date_to, q, dated_only=False):
+    """Daily token rollup per (date, email, agent, model) for the given filters.
+
+    The createdAt range is split into partitions (_partitions) that are
+    aggregated concurrently and merged by summing; closed partitions come
+    from the shared cache. dated_only leaves out messages without createdAt
+    (as the approximate mode does).
+    """
+    # Users cache tidak bergantung pada query messages -> dimuat paralel
+    with fanout.group() as fan:
+        users_f = fan.submit(_load_users_cache, users_col)
+
+        plan = _token_query(users_col, selected_agent, date_from, date_to, q)
+        if plan is None:
+            return []
+        assistants_query, user_key, start, end = plan
+        bounded = start is not None or end is not None
+
+        # Tanpa date_from: partisi mulai dari pesan paling lama
+        try:
+            if start is None:
+                first = _first_created(messages_col, assistants_query)
+                if first is not None:
+                    start = datetime(first.year, first.month, first.day)
+            if end is None:
+                end = datetime.combine(datetime.utcnow().date(), datetime.min.time()) + timedelta(days=1)
+        except PyMongoError as e:
+            if not budget_exceeded(e, "[Tokens]"):
+                current_app.logger.error(f"[Tokens] Error planning partitions: {e}")
+                flash("Error fetching token data", "danger")
+                cache.skip_store()
+            return []
+
+        parts = _partitions(start, end) if start is not None else []
+        # Pesan tanpa createdAt hanya ikut kalau tidak ada filter tanggal
+        if not bounded and not dated_only:
+            parts.append((None, None))
+        part_fs = [
+            fan.submit(_cached_partition, messages_col, convos_col, assistants_query,
+                       user_key, selected_agent, lo, hi)
+            for lo, hi in parts
+        ]
+        current_app.logger.info(f"[Tokens] Aggregating {len(parts)} partitions")
+
+    users_cache = users_f.result()
+
+    # Merge partial sums (asosiatif: urutan partisi tidak berpengaruh)
+    merged = {}
+    for fut in part_fs:
+        for day, user_id, model, in_tokens, out_tokens, messages in fut.result():
+            label = _labels((day, user_id, model), users_cache, agents_map, agent_name_by_id)
+            acc = merged.get(label[:4])
+            if acc is None:
+                acc = merged[label[:4]] = {
+                    "date": label[0],
+                    "email": label[1],
+                    "agent_label": label[2],
+                    "model_label": label[3],
+                    "agent_name": label[4],
+                    "total_tokens": 0,
+                    "input_tokens": 0,
+                    "output_tokens": 0,
+                    "total_messages": 0,
+                }
+            acc["total_tokens"] += in_tokens + out_tokens
+            acc["input_tokens"] += in_tokens
+            acc["output_tokens"] += out_tokens
+            acc["total_messages"] += messages
+
+    return _sort_rows(list(merged.values()))
+
+
+def _daily_totals(rows):
+    """Per-date sums of exact rollup rows, oldest first."""
+    days = {}
+    for r in rows:
+        d = days.setdefault(r["date"], dict.fromkeys(TOKEN_METRICS, 0))
+        for k in TOKEN_METRICS:
+            d[k] += r[k]
+    return [{"date": day, **days[day]} for day in sorted(days)]
+
+
+def _sample_windows(messages_col, query, start, end, head):
+    """One random createdAt window per stratum, sized for ~TOKEN_SAMPLE_SIZE messages in total.
+
+    query must already restrict createdAt to dated messages in [start, end);
+    head is the createdAt of its first TOKEN_SAMPLE_SIZE + 1 messages. The
+    range is cut into TOKEN_SAMPLE_WINDOWS equal strata and each gets a
+    window at a uniform random offset that wraps around inside its stratum,
+    so every message is sampled with probability width / stratum.
+    Returns (window offsets in seconds from their stratum start, stratum
+    length in seconds, width in seconds, window filter).
+    """
+    k = TOKEN_SAMPLE_WINDOWS
+    stratum = (end - start).total_seconds() / k
+    # Lebar hanya memengaruhi biaya, bukan bias: disesuaikan kalau kerapatan
+    # di luar awal rentang berbeda (count dengan limit, hanya key index)
+    width = max((head[-1] - head[0]).total_seconds(), 1.0) / k
+    for attempt in range(TOKEN_SAMPLE_ATTEMPTS):
+        width = min(width, stratum)
+        offsets = [random.uniform(0, stratum) for _ in range(k)]
+        intervals = []
+        for j, off in enumerate(offsets):
+            lo = j * stratum
+            if off + width > stratum:
+                intervals.append([lo, lo + off + width - stratum])
+                intervals.append([lo + off, lo + stratum])
+            else:
+                intervals.append([lo + off, lo + off + width])
+        merged = []
+        for lo, hi in intervals:
+            if merged and lo <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], hi)
+            else:
+                merged.append([lo, hi])
+        windows = {"$or": [
+            {"createdAt": {"$gte": start + timedelta(seconds=lo), "$lt": start + timedelta(seconds=hi)}}
+            for lo, hi in merged
+        ]}
+        if attempt == TOKEN_SAMPLE_ATTEMPTS - 1 or width >= stratum:
+            break
+        found = messages_col.count_documents({**query, **windows}, limit=2 * TOKEN_SAMPLE_SIZE + 1)
+        if found > 2 * TOKEN_SAMPLE_SIZE:
+            width /= 4
+        elif found < TOKEN_SAMPLE_SIZE / 2:
+            width *= min(TOKEN_SAMPLE_SIZE / max(found, 1), 8)
+        else:
+            break
+    return offsets, stratum, width, windows
+
+
+def _approx_rollup(users_col, messages_col, convos_col, agents_map, agent_name_by_id,
+                   selected_agent, date_from, date_to, q) -> dict:
+    """Estimated rollup from random createdAt windows holding ~TOKEN_SAMPLE_SIZE messages.
+
+    Returns {"rows", "daily", "totals", "sampled", "population", "exact"};
+    every figure has a "<metric>_ci" 95% half-width and population is an
+    estimate too. Groups that no window hit are absent. Messages without
+    createdAt are left out. When the range has at most TOKEN_SAMPLE_SIZE
+    messages the exact rollup (also without undated messages) is used
+    instead (exact=True, CIs 0).
+    """
+    result = {"rows": [], "daily": [], "totals": dict.fromkeys(TOKEN_METRICS, 0),
+              "sampled": 0, "population": 0, "exact": False}
+    with fanout.group() as fan:
+        users_f = fan.submit(_load_users_cache, users_col)
+
+        plan = _token_query(users_col, selected_agent, date_from, date_to, q)
+        if plan is None:
+            return result
+        query, _, start, end = plan
+        try:
+            if start is None:
+                first = _first_created(messages_col, query)
+                if first is None:
+                    return result
+                start = datetime(first.year, first.month, first.day)
+            if end is None:
+                end = datetime.combine(datetime.utcnow().date(), datetime.min.time()) + timedelta(days=1)
+            query = {**query, "createdAt": {"$type": "date", "$gte": start, "$lt": end}}
+            # Index scan terbatas: cek "range kecil" sekaligus kerapatan awal
+            head = [m["createdAt"] for m in messages_col.find(query, {"createdAt": 1, "_id": 0})
+                    .sort("createdAt", 1).limit(TOKEN_SAMPLE_SIZE + 1)]
+            plan = None
+            if len(head) > TOKEN_SAMPLE_SIZE:
+                # Strata hanya di antara pesan pertama dan terakhir: rentang
+                # kosong di tepi tidak memakan jendela
+                last = messages_col.find_one(query, {"createdAt": 1}, sort=[("createdAt", -1)])
+                start, end = head[0], last["createdAt"] + timedelta(milliseconds=1)
+                plan = _sample_windows(messages_col, query, start, end, head)
+        except PyMongoError as e:
+            if not budget_exceeded(e, "[Tokens]"):
+                current_app.logger.error(f"[Tokens] Error sampling messages: {e}")
+                flash("Error fetching token data", "danger")
+                cache.skip_store()
+            return result
+
+    if plan is None:
+        rows = _cached_token_rows(users_col, messages_col, convos_col, agents_map, agent_name_by_id,
+                                  selected_agent, date_from, date_to, q, dated_only=True)
+        zero = {k + "_ci": 0 for k in TOKEN_METRICS}
+        daily = _daily_totals(rows)
+        totals = dict.fromkeys(TOKEN_METRICS, 0)
+        for d in daily:
+            for k in TOKEN_METRICS:
+                totals[k] += d[k]
+        population = len(head)
+        return {
+            "rows": [{**r, **zero} for r in rows],
+            "daily": [{**d, **zero} for d in daily],
+            "totals": {**totals, **zero},
+            "sampled": population,
+            "population": population,
+            "exact": True,
+        }
+
+    offsets, stratum, width, windows = plan
+    k = len(offsets)
+    scale = stratum / width
+    users_cache = users_f.result()
+    groups, days, overall = {}, {}, _SampleGroup()
+    hits = 0  # pesan yang jatuh di jendela stratumnya
+    sampled = 0
+
+    def fold(batch):
+        nonlocal hits
+        for m, key, in_tokens, out_tokens, messages in _resolve_batch(batch, messages_col, convos_col, False):
+            values = (in_tokens + out_tokens, in_tokens, out_tokens, messages)
+            t = (m["createdAt"] - start).total_seconds()
+            w = min(int(t // stratum), k - 1)
+            if (t - w * stratum - offsets[w]) % stratum >= width:
+                continue  # pembulatan batas jendela ke milidetik di query
+            label = _labels(key, users_cache, agents_map, agent_name_by_id)
+            group = groups.get(label)
+            if group is None:
+                group = groups[label] = _SampleGroup()
+            day = days.get(key[0])
+            if day is None:
+                day = days[key[0]] = _SampleGroup()
+            group.add(w, values)
+            day.add(w, values)
+            overall.add(w, values)
+            hits += 1
+
+    batch = []
+    try:
+        cursor = messages_col.find(
+            {**query, **windows},
+            {"user":1,"model":1,"createdAt":1,"conversationId":1,"tokenCount":1,"parentMessageId":1}
+        ).batch_size(TOKEN_BATCH_SIZE)
+        for m in cursor:
+            batch.append(m)
+            if len(batch) >= TOKEN_BATCH_SIZE:
+                fold(batch)
+                sampled += len(batch)
+                batch = []
+    except PyMongoError as e:
+        # Jendela yang terpotong membuat estimasi bias -> jangan tampilkan
+        if not budget_exceeded(e, "[Tokens]"):
+            current_app.logger.error(f"[Tokens] Error sampling messages: {e}")
+            flash("Error fetching token data", "danger")
+            cache.skip_store()
+        return result
+    if batch:
+        fold(batch)
+        sampled += len(batch)
+
+    rows = [
+        {"date": day, "email": email, "agent_label": agent_label, "model_label": model_label,
+         "agent_name": agent_name, **acc.estimate(k, scale)}
+        for (day, email, agent_label, model_label, agent_name), acc in groups.items()
+    ]
+    result.update(
+        rows=_sort_rows(rows),
+        daily=[{"date": day, **days[day].estimate(k, scale)} for day in sorted(days)],
+        totals=overall.estimate(k, scale),
+        sampled=sampled,
+        population=round(scale * hits),
+    )
+    current_app.logger.info(f"[Tokens] Approximate rollup from {sampled} messages in {k} windows")
+    return result
+
+
+def _cached_approx_rollup(users_col, messages_col, convos_col, agents_map, agent_name_by_id,
+                          selected_agent, date_from, date_to, q) -> dict:
+    """_approx_rollup() through the shared result cache (one sample per TTL, stable pages)."""
+    key = cache.make_key("approx", TOKEN_SAMPLE_SIZE, selected_agent, date_from, date_to, q)
+    return cache.get_or_set("tokens", key, lambda: _approx_rollup(
+        users_col, messages_col, convos_col, agents_map, agent_name_by_id,
+        selected_agent, date_from, date_to, q,
+    ))
+
+
+def _active_users(users_col, messages_col, selected_agent, date_from, date_to, q):
+    """Estimated distinct users with assistant messages for the filters, or None on error.
+
+    Merges per-day HyperLogLog sketches (utils.hll) instead of a distinct()
+    over the range; messages without createdAt are not counted.
+    """
+    plan = _token_query(users_col, selected_agent, date_from, date_to, q)
+    if plan is None:
+        return 0
+    assistants_query, _, start, end = plan
+    try:
+        return hll.distinct_count(messages_col, assistants_query, "user", start, end)
+    except PyMongoError as e:
+        if not budget_exceeded(e, "[Tokens]"):
+            current_app.logger.error(f"[Tokens] Error estimating active users: {e}")
+            cache.skip_store()
+        return None
 
 
 def _export_excel(rows, date_from, date_to):
     """Export tokens data to Excel with error handling"""
     try:
+        import pandas as pd
         df_x = pd.DataFrame(rows)
         if df_x.empty:
             df_x = pd.DataFrame(columns=[
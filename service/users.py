@@ -157,6 +157,8 @@ def change_role(id):
             )
             
             if result.modified_count > 0:
+                # Tidak ada cache yang perlu di-invalidate: namespace "users"
+                # hanya menyimpan name/email, role selalu dibaca langsung
                 flash(f"Role successfully changed to {new_role}", "success")
                 current_app.logger.info(f"[Users] Role changed for user {id}: {new_role}")
             else:
@@ -0,0 +1,95 @@
+/* Helper untuk halaman yang memuat tabel/stat dari /admin-klg/api/v1 */
+(function () {
+  "use strict";
+
+  function esc(value) {
+    if (value === null || value === undefined) return "";
+    return String(value)
+      .replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;")
+      .replace(/"/g, "&quot;").replace(/'/g, "&#39;");
+  }
+
+  function num(value) {
+    return Number(value || 0).toLocaleString("en-US");
+  }
+
+  function alert(category, message) {
+    var box = document.getElementById("api-alerts");
+    if (!box) return;
+    var div = document.createElement("div");
+    div.className = "alert alert-" + category + " alert-dismissible fade show";
+    div.setAttribute("role", "alert");
+    div.innerHTML = esc(message) + '<button type="button" class="btn-close" data-bs-dismiss="alert"></button>';
+    box.appendChild(div);
+  }
+
+  var truncatedShown = false;
+
+  // GET JSON; flash messages dan flag "partial" dari server ditampilkan di #api-alerts
+  function get(url) {
+    return fetch(url, { credentials: "same-origin", headers: { Accept: "application/json" } })
+      .then(function (resp) {
+        if (resp.status === 401) {
+          // URL login dari url_for (base.html), bukan path hardcode
+          window.location = document.body.dataset.loginUrl + "?next=" +
+            encodeURIComponent(window.location.pathname + window.location.search);
+          throw new Error("Authentication required");
+        }
+        return resp.json().then(function (body) {
+          if (!resp.ok) throw new Error(body.error || resp.statusText);
+          (body.messages || []).forEach(function (m) { alert(m.category, m.message); });
+          if (body.partial && !truncatedShown) {
+            truncatedShown = true;
+            alert("info", "Truncated: query melebihi batas waktu. Data yang tampil mungkin tidak lengkap — persempit rentang tanggal atau filter.");
+          }
+          return body;
+        });
+      });
+  }
+
+  function query(params) {
+    var qs = new URLSearchParams();
+    Object.keys(params).forEach(function (k) {
+      if (params[k] !== "" && params[k] !== null && params[k] !== undefined) qs.set(k, params[k]);
+    });
+    return qs.toString();
+  }
+
+  // Tabel dengan tombol "Load more": fetch halaman berikut pakai next_cursor
+  function pagedTable(opts) {
+    var tbody = document.getElementById(opts.tbody);
+    var more = document.getElementById(opts.more);
+    var shown = document.getElementById(opts.shown);
+    var cursor = null;
+    var count = 0;
+
+    function load() {
+      more.disabled = true;
+      var params = Object.assign({}, opts.params, { limit: opts.limit });
+      if (cursor) params.cursor = cursor;
+      return get(opts.url + "?" + query(params)).then(function (body) {
+        if (!cursor) tbody.innerHTML = "";
+        body.data.forEach(function (row) {
+          count += 1;
+          tbody.insertAdjacentHTML("beforeend", opts.row(row, count));
+        });
+        if (!count) tbody.innerHTML = '<tr><td colspan="' + opts.colspan + '" class="text-center text-secondary py-4">' + esc(opts.empty) + "</td></tr>";
+        cursor = body.next_cursor;
+        more.classList.toggle("d-none", !cursor);
+        more.disabled = false;
+        if (shown) shown.textContent = num(count);
+        if (opts.loaded) opts.loaded(body);
+        return body;
+      }).catch(function (err) {
+        more.disabled = false;
+        if (!count) tbody.innerHTML = '<tr><td colspan="' + opts.colspan + '" class="text-center text-danger py-4">' + esc(err.message) + "</td></tr>";
+        else alert("danger", err.message);
+      });
+    }
+
+    more.addEventListener("click", load);
+    return load();
+  }
+
+  window.KlgApi = { get: get, esc: esc, num: num, query: query, alert: alert, pagedTable: pagedTable };
+})();
@@ -0,0 +1,176 @@
+# utils/assets.py
+# Static asset fingerprinting. build() menyalin static/ ke static/dist/ dengan
+# hash isi di nama file (bootstrap.min.<hash>.css), menulis ulang url() di CSS
+# ke nama ber-hash, dan membuat varian .gz/.br. Runtime: asset_url() di
+# template memakai manifest, /assets/<file> melayani varian terkompresi sesuai
+# Accept-Encoding dengan Cache-Control immutable. Tanpa manifest (dev, belum
+# build) asset_url() jatuh ke /static biasa.
+#
+#   python -m scripts.build_assets
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import abort, request, send_file, url_for
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+DIST = "dist"
+MANIFEST = "manifest.json"
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Font/gambar sudah terkompresi; gzip/brotli hanya untuk teks
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".html", ".map"}
+_CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+_manifest = {}   # path logis -> path ber-hash (relatif ke dist/)
+_variants = {}   # path ber-hash -> {"br": bool, "gz": bool}
+
+
+def _hashed_name(rel: str, data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    stem, ext = os.path.splitext(rel)
+    return f"{stem}.{digest}{ext}"
+
+
+def _rewrite_css(rel: str, css: str, manifest: dict) -> str:
+    """Point relative url() references in a CSS file at their hashed names."""
+    base = os.path.dirname(rel)
+
+    def repl(m):
+        quote, url = m.group(1), m.group(2)
+        if url.startswith(("data:", "http:", "https:", "//", "/", "#")):
+            return m.group(0)
+        path = re.split(r"[?#]", url, maxsplit=1)[0]
+        target = os.path.normpath(os.path.join(base, path)).replace(os.sep, "/")
+        hashed = manifest.get(target)
+        if not hashed:
+            return m.group(0)
+        return f"url({quote}{os.path.relpath(hashed, base or '.').replace(os.sep, '/')}{quote})"
+
+    return _CSS_URL.sub(repl, css)
+
+
+def _compress(path: str, data: bytes) -> dict:
+    """Write .gz (and .br if the brotli module is installed) when smaller."""
+    out = {"gz": False, "br": False}
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data):
+        with open(path + ".gz", "wb") as f:
+            f.write(gz)
+        out["gz"] = True
+    try:
+        import brotli
+    except ImportError:
+        return out
+    br = brotli.compress(data, quality=11)
+    if len(br) < len(data):
+        with open(path + ".br", "wb") as f:
+            f.write(br)
+        out["br"] = True
+    return out
+
+
+def build(static_dir: str = STATIC_DIR, log=print) -> dict:
+    """(Re)build static/dist and its manifest; returns the manifest."""
+    dist = os.path.join(static_dir, DIST)
+    shutil.rmtree(dist, ignore_errors=True)
+
+    sources = []
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != dist)
+        for name in sorted(files):
+            if name.endswith(".map") or name.startswith("."):
+                continue
+            sources.append(os.path.relpath(os.path.join(root, name), static_dir).replace(os.sep, "/"))
+    # CSS terakhir: url() di dalamnya butuh nama ber-hash font/gambar
+    sources.sort(key=lambda rel: (rel.endswith(".css"), rel))
+
+    manifest = {}
+    variants = {}
+    for rel in sources:
+        with open(os.path.join(static_dir, rel), "rb") as f:
+            data = f.read()
+        if rel.endswith(".css"):
+            data = _rewrite_css(rel, data.decode("utf-8"), manifest).encode("utf-8")
+        hashed = _hashed_name(rel, data)
+        target = os.path.join(dist, hashed)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as f:
+            f.write(data)
+        manifest[rel] = hashed
+        if os.path.splitext(rel)[1] in COMPRESSIBLE:
+            variants[hashed] = _compress(target, data)
+        log(f"[Assets] {rel} -> {DIST}/{hashed}")
+
+    with open(os.path.join(dist, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump({"files": manifest, "variants": variants}, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(app, static_dir: str = STATIC_DIR):
+    """Read static/dist/manifest.json; stale entries (source newer) are ignored."""
+    global _manifest, _variants
+    path = os.path.join(static_dir, DIST, MANIFEST)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        built_at = os.path.getmtime(path)
+    except (OSError, ValueError):
+        app.logger.info("[Assets] No asset manifest; serving /static without fingerprints")
+        _manifest, _variants = {}, {}
+        return
+
+    manifest = {}
+    for rel, hashed in (data.get("files") or {}).items():
+        try:
+            if os.path.getmtime(os.path.join(static_dir, rel)) > built_at:
+                app.logger.warning(f"[Assets] {rel} changed after build; run python -m scripts.build_assets")
+                continue
+        except OSError:
+            continue
+        manifest[rel] = hashed
+    _manifest, _variants = manifest, data.get("variants") or {}
+
+
+def asset_url(path: str) -> str:
+    """Fingerprinted URL for a file under static/, or the plain /static URL."""
+    hashed = _manifest.get(path)
+    if hashed:
+        return url_for("asset", filename=hashed)
+    return url_for("static", filename=path)
+
+
+def serve_asset(filename: str):
+    """Serve a built asset, picking the .br/.gz variant the client accepts."""
+    if filename not in _variants and filename not in _manifest.values():
+        abort(404)
+    path = os.path.join(STATIC_DIR, DIST, filename)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    variant = _variants.get(filename) or {}
+    encoding = None
+    if variant.get("br") and request.accept_encodings["br"]:
+        encoding = "br"
+    elif variant.get("gz") and request.accept_encodings["gzip"]:
+        encoding = "gzip"
+    if encoding:
+        path += ".br" if encoding == "br" else ".gz"
+
+    try:
+        resp = send_file(path, mimetype=mimetype, conditional=True, max_age=31536000)
+    except FileNotFoundError:
+        abort(404)
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    resp.headers["Cache-Control"] = IMMUTABLE
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+
+def init_app(app):
+    load_manifest(app)
+    app.add_url_rule("/assets/<path:filename>", "asset", serve_asset)
+    app.jinja_env.globals["asset_url"] = asset_url
@@ -0,0 +1,241 @@
+# utils/cache.py
+# Cache hasil agregasi yang dipakai bersama oleh semua worker gunicorn di satu
+# host: SQLite (WAL) di CACHE_PATH. Entry punya TTL, total ukuran dibatasi
+# CACHE_MAX_BYTES (LRU). Kalau SQLite error, cache dianggap miss.
+#
+# Yang di-cache hanya turunan data yang ditulis LibreChat (messages, files,
+# users name/email, jumlah balances); kesegarannya dijaga TTL. Write route
+# dashboard saat ini (role user, tokenCredits, kategori) tidak mengubah nilai
+# yang di-cache, dan Apply target Mongo baru sudah masuk key (_scope), jadi
+# belum ada yang memanggil invalidate(). Route baru yang menulis field yang
+# ikut di-cache wajib memanggil invalidate() untuk namespace-nya.
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+
+from flask import current_app, g, has_app_context, has_request_context
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+CACHE_PATH = os.getenv("CACHE_PATH", os.path.join("/tmp", "klg-cache.sqlite3"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Kolom "accessed" (untuk LRU) cukup di-update sesekali, bukan tiap hit
+TOUCH_INTERVAL = 30.0
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS entries (
+        ns TEXT NOT NULL, key TEXT NOT NULL, gen INTEGER NOT NULL,
+        value TEXT NOT NULL, size INTEGER NOT NULL,
+        expires REAL NOT NULL, accessed REAL NOT NULL,
+        PRIMARY KEY (ns, key))""",
+    "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)",
+    "CREATE TABLE IF NOT EXISTS generations (ns TEXT PRIMARY KEY, gen INTEGER NOT NULL)",
+)
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+stats = {}  # (namespace, result) -> count, untuk /metrics
+
+
+def _reset_after_fork():
+    global _local, _stats_lock
+    # Koneksi SQLite tidak boleh dipakai lintas fork
+    _local = threading.local()
+    _stats_lock = threading.Lock()
+    stats.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _count(ns: str, result: str):
+    with _stats_lock:
+        stats[(ns, result)] = stats.get((ns, result), 0) + 1
+
+
+def _log(msg: str):
+    if has_app_context():
+        current_app.logger.warning(f"[Cache] {msg}")
+
+
+def _conn() -> sqlite3.Connection:
+    """One connection per thread; created (and the schema ensured) lazily."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(CACHE_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(CACHE_PATH, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for stmt in _SCHEMA:
+            conn.execute(stmt)
+        _local.conn = conn
+    return conn
+
+
+def _json_default(o):
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    if hasattr(o, "item"):  # scalar numpy/pandas
+        return o.item()
+    raise TypeError(f"{type(o).__name__} is not cacheable")
+
+
+def _scope() -> str:
+    """Entries are scoped to the active Mongo target (Apply di Settings)."""
+    if not has_app_context():
+        return ""
+    return f"{current_app.config.get('MONGO_URI')}|{current_app.config.get('MONGO_DB')}"
+
+
+def make_key(*parts) -> str:
+    raw = json.dumps([_scope(), *parts], sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _generation(conn, ns: str) -> int:
+    row = conn.execute("SELECT gen FROM generations WHERE ns = ?", (ns,)).fetchone()
+    return row[0] if row else 0
+
+
+def _get(conn, ns: str, key: str):
+    now = time.time()
+    row = conn.execute(
+        "SELECT e.value, e.expires, e.accessed FROM entries e"
+        " LEFT JOIN generations g ON g.ns = e.ns"
+        " WHERE e.ns = ? AND e.key = ? AND e.gen = COALESCE(g.gen, 0)",
+        (ns, key),
+    ).fetchone()
+    if row is None or row[1] <= now:
+        return None
+    if now - row[2] > TOUCH_INTERVAL:
+        conn.execute("UPDATE entries SET accessed = ? WHERE ns = ? AND key = ?", (now, ns, key))
+    return row[0]
+
+
+def _put(conn, ns: str, key: str, gen: int, payload: str, ttl: float):
+    size = len(payload)
+    if size > CACHE_MAX_BYTES // 4:
+        return
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Jangan simpan hasil yang dihitung sebelum invalidate() terakhir
+        if _generation(conn, ns) != gen:
+            conn.execute("ROLLBACK")
+            return
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (ns, key, gen, value, size, expires, accessed)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (ns, key, gen, payload, size, now + ttl, now),
+        )
+        _evict(conn, now)
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+
+def _evict(conn, now: float):
+    """Drop expired entries, then least recently used ones, down to 90% of the cap."""
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+    if total <= CACHE_MAX_BYTES:
+        return
+    conn.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+    target = CACHE_MAX_BYTES * 0.9
+    for ns, key, size in conn.execute(
+        "SELECT ns, key, size FROM entries ORDER BY accessed"
+    ).fetchall():
+        if total <= target:
+            break
+        conn.execute("DELETE FROM entries WHERE ns = ? AND key = ?", (ns, key))
+        total -= size
+        _count(ns, "evicted")
+
+
+def skip_store():
+    """Mark the current request's result as incomplete: don't cache it."""
+    if has_request_context():
+        g.cache_skip = True
+
+
+def _storable() -> bool:
+    if not has_request_context():
+        return True
+    return not (g.get("query_truncated") or g.get("cache_skip"))
+
+
+def get_or_set(ns: str, key: str, compute, ttl: float = None):
+    """Return the cached value for (ns, key), computing and storing it on a miss.
+
+    Values must be JSON-serialisable (dates come back as ISO strings).
+    Results of a request that hit its query budget or called skip_store()
+    are returned but not stored.
+    """
+    if not CACHE_ENABLED:
+        return compute()
+    try:
+        conn = _conn()
+        gen = _generation(conn, ns)
+        payload = _get(conn, ns, key)
+    except sqlite3.Error as e:
+        _log(f"Lookup failed for {ns}: {e}")
+        _count(ns, "error")
+        return compute()
+    if payload is not None:
+        _count(ns, "hit")
+        return json.loads(payload)
+
+    _count(ns, "miss")
+    value = compute()
+    if _storable():
+        try:
+            _put(conn, ns, key, gen, json.dumps(value, default=_json_default), ttl or CACHE_TTL)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            _log(f"Store failed for {ns}: {e}")
+            _count(ns, "error")
+    return value
+
+
+def invalidate(*namespaces: str):
+    """Drop every entry of the given namespaces, in all workers on this host.
+
+    Hook for write routes that change a cached value; none do today (see
+    the module header).
+    """
+    if not CACHE_ENABLED:
+        return
+    conn = None
+    try:
+        conn = _conn()
+        conn.execute("BEGIN IMMEDIATE")
+        for ns in namespaces:
+            conn.execute(
+                "INSERT INTO generations (ns, gen) VALUES (?, 1)"
+                " ON CONFLICT (ns) DO UPDATE SET gen = gen + 1",
+                (ns,),
+            )
+            conn.execute("DELETE FROM entries WHERE ns = ?", (ns,))
+        conn.execute("COMMIT")
+    except sqlite3.Error as e:
+        if conn is not None and conn.in_transaction:
+            conn.execute("ROLLBACK")
+        _log(f"Invalidate failed for {', '.join(namespaces)}: {e}")
+
+
+def summary() -> dict:
+    """Entry count and bytes per namespace (for diagnostics)."""
+    try:
+        rows = _conn().execute(
+            "SELECT ns, COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE expires > ? GROUP BY ns",
+            (time.time(),),
+        ).fetchall()
+    except sqlite3.Error:
+        return {}
+    return {ns: {"entries": n, "bytes": size} for ns, n, size in rows}
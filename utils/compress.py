@@ -0,0 +1,35 @@
+# utils/compress.py
+# Gzip response HTML/JSON admin kalau browser menerima gzip (header Accept-Encoding).
+# Asset statis tidak lewat sini: sudah dikompres saat build (utils.assets).
+import gzip
+import os
+
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_TYPES = {"text/html", "application/json", "text/plain", "text/csv"}
+
+
+def gzip_response(resp, accept_encodings):
+    """Compress resp in place when it is a buffered, uncompressed text response."""
+    if (
+        resp.direct_passthrough
+        or resp.is_streamed
+        or resp.status_code < 200
+        or resp.status_code in (204, 206, 304)
+        or "Content-Encoding" in resp.headers
+        or resp.mimetype not in COMPRESS_TYPES
+    ):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    if not accept_encodings["gzip"]:
+        return resp
+
+    data = resp.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return resp
+    resp.set_data(gzip.compress(data, compresslevel=COMPRESS_LEVEL))
+    resp.headers["Content-Encoding"] = "gzip"
+    # ETag isi tidak lagi cocok dengan body terkompresi
+    if resp.headers.get("ETag"):
+        resp.set_etag(resp.get_etag()[0], weak=True)
+    return resp
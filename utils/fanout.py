@@ -0,0 +1,82 @@
+# utils/fanout.py
+# Fan-out query independen dalam satu request ke thread pool per proses, lalu
+# join. Tiap task jalan di salinan contextvars request (request/app context
+# Flask, budget pymongo.timeout(), utils.timing), jadi current_app, g,
+# Server-Timing dan maxTimeMS tetap berlaku seperti di thread request.
+#
+#     with fanout.group() as fan:
+#         count_f = fan.submit(col.count_documents, query)
+#         agg_f = fan.submit(lambda: list(col.aggregate(pipe)))
+#     total = count_f.result()  # exception task muncul di sini
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", "8"))
+
+_pool = None
+_pool_lock = threading.Lock()
+_in_task = threading.local()
+
+
+def _reset_after_fork():
+    # Thread pool milik parent tidak ikut ter-fork
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+    return _pool
+
+
+def _run_in_task(fn, args, kwargs):
+    _in_task.active = True
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _in_task.active = False
+
+
+def _inline(fn, args, kwargs) -> Future:
+    fut = Future()
+    try:
+        fut.set_result(fn(*args, **kwargs))
+    except BaseException as e:
+        fut.set_exception(e)
+    return fut
+
+
+class group:
+    """Request-scoped set of concurrent tasks; leaving the block joins them all."""
+
+    def __init__(self):
+        self._futures = []
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        # Task yang submit lagi dijalankan inline: pool tidak boleh menunggu
+        # dirinya sendiri (deadlock kalau semua worker pool sedang menunggu)
+        if FANOUT_WORKERS <= 0 or getattr(_in_task, "active", False):
+            return _inline(fn, args, kwargs)
+        ctx = contextvars.copy_context()
+        fut = _executor().submit(ctx.run, _run_in_task, fn, args, kwargs)
+        self._futures.append(fut)
+        return fut
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Jangan biarkan query jalan melewati umur request
+        wait(self._futures)
+        return False
@@ -1,5 +1,6 @@
 import re
 from datetime import datetime
+from math import ceil
 
 def kebab(s: str) -> str:
     s = s.strip().lower()
@@ -23,3 +24,11 @@ def human_bytes(n):
         f /= 1024.0
         i += 1
     return f"{f:.0f} {units[i]}" if i == 0 else f"{f:.2f} {units[i]}"
+
+def percentile(values, p):
+    """Nearest-rank percentile (p in 0..100); None for an empty list."""
+    if not values:
+        return None
+    vals = sorted(values)
+    k = max(ceil(p / 100.0 * len(vals)) - 1, 0)
+    return vals[min(k, len(vals) - 1)]
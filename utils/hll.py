@@ -0,0 +1,141 @@
+# utils/hll.py
+# HyperLogLog untuk counter "distinct user" di dashboard. Sketch per hari
+# (per collection + filter) di-cache per bulan di namespace "hll"; distinct
+# untuk rentang berapa pun = merge sketch harian (max per register), O(hari),
+# tanpa menarik seluruh array distinct() ke Python. Error relatif standar
+# ~1.04/sqrt(2^p): p=12 -> ~1.6%; untuk jumlah kecil (linear counting)
+# praktis eksak.
+import base64
+import hashlib
+import math
+import os
+import zlib
+from datetime import datetime, timedelta
+
+from config.mongo import settled_before
+from utils import cache, fanout
+
+HLL_PRECISION = int(os.getenv("HLL_PRECISION", "12"))
+# Bulan yang sudah lewat tidak berubah lagi -> cache jangka panjang
+HLL_CLOSED_TTL = float(os.getenv("HLL_CLOSED_TTL", str(400 * 86400)))
+HLL_BATCH_SIZE = 5000
+
+
+class HyperLogLog:
+    """Mergeable distinct-count sketch with 2^p one-byte registers."""
+    __slots__ = ("p", "registers")
+
+    def __init__(self, p: int = HLL_PRECISION, registers: bytearray = None):
+        if not 4 <= p <= 16:
+            raise ValueError("HyperLogLog precision must be between 4 and 16")
+        self.p = p
+        self.registers = registers if registers is not None else bytearray(1 << p)
+
+    def add(self, value):
+        # str(): ObjectId dan hex string-nya dihitung sebagai user yang sama
+        digest = hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest()
+        h = int.from_bytes(digest, "big")
+        bits = 64 - self.p
+        idx = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.p != self.p:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / math.fsum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction (linear counting); hash 64-bit tidak
+            # perlu koreksi large range
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def dumps(self) -> str:
+        """Compact string form for the JSON cache (register dump, zlib + base64)."""
+        return base64.b64encode(zlib.compress(bytes([self.p]) + bytes(self.registers))).decode("ascii")
+
+    @classmethod
+    def loads(cls, raw: str) -> "HyperLogLog":
+        data = zlib.decompress(base64.b64decode(raw))
+        return cls(data[0], bytearray(data[1:]))
+
+
+def _months(start: datetime, end: datetime):
+    """Calendar months [lo, hi) covering [start, end)."""
+    months = []
+    lo = datetime(start.year, start.month, 1)
+    while lo < end:
+        hi = datetime(lo.year + lo.month // 12, lo.month % 12 + 1, 1)
+        months.append((lo, hi))
+        lo = hi
+    return months
+
+
+def _day_sketches(col, match: dict, field: str, lo: datetime, hi: datetime) -> dict:
+    """{YYYY-MM-DD: dumped sketch} of the distinct non-null `field` per createdAt day in [lo, hi)."""
+    pipe = [
+        {"$match": {**match, "createdAt": {"$gte": lo, "$lt": hi}}},
+        # Satu dokumen per (hari, nilai), bukan per dokumen sumber
+        {"$group": {"_id": {
+            "d": {"$dateToString": {"format": "%Y-%m-%d", "date": "$createdAt"}},
+            "v": f"${field}",
+        }}},
+    ]
+    days = {}
+    for doc in col.aggregate(pipe, batchSize=HLL_BATCH_SIZE):
+        value = doc["_id"].get("v")
+        if value is not None:
+            days.setdefault(doc["_id"]["d"], HyperLogLog()).add(value)
+    return {day: sketch.dumps() for day, sketch in days.items()}
+
+
+def _cached_month(col, match: dict, field: str, lo: datetime, hi: datetime, settled: datetime) -> dict:
+    key = cache.make_key(col.name, field, match, lo, HLL_PRECISION)
+    # Bulan berjalan (atau yang baru lewat dan mungkin belum sampai di
+    # secondary, lihat settled_before) masih bisa bertambah -> TTL cache biasa
+    ttl = HLL_CLOSED_TTL if hi <= settled else None
+    return cache.get_or_set("hll", key, lambda: _day_sketches(col, match, field, lo, hi), ttl=ttl)
+
+
+def distinct_count(col, match: dict, field: str, start: datetime = None, end: datetime = None) -> int:
+    """Estimated number of distinct non-null `field` values among docs created in [start, end).
+
+    start=None starts at the oldest dated document, end=None runs through
+    today (UTC). Documents without a createdAt date are not counted.
+    PyMongoError (incl. the query budget) propagates to the caller.
+    """
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    if end is None:
+        end = today + timedelta(days=1)
+    if start is None:
+        first = col.find_one({**match, "createdAt": {"$type": "date"}}, {"createdAt": 1},
+                             sort=[("createdAt", 1)])
+        if first is None:
+            return 0
+        start = first["createdAt"]
+    start = datetime(start.year, start.month, start.day)
+    if start >= end:
+        return 0
+
+    # Sketch di-cache per bulan penuh (kunci tidak bergantung rentang query);
+    # hari di luar [start, end) dilewati saat merge
+    settled = settled_before()
+    with fanout.group() as fan:
+        month_fs = [fan.submit(_cached_month, col, match, field, lo, hi, settled)
+                    for lo, hi in _months(start, end)]
+
+    first_day, end_day = start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+    total = HyperLogLog()
+    for fut in month_fs:
+        for day, raw in fut.result().items():
+            if first_day <= day < end_day:
+                total.merge(HyperLogLog.loads(raw))
+    return total.count()
@@ -0,0 +1,396 @@
+# utils/live_tokens.py
+# Counter token hari ini (UTC) per agent dan per model untuk panel live di
+# halaman Tokens (/admin-klg/admin/tokens/live, Server-Sent Events).
+#
+# Satu watcher per worker, hanya jalan selama ada subscriber: seed sekali
+# dengan satu aggregate atas pesan hari ini (satu baris kecil per pesan, jadi
+# tokenCount tiap pesan yang sudah dihitung tercatat di "seen" dan update
+# berikutnya hanya menambah selisihnya), lalu change stream pada
+# collection messages meng-update counter per pesan baru (plus satu lookup
+# parent untuk input token) dan mem-push delta ke semua subscriber. Change
+# stream butuh replica set (single-node pun cukup); di standalone feed
+# melapor "unavailable" dan panel disembunyikan.
+#
+# Atribusi sama dengan rollup di service/tokens.py: output = tokenCount
+# pesan assistant, input = tokenCount parent kalau parent pesan user.
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pymongo import errors
+
+from config.mongo import get_db
+
+# Tiap stream memakai satu thread gthread selama terbuka
+LIVE_MAX_STREAMS = int(os.getenv("LIVE_MAX_STREAMS", "2"))
+# Stream ditutup berkala; EventSource reconnect sendiri dan dapat snapshot baru
+LIVE_STREAM_SECONDS = float(os.getenv("LIVE_STREAM_SECONDS", "300"))
+LIVE_HEARTBEAT_S = 15
+LIVE_IDLE_S = 30        # watcher berhenti setelah sekian detik tanpa subscriber
+LIVE_RETRY_S = 300      # jeda sebelum cek replica set lagi setelah "unavailable"
+AGENTS_RELOAD_S = 60
+_AWAIT_MS = 1000
+_QUEUE_SIZE = 256
+
+ASSISTANT_FLAGS = [False, "false", "False", 0]
+USER_FLAGS = (True, "true", "True", 1)
+_HISTORY_LOST = 286     # ChangeStreamHistoryLost: resume token sudah lewat oplog
+
+_PIPELINE = [
+    {"$match": {
+        "operationType": {"$in": ["insert", "update", "replace"]},
+        "fullDocument.isCreatedByUser": {"$in": ASSISTANT_FLAGS},
+    }},
+    {"$project": {
+        "operationType": 1,
+        "fullDocument.model": 1,
+        "fullDocument.createdAt": 1,
+        "fullDocument.tokenCount": 1,
+        "fullDocument.parentMessageId": 1,
+    }},
+]
+
+
+class LiveUnavailable(Exception):
+    """The live feed cannot serve this subscriber (no replica set, busy)."""
+
+
+class _Counter:
+    __slots__ = ("total_tokens", "input_tokens", "output_tokens", "total_messages")
+
+    def __init__(self):
+        self.total_tokens = self.input_tokens = self.output_tokens = self.total_messages = 0
+
+    def add(self, in_tokens, out_tokens, messages):
+        self.input_tokens += in_tokens
+        self.output_tokens += out_tokens
+        self.total_tokens += in_tokens + out_tokens
+        self.total_messages += messages
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+class _Subscriber:
+    __slots__ = ("queue",)
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=_QUEUE_SIZE)
+
+
+class _Feed:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subs = set()
+        self.thread = None
+        self.idle_since = time.monotonic()
+        self.logger = None
+        self.unavailable = None     # (reason, retry_at)
+        self._reset_day(None)
+        self.agents_map = {}
+        self.agent_names = {}
+        self.agents_loaded = 0.0
+
+    def _reset_day(self, day):
+        self.day = day
+        self.totals = _Counter()
+        self.agents = {}
+        self.models = {}
+        self.seen = {}              # _id pesan yang sudah dihitung (seed + stream) -> tokenCount
+
+    def snapshot(self):
+        return {
+            "date": self.day.isoformat() if self.day else None,
+            "totals": self.totals.as_dict(),
+            "agents": {k: c.as_dict() for k, c in self.agents.items()},
+            "models": {k: c.as_dict() for k, c in self.models.items()},
+        }
+
+
+_feed = _Feed()
+
+
+def _reset_after_fork():
+    # Thread watcher tidak ikut ter-fork; tiap worker mulai kosong
+    global _feed
+    _feed = _Feed()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _today():
+    return datetime.utcnow().date()
+
+
+def _int(value) -> int:
+    try:
+        return int(value or 0)
+    except (ValueError, TypeError):
+        return 0
+
+
+def _labels(feed, model):
+    """(agent_label, model_label) exactly as the daily rollup names them."""
+    agent_name = feed.agent_names.get(model)
+    return agent_name or "General", feed.agents_map.get(model, model or "Unknown Model")
+
+
+def _load_agents(feed, db):
+    agents_map, agent_names = {}, {}
+    for a in db["agents"].find({}, {"id": 1, "model": 1, "name": 1}):
+        if a.get("id"):
+            agents_map[a["id"]] = a.get("model")
+            agent_names[a["id"]] = a.get("name")
+    feed.agents_map, feed.agent_names = agents_map, agent_names
+    feed.agents_loaded = time.monotonic()
+
+
+def _broadcast(feed, name, data):
+    """Queue an event for every subscriber; a full queue drops that stream."""
+    for sub in list(feed.subs):
+        try:
+            sub.queue.put_nowait((name, data))
+        except queue.Full:
+            # Browser terlalu lambat: tutup stream, reconnect dapat snapshot baru
+            feed.subs.discard(sub)
+            with sub.queue.mutex:
+                sub.queue.queue.clear()
+            sub.queue.put_nowait(None)
+
+
+def _supports_change_streams(db) -> bool:
+    try:
+        hello = db.client.admin.command("hello")
+    except (errors.PyMongoError, NotImplementedError, TypeError):
+        return False
+    return bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+
+
+def _seed(feed, db):
+    """Rebuild today's counters with one aggregate; returns its operationTime."""
+    day = _today()
+    start = datetime(day.year, day.month, day.day)
+    pipeline = [
+        {"$match": {
+            "isCreatedByUser": {"$in": ASSISTANT_FLAGS},
+            "createdAt": {"$gte": start, "$lt": start + timedelta(days=1)},
+        }},
+        {"$lookup": {"from": "messages", "localField": "parentMessageId",
+                     "foreignField": "messageId", "as": "parent"}},
+        {"$project": {
+            "model": 1,
+            "tokenCount": 1,
+            "has_parent": {"$gt": [{"$size": "$parent"}, 0]},
+            "parent_user": {"$arrayElemAt": ["$parent.isCreatedByUser", 0]},
+            "parent_tokens": {"$arrayElemAt": ["$parent.tokenCount", 0]},
+        }},
+    ]
+    # operationTime dari session -> change stream mulai tepat setelah snapshot
+    with db.client.start_session() as session:
+        rows = list(db["messages"].aggregate(pipeline, session=session))
+        op_time = session.operation_time
+    _load_agents(feed, db)
+
+    with feed.lock:
+        feed._reset_day(day)
+        for row in rows:
+            agent_label, model_label = _labels(feed, row.get("model"))
+            out_tokens = _int(row.get("tokenCount"))
+            in_tokens = _int(row.get("parent_tokens")) if row.get("parent_user") in USER_FLAGS else 0
+            messages = 2 if row.get("has_parent") else 1
+            feed.seen[row["_id"]] = out_tokens
+            for c in (feed.totals,
+                      feed.agents.setdefault(agent_label, _Counter()),
+                      feed.models.setdefault(model_label, _Counter())):
+                c.add(in_tokens, out_tokens, messages)
+        _broadcast(feed, "snapshot", feed.snapshot())
+    if feed.logger:
+        feed.logger.info(f"[Live] Seeded {day} from {len(rows)} messages")
+    return op_time
+
+
+def _apply(feed, db, change):
+    """Fold one change event into the counters and push the delta."""
+    doc = change.get("fullDocument")
+    if not doc:
+        return
+    created = doc.get("createdAt")
+    if not isinstance(created, datetime) or created.date() != feed.day:
+        return
+    key = change["documentKey"]["_id"]
+    out_tokens = _int(doc.get("tokenCount"))
+
+    prev = feed.seen.get(key)
+    if prev is None:
+        # Belum pernah dihitung (seed mencatat semua pesan di snapshot-nya)
+        in_tokens, messages = 0, 1
+        parent_id = doc.get("parentMessageId")
+        if parent_id:
+            parent = db["messages"].find_one({"messageId": parent_id},
+                                             {"isCreatedByUser": 1, "tokenCount": 1})
+            if parent:
+                messages = 2
+                if parent.get("isCreatedByUser") in USER_FLAGS:
+                    in_tokens = _int(parent.get("tokenCount"))
+    elif out_tokens != prev:
+        # tokenCount ditulis ulang (mis. pesan di-finalize setelah streaming)
+        in_tokens, messages = 0, 0
+        out_tokens -= prev
+    else:
+        return
+
+    model = doc.get("model")
+    if model not in feed.agents_map and time.monotonic() - feed.agents_loaded > AGENTS_RELOAD_S:
+        _load_agents(feed, db)
+    agent_label, model_label = _labels(feed, model)
+
+    with feed.lock:
+        feed.seen[key] = (prev or 0) + out_tokens
+        for c in (feed.totals,
+                  feed.agents.setdefault(agent_label, _Counter()),
+                  feed.models.setdefault(model_label, _Counter())):
+            c.add(in_tokens, out_tokens, messages)
+        _broadcast(feed, "delta", {
+            "agent": agent_label,
+            "model": model_label,
+            "total_tokens": in_tokens + out_tokens,
+            "input_tokens": in_tokens,
+            "output_tokens": out_tokens,
+            "total_messages": messages,
+        })
+
+
+def _should_stop(feed) -> bool:
+    with feed.lock:
+        if feed.subs or time.monotonic() - feed.idle_since < LIVE_IDLE_S:
+            return False
+        feed.thread = None
+        feed._reset_day(None)
+        return True
+
+
+def _unavailable(feed, reason):
+    with feed.lock:
+        feed.unavailable = (reason, time.monotonic() + LIVE_RETRY_S)
+        feed.thread = None
+        feed._reset_day(None)
+        _broadcast(feed, "unavailable", {"reason": reason})
+        for sub in list(feed.subs):
+            try:
+                sub.queue.put_nowait(None)
+            except queue.Full:
+                pass
+        feed.subs.clear()
+    if feed.logger:
+        feed.logger.warning(f"[Live] {reason}")
+
+
+def _watch(feed):
+    resume = None
+    backoff = 2.0
+    checked = False
+    while not _should_stop(feed):
+        db = get_db()
+        if db is None:
+            time.sleep(backoff)
+            continue
+        if not checked:
+            if not _supports_change_streams(db):
+                _unavailable(feed, "Change streams need a replica set; MongoDB is running standalone")
+                return
+            checked = True
+        try:
+            start_at = None
+            if resume is None or feed.day != _today():
+                start_at = _seed(feed, db)
+                resume = None
+            with db["messages"].watch(_PIPELINE, full_document="updateLookup",
+                                      max_await_time_ms=_AWAIT_MS, resume_after=resume,
+                                      start_at_operation_time=start_at) as stream:
+                while True:
+                    change = stream.try_next()
+                    if change is not None:
+                        _apply(feed, db, change)
+                    resume = stream.resume_token
+                    if feed.day != _today():
+                        resume = None
+                        break
+                    if change is None and _should_stop(feed):
+                        return
+            backoff = 2.0
+        except errors.OperationFailure as e:
+            if e.code == _HISTORY_LOST:
+                resume = None
+            if feed.logger:
+                feed.logger.warning(f"[Live] Change stream error: {e}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+        except errors.PyMongoError as e:
+            if feed.logger:
+                feed.logger.warning(f"[Live] Change stream interrupted: {e}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+        except Exception as e:
+            if feed.logger:
+                feed.logger.error(f"[Live] Watcher error: {e}")
+            resume = None
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+
+def subscribe(logger=None) -> _Subscriber:
+    """Register a stream; starts this worker's watcher if it isn't running."""
+    feed = _feed
+    with feed.lock:
+        if feed.unavailable and time.monotonic() < feed.unavailable[1]:
+            raise LiveUnavailable(feed.unavailable[0])
+        if len(feed.subs) >= LIVE_MAX_STREAMS:
+            raise LiveUnavailable("Too many live streams on this worker")
+        feed.unavailable = None
+        feed.logger = logger or feed.logger
+        sub = _Subscriber()
+        feed.subs.add(sub)
+        if feed.day is not None:
+            sub.queue.put_nowait(("snapshot", feed.snapshot()))
+        if feed.thread is None or not feed.thread.is_alive():
+            feed.thread = threading.Thread(target=_watch, args=(feed,), name="live-tokens", daemon=True)
+            feed.thread.start()
+    return sub
+
+
+def unsubscribe(sub):
+    feed = _feed
+    with feed.lock:
+        feed.subs.discard(sub)
+        if not feed.subs:
+            feed.idle_since = time.monotonic()
+
+
+def _sse(name, data) -> str:
+    return f"event: {name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def stream(sub):
+    """SSE body for one subscriber: snapshot, deltas, heartbeats."""
+    deadline = time.monotonic() + LIVE_STREAM_SECONDS
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                event = sub.queue.get(timeout=min(LIVE_HEARTBEAT_S, remaining))
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            if event is None:
+                break
+            yield _sse(*event)
+    finally:
+        unsubscribe(sub)
@@ -0,0 +1,320 @@
+# utils/metrics.py
+# Metrics Prometheus (text format) tanpa dependency tambahan. Tiap worker
+# gunicorn menyimpan counter-nya in-process dan menulis snapshot JSON ke
+# METRICS_DIR; /metrics menjumlahkan snapshot semua worker. Snapshot worker
+# yang sudah mati digabung ke satu file retired.json lalu dihapus, jadi
+# direktori tidak terus bertambah dan total counter tetap monoton.
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+try:
+    import fcntl
+except ImportError:  # Windows (flask run, satu proses): tidak ada yang digabung
+    fcntl = None
+
+from pymongo import monitoring
+
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join("/tmp", "klg-metrics"))
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1"))
+RETIRED_FILE = "retired.json"
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+MONGO_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+_http = {}          # (endpoint, method) -> [bucket counts..., sum, count]
+_http_status = {}   # (endpoint, method, status) -> count
+_mongo = {}         # (collection, command) -> [bucket counts..., sum, count]
+_mongo_failed = {}  # (collection, command) -> count
+_inflight = [0]
+_last_flush = [0.0]
+
+
+def _reset_after_fork():
+    """Fresh lock and counters in each worker (preload_app forks the master)."""
+    global _lock
+    _lock = threading.Lock()
+    for table in (_http, _http_status, _mongo, _mongo_failed):
+        table.clear()
+    _inflight[0] = 0
+    _last_flush[0] = 0.0
+    command_listener._pending.clear()
+
+
+def _observe(table, key, buckets, value):
+    """Row layout: per-bucket counts (non-cumulative), then sum, then count."""
+    row = table.get(key)
+    if row is None:
+        row = table[key] = [0] * (len(buckets) + 2)
+    idx = bisect_left(buckets, value)
+    if idx < len(buckets):
+        row[idx] += 1
+    row[-2] += value
+    row[-1] += 1
+
+
+def request_started():
+    with _lock:
+        _inflight[0] += 1
+
+
+def request_finished(endpoint: str, method: str, status: int, seconds: float):
+    with _lock:
+        _inflight[0] -= 1
+        _observe(_http, (endpoint, method), HTTP_BUCKETS, seconds)
+        key = (endpoint, method, str(status))
+        _http_status[key] = _http_status.get(key, 0) + 1
+    if time.monotonic() - _last_flush[0] >= FLUSH_INTERVAL:
+        flush()
+
+
+def mongo_command(collection: str, command: str, seconds: float, failed: bool = False):
+    with _lock:
+        _observe(_mongo, (collection, command), MONGO_BUCKETS, seconds)
+        if failed:
+            key = (collection, command)
+            _mongo_failed[key] = _mongo_failed.get(key, 0) + 1
+
+
+def command_collection(command_name: str, command: dict) -> str:
+    """Best-effort collection name for a Mongo command document."""
+    if command_name == "getMore":
+        return str(command.get("collection", "-"))
+    target = command.get(command_name)
+    return target if isinstance(target, str) else "-"
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Feed Mongo command counts/durations per collection into the metrics."""
+
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        if len(self._pending) > 10000:
+            self._pending.clear()
+        self._pending[event.request_id] = command_collection(event.command_name, event.command)
+
+    def succeeded(self, event):
+        coll = self._pending.pop(event.request_id, "-")
+        mongo_command(coll, event.command_name, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        coll = self._pending.pop(event.request_id, "-")
+        mongo_command(coll, event.command_name, event.duration_micros / 1e6, failed=True)
+
+
+command_listener = CommandMetrics()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _snapshot() -> dict:
+    from utils import cache, throttle
+    with cache._stats_lock:
+        cache_stats = [list(k) + [v] for k, v in cache.stats.items()]
+    with _lock:
+        return {
+            "pid": os.getpid(),
+            "http": [list(k) + v for k, v in _http.items()],
+            "http_status": [list(k) + [v] for k, v in _http_status.items()],
+            "mongo": [list(k) + v for k, v in _mongo.items()],
+            "mongo_failed": [list(k) + [v] for k, v in _mongo_failed.items()],
+            "inflight": _inflight[0],
+            "login": dict(throttle.stats),
+            "cache": cache_stats,
+        }
+
+
+def flush():
+    """Write this worker's snapshot to METRICS_DIR (atomic replace)."""
+    _last_flush[0] = time.monotonic()
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"worker_{os.getpid()}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_snapshot(), f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _read_json(path: str):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# (field, jumlah label) dari baris counter di snapshot
+_ROW_FIELDS = (("http", 2), ("http_status", 3), ("mongo", 2), ("mongo_failed", 2), ("cache", 2))
+
+
+def _retire_dead_workers(names) -> set:
+    """Fold snapshots of dead worker pids into RETIRED_FILE, delete them, return their names.
+
+    Caller holds the metrics lock, so no other worker folds or reads the
+    same files meanwhile.
+    """
+    dead = set()
+    for name in names:
+        if not name.startswith("worker_"):
+            continue
+        pid = name[len("worker_"):].split(".", 1)[0]
+        if pid.isdigit() and int(pid) != os.getpid() and not _pid_alive(int(pid)):
+            dead.add(name)
+    if not dead:
+        return dead
+
+    retired_path = os.path.join(METRICS_DIR, RETIRED_FILE)
+    snaps = [_read_json(retired_path) or {}]
+    snaps += [snap for snap in (_read_json(os.path.join(METRICS_DIR, name))
+                                for name in sorted(dead) if name.endswith(".json")) if snap]
+    retired = {"pid": 0, "inflight": 0, "login": {}}
+    for field, nlabels in _ROW_FIELDS:
+        retired[field] = [list(k) + v for k, v in _merge_rows(snaps, field, nlabels).items()]
+    for snap in snaps:
+        for k, v in (snap.get("login") or {}).items():
+            retired["login"][k] = retired["login"].get(k, 0) + v
+    tmp = f"{retired_path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(retired, f)
+    os.replace(tmp, retired_path)
+    # Baru dihapus setelah retired.json tertulis: counter tidak pernah hilang
+    for name in dead:
+        try:
+            os.remove(os.path.join(METRICS_DIR, name))
+        except OSError:
+            pass
+    return dead
+
+
+def _read_snapshots() -> list:
+    names = os.listdir(METRICS_DIR)
+    if fcntl is not None:
+        dead = _retire_dead_workers(names)
+        if dead:
+            names = [n for n in names if n not in dead and n != RETIRED_FILE] + [RETIRED_FILE]
+    snaps = []
+    for name in names:
+        if (name.startswith("worker_") and name.endswith(".json")) or name == RETIRED_FILE:
+            snap = _read_json(os.path.join(METRICS_DIR, name))
+            if snap is not None:
+                snaps.append(snap)
+    return snaps
+
+
+def _load_snapshots() -> list:
+    flush()
+    try:
+        if fcntl is None:
+            snaps = _read_snapshots()
+        else:
+            with open(os.path.join(METRICS_DIR, "metrics.lock"), "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                snaps = _read_snapshots()
+    except OSError:
+        return [_snapshot()]
+    return snaps or [_snapshot()]
+
+
+def _merge_rows(snaps, field, nlabels):
+    merged = {}
+    for snap in snaps:
+        for row in snap.get(field, []):
+            key = tuple(row[:nlabels])
+            vals = row[nlabels:]
+            cur = merged.get(key)
+            merged[key] = vals if cur is None else [a + b for a, b in zip(cur, vals)]
+    return merged
+
+
+def _esc(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, le=None):
+    parts = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if le is not None:
+        parts.append(f'le="{le}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _histogram(out, name, help_text, names, rows, buckets):
+    out.append(f"# HELP {name} {help_text}")
+    out.append(f"# TYPE {name} histogram")
+    for key in sorted(rows):
+        vals = rows[key]
+        acc = 0
+        for le, n in zip(buckets, vals):
+            acc += n
+            out.append(f"{name}_bucket{_labels(names, key, le)} {acc}")
+        out.append(f"{name}_bucket{_labels(names, key, '+Inf')} {vals[-1]}")
+        out.append(f"{name}_sum{_labels(names, key)} {vals[-2]:.6f}")
+        out.append(f"{name}_count{_labels(names, key)} {vals[-1]}")
+
+
+def render() -> str:
+    """Prometheus text exposition aggregated over all workers, including retired ones."""
+    snaps = _load_snapshots()
+    out = []
+
+    _histogram(out, "klg_http_request_duration_seconds", "Request latency per Flask endpoint.",
+               ("endpoint", "method"), _merge_rows(snaps, "http", 2), HTTP_BUCKETS)
+
+    out.append("# HELP klg_http_requests_total Requests per endpoint and status code.")
+    out.append("# TYPE klg_http_requests_total counter")
+    for key, vals in sorted(_merge_rows(snaps, "http_status", 3).items()):
+        out.append(f"klg_http_requests_total{_labels(('endpoint', 'method', 'status'), key)} {vals[0]}")
+
+    # Gauge in-flight hanya dari worker yang masih hidup
+    inflight = sum(s.get("inflight", 0) for s in snaps if _pid_alive(int(s.get("pid", 0))))
+    out.append("# HELP klg_http_requests_in_flight Requests currently being served.")
+    out.append("# TYPE klg_http_requests_in_flight gauge")
+    out.append(f"klg_http_requests_in_flight {inflight}")
+
+    _histogram(out, "klg_mongo_command_duration_seconds", "MongoDB command latency per collection.",
+               ("collection", "command"), _merge_rows(snaps, "mongo", 2), MONGO_BUCKETS)
+
+    out.append("# HELP klg_mongo_command_failures_total Failed MongoDB commands per collection.")
+    out.append("# TYPE klg_mongo_command_failures_total counter")
+    for key, vals in sorted(_merge_rows(snaps, "mongo_failed", 2).items()):
+        out.append(f"klg_mongo_command_failures_total{_labels(('collection', 'command'), key)} {vals[0]}")
+
+    login = {}
+    for snap in snaps:
+        for k, v in (snap.get("login") or {}).items():
+            login[k] = login.get(k, 0) + v
+    out.append("# HELP klg_login_attempts_total Login attempts by throttle decision.")
+    out.append("# TYPE klg_login_attempts_total counter")
+    for result in ("allowed", "throttled"):
+        out.append(f'klg_login_attempts_total{{result="{result}"}} {login.get(result, 0)}')
+    out.append("# HELP klg_login_failures_total Failed login attempts.")
+    out.append("# TYPE klg_login_failures_total counter")
+    out.append(f"klg_login_failures_total {login.get('failures', 0)}")
+    out.append("# HELP klg_login_lockouts_total Lockouts applied by the login throttle.")
+    out.append("# TYPE klg_login_lockouts_total counter")
+    out.append(f"klg_login_lockouts_total {login.get('lockouts', 0)}")
+
+    out.append("# HELP klg_cache_requests_total Shared result cache lookups by namespace and result.")
+    out.append("# TYPE klg_cache_requests_total counter")
+    for key, vals in sorted(_merge_rows(snaps, "cache", 2).items()):
+        out.append(f"klg_cache_requests_total{_labels(('namespace', 'result'), key)} {vals[0]}")
+
+    return "\n".join(out) + "\n"
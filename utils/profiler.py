@@ -0,0 +1,133 @@
+# utils/profiler.py
+# Profiler on-demand untuk admin: request dengan ?_profile=1 (atau cookie
+# klg_profile=1) dijalankan di bawah cProfile + tracemalloc, hasilnya disimpan
+# sebagai .prof + .json di PROFILE_DIR (ring buffer PROFILE_KEEP file).
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join("/tmp", "klg-profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+PROFILE_COOKIE = "klg_profile"
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 15
+
+NAME_RE = re.compile(r"^[0-9]{8}-[0-9]{6}-[0-9]+-[A-Za-z0-9_.]+$")
+
+# Satu request di-profile sekaligus (tracemalloc bersifat global per proses)
+_busy = threading.Lock()
+
+
+def _reset_after_fork():
+    # Lock bisa sedang dipegang thread lain saat fork
+    global _busy
+    _busy = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def requested(req) -> bool:
+    return req.args.get("_profile") == "1" or req.cookies.get(PROFILE_COOKIE) == "1"
+
+
+def start():
+    """Begin profiling this request; None if another profile is running."""
+    if not _busy.acquire(blocking=False):
+        return None
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(10)
+    tracemalloc.reset_peak()
+    prof = cProfile.Profile()
+    prof.enable()
+    return {"prof": prof, "t0": time.perf_counter(), "tracing": started_tracing, "at": time.time()}
+
+
+def stop(state, endpoint: str, path: str, status=None) -> str:
+    """Stop profiling, write .prof/.json into the ring; returns the entry name."""
+    prof = state["prof"]
+    try:
+        prof.disable()
+        duration_ms = (time.perf_counter() - state["t0"]) * 1000
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        if state["tracing"]:
+            tracemalloc.stop()
+    finally:
+        _busy.release()
+
+    allocations = [
+        {"where": str(stat.traceback[0]), "size": stat.size, "count": stat.count}
+        for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+    ]
+
+    buf = io.StringIO()
+    stats = pstats.Stats(prof, stream=buf)
+    stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(state["at"]))
+    safe_endpoint = re.sub(r"[^A-Za-z0-9_.]", "_", endpoint or "unknown")
+    name = f"{stamp}-{os.getpid()}-{safe_endpoint}"
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    prof.dump_stats(os.path.join(PROFILE_DIR, f"{name}.prof"))
+    meta = {
+        "name": name,
+        "at": state["at"],
+        "endpoint": endpoint,
+        "path": path,
+        "status": status,
+        "duration_ms": duration_ms,
+        "mem_current": current,
+        "mem_peak": peak,
+        "functions": buf.getvalue(),
+        "allocations": allocations,
+    }
+    with open(os.path.join(PROFILE_DIR, f"{name}.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    _trim()
+    return name
+
+
+def _trim():
+    """Keep only the newest PROFILE_KEEP profiles."""
+    for name in [e["name"] for e in list_profiles()][PROFILE_KEEP:]:
+        for ext in (".prof", ".json"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, name + ext))
+            except OSError:
+                pass
+
+
+def list_profiles() -> list:
+    """Stored profiles, newest first."""
+    try:
+        names = [n[:-5] for n in os.listdir(PROFILE_DIR) if n.endswith(".json")]
+    except OSError:
+        return []
+    out = []
+    for name in names:
+        meta = load(name)
+        if meta:
+            meta.pop("functions", None)
+            out.append(meta)
+    out.sort(key=lambda m: m.get("at", 0), reverse=True)
+    return out
+
+
+def load(name: str):
+    if not NAME_RE.match(name or ""):
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, f"{name}.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,217 @@
+# utils/slowlog.py
+# Slow-query log: CommandListener yang mencatat command Mongo di atas
+# SLOW_QUERY_MS, dengan filter yang literalnya di-redact, endpoint Flask
+# asal, dan (opsional) explain("executionStats") untuk tiap shape baru.
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import pymongo
+from flask import has_request_context, request
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "false").lower() == "true"
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+MAX_SHAPES = 500
+
+TRACKED = {"find", "aggregate", "count", "distinct", "getMore", "update", "delete", "findAndModify"}
+EXPLAINABLE = {"find", "aggregate", "count", "distinct"}
+# Field internal driver yang tidak boleh ikut dikirim ulang di explain
+_DRIVER_FIELDS = {"lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "maxTimeMS", "$readConcern"}
+
+_lock = threading.Lock()
+_entries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+_shapes = {}  # shape key -> stats dict
+
+
+def redact(value):
+    """Replace literal values with '?' but keep keys, operators and $field paths."""
+    if isinstance(value, dict):
+        return {k: redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and not any(isinstance(v, (dict, list, tuple)) for v in value):
+            return ["?"]
+        return [redact(v) for v in value]
+    if isinstance(value, str) and value.startswith("$"):
+        return value
+    return "?"
+
+
+def command_shape(name: str, cmd: dict):
+    """Redacted, comparable shape of the query part of a command."""
+    if name == "find":
+        shape = {"filter": redact(cmd.get("filter") or {})}
+        if cmd.get("sort"):
+            shape["sort"] = list(cmd["sort"])
+        return shape
+    if name == "aggregate":
+        return {"pipeline": [redact(stage) for stage in cmd.get("pipeline") or []]}
+    if name == "count":
+        return {"query": redact(cmd.get("query") or {})}
+    if name == "distinct":
+        return {"key": cmd.get("key"), "query": redact(cmd.get("query") or {})}
+    if name in ("update", "delete"):
+        ops = cmd.get("updates" if name == "update" else "deletes") or [{}]
+        return {"q": redact(ops[0].get("q") or {}), "n": len(ops)}
+    if name == "findAndModify":
+        return {"query": redact(cmd.get("query") or {})}
+    return {}
+
+
+def _collection(name: str, cmd: dict) -> str:
+    if name == "getMore":
+        return str(cmd.get("collection", "-"))
+    target = cmd.get(name)
+    return target if isinstance(target, str) else "-"
+
+
+def _summarize_explain(res: dict) -> dict:
+    stats = res.get("executionStats") or {}
+    planner = res.get("queryPlanner") or {}
+    if not planner and res.get("stages"):
+        # aggregate: plan ada di stage $cursor pertama
+        first = (res["stages"][0] or {}).get("$cursor") or {}
+        planner = first.get("queryPlanner") or {}
+        stats = first.get("executionStats") or stats
+
+    stages = []
+    node = planner.get("winningPlan") or {}
+    node = node.get("queryPlan", node)
+    while node:
+        stage = node.get("stage")
+        if stage:
+            stages.append(stage + (f" {node['indexName']}" if node.get("indexName") else ""))
+        node = node.get("inputStage") or (node.get("inputStages") or [None])[0]
+
+    return {
+        "plan": " <- ".join(stages) or "-",
+        "collscan": any(s.startswith("COLLSCAN") for s in stages),
+        "n_returned": stats.get("nReturned"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "exec_ms": stats.get("executionTimeMillis"),
+    }
+
+
+def explain_command(client, dbname: str, cmd: dict) -> dict:
+    """explain("executionStats") of a captured command, summarised."""
+    body = {k: v for k, v in cmd.items() if k not in _DRIVER_FIELDS}
+    try:
+        with pymongo.timeout(10):
+            res = client[dbname].command({"explain": body, "verbosity": "executionStats"})
+        return _summarize_explain(res)
+    except PyMongoError as e:
+        return {"error": str(e)[:200]}
+
+
+def _run_explain(key: str, dbname: str, name: str, cmd: dict):
+    from config.mongo import get_db  # import di sini: config.mongo mengimpor modul ini
+    db = get_db()
+    if db is None:
+        return
+    summary = explain_command(db.client, dbname, cmd)
+    with _lock:
+        if key in _shapes:
+            _shapes[key]["explain"] = summary
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    """Record commands slower than SLOW_QUERY_MS."""
+
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        if event.command_name not in TRACKED:
+            return
+        if len(self._pending) > 10000:
+            self._pending.clear()
+        endpoint = request.endpoint if has_request_context() else None
+        self._pending[event.request_id] = (event.command, endpoint or "-")
+
+    def succeeded(self, event):
+        pending = self._pending.pop(event.request_id, None)
+        if pending is None:
+            return
+        ms = event.duration_micros / 1000.0
+        if ms < SLOW_QUERY_MS:
+            return
+        self._record(event, pending, ms)
+
+    def failed(self, event):
+        self._pending.pop(event.request_id, None)
+
+    def _record(self, event, pending, ms):
+        cmd, endpoint = pending
+        name = event.command_name
+        coll = _collection(name, cmd)
+        shape = command_shape(name, cmd)
+        key = f"{coll}.{name} {json.dumps(shape, sort_keys=True, default=str)}"
+        explain_new = False
+        with _lock:
+            _entries.append({
+                "at": time.time(),
+                "collection": coll,
+                "command": name,
+                "shape": key,
+                "ms": ms,
+                "endpoint": endpoint,
+            })
+            st = _shapes.get(key)
+            if st is None:
+                if len(_shapes) >= MAX_SHAPES:
+                    # buang shape dengan total waktu terkecil
+                    del _shapes[min(_shapes, key=lambda k: _shapes[k]["total_ms"])]
+                st = _shapes[key] = {
+                    "key": key, "collection": coll, "command": name,
+                    "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                    "endpoints": set(), "first_seen": time.time(), "explain": None,
+                }
+                explain_new = SLOW_QUERY_EXPLAIN and name in EXPLAINABLE
+            st["count"] += 1
+            st["total_ms"] += ms
+            st["max_ms"] = max(st["max_ms"], ms)
+            st["endpoints"].add(endpoint)
+            if explain_new:
+                st["explain"] = {"pending": True}
+        if explain_new:
+            threading.Thread(
+                target=_run_explain, args=(key, event.database_name, name, cmd),
+                name="slowlog-explain", daemon=True,
+            ).start()
+
+
+listener = SlowQueryListener()
+
+
+def _reset_after_fork():
+    global _lock
+    _lock = threading.Lock()
+    listener._pending.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def recent_entries(limit: int = 100) -> list:
+    with _lock:
+        return list(_entries)[-limit:][::-1]
+
+
+def shape_stats() -> list:
+    """Per-shape aggregates, slowest total first."""
+    with _lock:
+        rows = [dict(st, endpoints=sorted(st["endpoints"])) for st in _shapes.values()]
+    rows.sort(key=lambda r: r["total_ms"], reverse=True)
+    return rows
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _shapes.clear()
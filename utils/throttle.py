@@ -0,0 +1,121 @@
+# utils/throttle.py
+# Token-bucket throttling untuk form login. Bucket disimpan in-process (per
+# worker gunicorn); tiap attempt memakai token dari bucket IP dan username,
+# dan failure beruntun menambah lockout eksponensial.
+import os
+import threading
+import time
+
+IP_RATE_PER_MIN = float(os.getenv("LOGIN_IP_RATE_PER_MIN", "10"))
+IP_BURST = float(os.getenv("LOGIN_IP_BURST", "5"))
+USER_RATE_PER_MIN = float(os.getenv("LOGIN_USER_RATE_PER_MIN", "5"))
+USER_BURST = float(os.getenv("LOGIN_USER_BURST", "5"))
+LOCKOUT_AFTER = int(os.getenv("LOGIN_LOCKOUT_AFTER", "5"))
+LOCKOUT_BASE_S = float(os.getenv("LOGIN_LOCKOUT_BASE", "30"))
+LOCKOUT_MAX_S = float(os.getenv("LOGIN_LOCKOUT_MAX", "900"))
+LOCKOUT_MAX_EXPONENT = 32
+MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", "10000"))
+
+# Counter untuk /metrics
+stats = {"allowed": 0, "throttled": 0, "lockouts": 0, "failures": 0}
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "failures", "locked_until")
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+        self.failures = 0
+        self.locked_until = 0.0
+
+
+_buckets = {}
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _lock
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _get(key, burst, now):
+    b = _buckets.get(key)
+    if b is None:
+        if len(_buckets) >= MAX_KEYS:
+            _prune(now)
+        b = _buckets[key] = _Bucket(burst, now)
+    return b
+
+
+def _prune(now):
+    """Drop buckets that have no failures and no active lockout."""
+    for key in [k for k, b in _buckets.items() if b.locked_until <= now and b.failures == 0]:
+        del _buckets[key]
+    if len(_buckets) >= MAX_KEYS:
+        # Masih penuh (banyak key dengan failure) -> buang yang paling lama
+        oldest = sorted(_buckets, key=lambda k: _buckets[k].updated)[: len(_buckets) // 2]
+        for key in oldest:
+            del _buckets[key]
+
+
+def _refill(b, rate_per_min, burst, now):
+    """Refill without charging; returns seconds to wait (0 = a token is available)."""
+    if b.locked_until > now:
+        return b.locked_until - now
+    b.tokens = min(burst, b.tokens + (now - b.updated) * rate_per_min / 60.0)
+    b.updated = now
+    if b.tokens >= 1:
+        return 0.0
+    return (1 - b.tokens) * 60.0 / rate_per_min
+
+
+def check(ip: str, username: str) -> float:
+    """Charge one attempt; returns 0 if allowed, else seconds until retry.
+
+    Must be called before the password hash is computed.
+    """
+    now = time.monotonic()
+    with _lock:
+        ip_b = _get(("ip", ip), IP_BURST, now)
+        user_b = _get(("user", username), USER_BURST, now)
+        # Cek kedua bucket dulu, token baru diambil kalau keduanya lolos:
+        # flood dari IP yang sudah di-throttle tidak menghabiskan bucket
+        # username admin asli (dan sebaliknya)
+        wait = max(_refill(ip_b, IP_RATE_PER_MIN, IP_BURST, now),
+                   _refill(user_b, USER_RATE_PER_MIN, USER_BURST, now))
+        if not wait:
+            ip_b.tokens -= 1
+            user_b.tokens -= 1
+        stats["throttled" if wait else "allowed"] += 1
+        return wait
+
+
+def record_failure(ip: str, username: str):
+    """Count a failed login; lock the keys out exponentially after LOCKOUT_AFTER."""
+    now = time.monotonic()
+    with _lock:
+        stats["failures"] += 1
+        for key, burst in ((("ip", ip), IP_BURST), (("user", username), USER_BURST)):
+            b = _get(key, burst, now)
+            b.failures += 1
+            if b.failures >= LOCKOUT_AFTER:
+                # Eksponen dibatasi: 2.0 ** (>1023) -> OverflowError
+                exponent = min(b.failures - LOCKOUT_AFTER, LOCKOUT_MAX_EXPONENT)
+                delay = min(LOCKOUT_BASE_S * (2.0 ** exponent), LOCKOUT_MAX_S)
+                b.locked_until = now + delay
+                stats["lockouts"] += 1
+
+
+def record_success(ip: str, username: str):
+    """Reset failure counters after a successful login."""
+    with _lock:
+        for key in (("ip", ip), ("user", username)):
+            b = _buckets.get(key)
+            if b is not None:
+                b.failures = 0
+                b.locked_until = 0.0
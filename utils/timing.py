@@ -0,0 +1,143 @@
+# utils/timing.py
+# Breakdown waktu per request (mongo / compute / render) untuk header
+# Server-Timing. State disimpan di ContextVar supaya CommandListener (yang
+# jalan di thread yang mengeksekusi query) bisa menambah ke request yang benar.
+# Query fan-out berjalan bersamaan, jadi span "mongo" = gabungan (union)
+# interval waktu command, bukan jumlah durasinya; jumlahnya tetap dilaporkan
+# sebagai "mongo_cpu".
+import threading
+from contextvars import ContextVar
+from time import perf_counter
+
+from pymongo import monitoring
+
+_current = ContextVar("request_timing", default=None)
+
+
+class RequestTiming:
+    __slots__ = ("started", "mongo_s", "mongo_intervals", "mongo_calls", "docs", "render_s",
+                 "_render_t0", "_lock")
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.mongo_s = 0.0
+        self.mongo_intervals = []  # (start, end) perf_counter per command
+        self.mongo_calls = 0
+        self.docs = 0
+        self.render_s = 0.0
+        self._render_t0 = None
+        self._lock = threading.Lock()
+
+    def add_mongo(self, seconds: float, docs: int):
+        """Record one finished command (called right after it completes)."""
+        end = perf_counter()
+        with self._lock:
+            self.mongo_s += seconds
+            self.mongo_intervals.append((end - seconds, end))
+            self.mongo_calls += 1
+            self.docs += docs
+
+    def _mongo_wall(self) -> float:
+        """Seconds during which at least one command was running."""
+        with self._lock:
+            intervals = sorted(self.mongo_intervals)
+        wall = 0.0
+        lo = hi = None
+        for start, end in intervals:
+            if hi is None or start > hi:
+                if hi is not None:
+                    wall += hi - lo
+                lo, hi = start, end
+            elif end > hi:
+                hi = end
+        if hi is not None:
+            wall += hi - lo
+        return wall
+
+    def breakdown(self) -> dict:
+        """Milliseconds per span; compute is whatever is left of the total.
+
+        mongo is the wall time covered by commands (overlapping fan-out
+        queries count once); mongo_cpu is the sum of their durations.
+        """
+        total = (perf_counter() - self.started) * 1000
+        mongo = self._mongo_wall() * 1000
+        render = self.render_s * 1000
+        return {
+            "total": total,
+            "mongo": mongo,
+            "mongo_cpu": self.mongo_s * 1000,
+            "render": render,
+            "compute": max(total - mongo - render, 0.0),
+            "round_trips": self.mongo_calls,
+            "docs": self.docs,
+        }
+
+
+def begin():
+    """Start timing the current request; returns the ContextVar token."""
+    return _current.set(RequestTiming())
+
+
+def end(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def render_started(*args, **kwargs):
+    t = _current.get()
+    if t is not None:
+        t._render_t0 = perf_counter()
+
+
+def render_finished(*args, **kwargs):
+    t = _current.get()
+    if t is not None and t._render_t0 is not None:
+        t.render_s += perf_counter() - t._render_t0
+        t._render_t0 = None
+
+
+def server_timing_header(b: dict) -> str:
+    return ", ".join([
+        f'mongo;dur={b["mongo"]:.1f};desc="Mongo ({b["round_trips"]} round trips, {b["docs"]} docs)"',
+        f'mongo_cpu;dur={b["mongo_cpu"]:.1f};desc="Mongo summed over concurrent queries"',
+        f'compute;dur={b["compute"]:.1f};desc="Python"',
+        f'render;dur={b["render"]:.1f};desc="Jinja"',
+        f'total;dur={b["total"]:.1f}',
+    ])
+
+
+def _reply_docs(command_name: str, reply) -> int:
+    if not isinstance(reply, dict):
+        return 0
+    cursor = reply.get("cursor")
+    if isinstance(cursor, dict):
+        return len(cursor.get("firstBatch") or cursor.get("nextBatch") or [])
+    if command_name == "distinct":
+        return len(reply.get("values") or [])
+    if command_name == "count":
+        return 1
+    return 0
+
+
+class CommandTiming(monitoring.CommandListener):
+    """Attribute Mongo round trips and documents to the current request."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        t = _current.get()
+        if t is not None:
+            t.add_mongo(event.duration_micros / 1e6, _reply_docs(event.command_name, event.reply))
+
+    def failed(self, event):
+        t = _current.get()
+        if t is not None:
+            t.add_mongo(event.duration_micros / 1e6, 0)
+
+
+command_listener = CommandTiming()